@@ -0,0 +1,50 @@
+"""
+Backfill message_count on support conversations
+Run this once: python backfill_message_counts.py
+
+Each turn increments message_count as it commits (customer, AI and agent
+messages; system notices are not counted); this recounts it for conversations
+created before it was maintained. Run it while widget traffic is quiet: a turn
+committed during the recount can be overwritten by the stale total.
+"""
+import asyncio
+from pymongo import UpdateOne
+from middleware.database import db
+
+BATCH_SIZE = 1000
+COUNTED_AUTHOR_TYPES = ["customer", "ai", "agent"]
+
+
+async def backfill_message_counts():
+    writes = []
+    conversations = 0
+
+    # One pass over all counted messages, grouped by conversation
+    cursor = db.messages.aggregate([
+        {"$match": {"author_type": {"$in": COUNTED_AUTHOR_TYPES}}},
+        {"$group": {"_id": "$conversation_id", "message_count": {"$sum": 1}}}
+    ], allowDiskUse=True)
+
+    async for row in cursor:
+        writes.append(UpdateOne(
+            {"id": row["_id"]},
+            {"$set": {"message_count": row["message_count"]}}
+        ))
+        conversations += 1
+        if len(writes) >= BATCH_SIZE:
+            await db.conversations.bulk_write(writes, ordered=False)
+            writes = []
+    if writes:
+        await db.conversations.bulk_write(writes, ordered=False)
+
+    # Conversations without any counted messages
+    empty = await db.conversations.update_many(
+        {"message_count": {"$exists": False}},
+        {"$set": {"message_count": 0}}
+    )
+
+    print(f"✅ Backfilled message counts for {conversations} conversations")
+    print(f"  • Set {empty.modified_count} empty conversations to 0")
+
+if __name__ == "__main__":
+    asyncio.run(backfill_message_counts())
@@ -0,0 +1,51 @@
+"""
+Backfill thread summaries (reply_count, last_reply_at) on messaging messages
+Run this once: python backfill_reply_counts.py
+
+New replies keep these fields up to date; this recomputes them for messages
+created before they were maintained.
+"""
+import asyncio
+from pymongo import UpdateOne
+from middleware.database import db
+
+BATCH_SIZE = 1000
+
+
+async def backfill_reply_counts():
+    writes = []
+    threads = 0
+
+    # One pass over all replies, grouped by parent
+    cursor = db.messaging_messages.aggregate([
+        {"$match": {"parent_id": {"$ne": None}}},
+        {"$group": {
+            "_id": "$parent_id",
+            "reply_count": {"$sum": 1},
+            "last_reply_at": {"$max": "$created_at"}
+        }}
+    ], allowDiskUse=True)
+
+    async for row in cursor:
+        writes.append(UpdateOne(
+            {"id": row["_id"]},
+            {"$set": {"reply_count": row["reply_count"], "last_reply_at": row["last_reply_at"]}}
+        ))
+        threads += 1
+        if len(writes) >= BATCH_SIZE:
+            await db.messaging_messages.bulk_write(writes, ordered=False)
+            writes = []
+    if writes:
+        await db.messaging_messages.bulk_write(writes, ordered=False)
+
+    # Stale counts on messages whose replies were all deleted
+    reset = await db.messaging_messages.update_many(
+        {"parent_id": None, "reply_count": {"$gt": 0}, "last_reply_at": {"$exists": False}},
+        {"$set": {"reply_count": 0, "last_reply_at": None}}
+    )
+
+    print(f"✅ Backfilled reply counts for {threads} threads")
+    print(f"  • Reset {reset.modified_count} stale reply counts")
+
+if __name__ == "__main__":
+    asyncio.run(backfill_reply_counts())
@@ -0,0 +1,37 @@
+"""
+Backfill the search index for messaging, tickets, CRM customers and company KB
+Run this once: python backfill_search_index.py
+
+Documents are indexed as they are written; this builds entries for documents
+created before search went through the index (safe to re-run).
+"""
+import asyncio
+from pymongo import ReplaceOne
+from middleware.database import db
+from services.search_service import search_service, SCOPES
+
+BATCH_SIZE = 1000
+
+
+async def backfill_search_index():
+    for scope, config in SCOPES.items():
+        writes = []
+        indexed = 0
+
+        cursor = db[config["collection"]].find({}, {"_id": 0})
+        async for document in cursor:
+            if not document.get("id"):
+                continue
+            entry = search_service.build_entry(scope, document)
+            writes.append(ReplaceOne({"scope": scope, "doc_id": entry["doc_id"]}, entry, upsert=True))
+            indexed += 1
+            if len(writes) >= BATCH_SIZE:
+                await db.search_index.bulk_write(writes, ordered=False)
+                writes = []
+        if writes:
+            await db.search_index.bulk_write(writes, ordered=False)
+
+        print(f"✅ Indexed {indexed} {scope}")
+
+if __name__ == "__main__":
+    asyncio.run(backfill_search_index())
@@ -0,0 +1,34 @@
+"""
+Backfill unread counters (unread_count on messaging_read_status)
+Run this once: python backfill_unread_counters.py
+
+New messages and reads keep the counters up to date and the reconciliation
+job repairs drift a slice at a time; this recounts every channel and DM at once
+for data created before the counters were maintained (safe to re-run).
+"""
+import asyncio
+from middleware.database import db
+from services.unread_counters import unread_counters
+
+
+async def backfill_unread_counters():
+    targets = [
+        ("channel_id", db.messaging_channels, "members", "channels"),
+        ("dm_conversation_id", db.messaging_dm_conversations, "participants", "DMs"),
+    ]
+    for field, collection, participants_field, label in targets:
+        stats = {"targets": 0, "counters": 0, "repaired": 0}
+
+        cursor = collection.find({}, {"_id": 0, "id": 1, "tenant_id": 1, participants_field: 1})
+        async for target in cursor:
+            if not target.get("id"):
+                continue
+            await unread_counters.reconcile_target(
+                field, target, target.get(participants_field, []), collection, stats
+            )
+
+        print(f"✅ Backfilled unread counters for {stats['targets']} {label}")
+        print(f"  • Set {stats['repaired']} of {stats['counters']} counters")
+
+if __name__ == "__main__":
+    asyncio.run(backfill_unread_counters())
@@ -28,10 +28,12 @@ INDEXES = {
         {"keys": [("tenant_id", 1), ("status", 1)]},
         {"keys": [("tenant_id", 1), ("created_at", -1)]},
         {"keys": [("customer_email", 1)]},
+        {"keys": [("last_message_at", -1)]},  # Sentiment pipeline change scan
     ],
     "messages": [
         {"keys": [("conversation_id", 1)]},
         {"keys": [("conversation_id", 1), ("created_at", 1)]},
+        {"keys": [("conversation_id", 1), ("created_at", -1), ("id", -1)]},  # Keyset pages of history
     ],
     "user_agents": [
         {"keys": [("id", 1)], "unique": True},
@@ -99,6 +101,68 @@ INDEXES = {
     "quota_alerts": [
         {"keys": [("tenant_id", 1), ("feature_key", 1), ("alert_type", 1)]},
     ],
+    "sentiment_usage": [
+        {"keys": [("tenant_id", 1), ("date", 1)], "unique": True},
+    ],
+    "pipeline_leases": [
+        {"keys": [("id", 1)], "unique": True},
+    ],
+    "reply_suggestions": [
+        {"keys": [("conversation_id", 1)], "unique": True},
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},  # TTL index
+    ],
+    "messaging_read_status": [
+        {"keys": [("user_id", 1), ("unread_count", 1)]},  # Unread counters per user
+        {"keys": [("user_id", 1), ("channel_id", 1)]},
+        {"keys": [("user_id", 1), ("dm_conversation_id", 1)]},
+        {"keys": [("channel_id", 1)]},
+        {"keys": [("dm_conversation_id", 1)]},
+    ],
+    "messaging_messages": [
+        # Keyset pages of channel, DM and thread history; also last message per
+        # channel/DM and thread summaries (every such query filters on tenant_id)
+        {"keys": [("tenant_id", 1), ("channel_id", 1), ("parent_id", 1), ("created_at", -1), ("id", -1)]},
+        {"keys": [("tenant_id", 1), ("dm_conversation_id", 1), ("parent_id", 1), ("created_at", -1), ("id", -1)]},
+        {"keys": [("tenant_id", 1), ("parent_id", 1), ("created_at", -1), ("id", -1)]},
+        {"keys": [("channel_id", 1), ("created_at", -1)]},
+        {"keys": [("dm_conversation_id", 1), ("created_at", -1)]},
+    ],
+    "messaging_channels": [
+        {"keys": [("tenant_id", 1)]},
+        {"keys": [("unread_reconciled_at", 1)]},
+    ],
+    "messaging_dm_conversations": [
+        {"keys": [("unread_reconciled_at", 1)]},
+    ],
+    "messaging_presence": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("tenant_id", 1), ("expires_at", 1)]},
+        {"keys": [("user_id", 1), ("expires_at", 1)]},
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 300},  # Backstop; sweeps run sooner
+    ],
+    "realtime_events": [
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},  # TTL index
+    ],
+    "search_index": [
+        {"keys": [("scope", 1), ("doc_id", 1)], "unique": True},
+        {"keys": [("tenant_id", 1), ("scope", 1), ("terms", 1)]},  # Prefix range scans per tenant
+        {"keys": [("scope", 1), ("channel_id", 1)]},
+        {"keys": [("scope", 1), ("parent_id", 1)]},
+    ],
+    "llm_usage": [
+        {"keys": [("bucket", 1), ("tenant_id", 1), ("agent_id", 1), ("provider", 1), ("model", 1), ("feature", 1)], "unique": True},
+        {"keys": [("tenant_id", 1), ("bucket", 1)]},
+        {"keys": [("bucket", 1)]},
+    ],
+}
+
+# Indexes superseded by the ones above; dropped where an older deploy created them
+DROPPED_INDEXES = {
+    "messaging_messages": [
+        "channel_id_1_parent_id_1_created_at_-1",
+        "dm_conversation_id_1_parent_id_1_created_at_-1",
+        "parent_id_1_created_at_-1",
+    ],
 }
 
 
@@ -125,6 +189,17 @@ async def create_indexes(db):
                 else:
                     logger.warning(f"Failed to create index on {collection_name}: {e}")
     
+    for collection_name, index_names in DROPPED_INDEXES.items():
+        collection = db[collection_name]
+        existing_indexes = await collection.index_information()
+        for index_name in index_names:
+            if index_name in existing_indexes:
+                try:
+                    await collection.drop_index(index_name)
+                    logger.info(f"Dropped index '{index_name}' on {collection_name}")
+                except Exception as e:
+                    logger.warning(f"Failed to drop index '{index_name}' on {collection_name}: {e}")
+    
     logger.info("Index creation complete!")
 
 
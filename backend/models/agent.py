@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 class AgentCreate(BaseModel):
     name: str
@@ -9,6 +9,10 @@ class AgentCreate(BaseModel):
     temperature: float = 0.7
     max_tokens: int = 2000
     is_marketplace: bool = False
+    fallback_chain: List[Dict[str, str]] = []  # [{provider_id, model}] tried in order after the primary
+    hedge_requests: bool = False
+    latency_budget_ms: Optional[int] = None  # Router default when unset
+    hedge_delay_ms: Optional[int] = None  # Used until the provider has enough latency samples
 
 class AgentUpdate(BaseModel):
     name: Optional[str] = None
@@ -18,6 +22,10 @@ class AgentUpdate(BaseModel):
     max_tokens: Optional[int] = None
     is_active: Optional[bool] = None
     is_marketplace: Optional[bool] = None
+    fallback_chain: Optional[List[Dict[str, str]]] = None
+    hedge_requests: Optional[bool] = None
+    latency_budget_ms: Optional[int] = None
+    hedge_delay_ms: Optional[int] = None
 
 class AgentResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -33,6 +41,10 @@ class AgentResponse(BaseModel):
     version: int
     is_active: bool
     is_marketplace: bool
+    fallback_chain: List[Dict[str, str]] = []
+    hedge_requests: bool = False
+    latency_budget_ms: Optional[int] = None  # Router default when unset
+    hedge_delay_ms: Optional[int] = None  # Used until the provider has enough latency samples
     created_at: str
     updated_at: str
 
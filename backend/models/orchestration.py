@@ -63,8 +63,9 @@ class OrchestrationRunResponse(BaseModel):
     mother_admin_agent_id: str
     user_prompt: str
     requested_actions: List[Dict[str, Any]] = []
-    executed_actions: List[Dict[str, Any]] = []
+    executed_actions: List[Dict[str, Any]] = []  # Each with status, started_at, duration_ms
     final_response: Optional[str] = None
+    timings: Dict[str, Any] = {}  # llm_calls_ms, children_rounds_ms, total_ms
     status: str = "pending"  # pending, processing, completed, failed
     created_at: str
     completed_at: Optional[str] = None
@@ -1,17 +1,19 @@
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Dict, Any
 
 class ProviderCreate(BaseModel):
     name: str
     type: Literal["openai", "anthropic", "google"]
     api_key: str
     base_url: Optional[str] = None
+    rate_limits: Optional[Dict[str, Any]] = None  # {rpm, tpm, max_concurrency, models: {model: {...}}}
 
 class ProviderUpdate(BaseModel):
     name: Optional[str] = None
     api_key: Optional[str] = None
     base_url: Optional[str] = None
     is_active: Optional[bool] = None
+    rate_limits: Optional[Dict[str, Any]] = None
 
 class ProviderResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -25,6 +27,7 @@ class ProviderResponse(BaseModel):
     total_cost: float
     last_error: Optional[str] = None
     models: List[str] = []
+    rate_limits: Optional[Dict[str, Any]] = None
     created_at: str
     updated_at: str
 
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, Literal
+from typing import Optional, Literal, Dict, List
 
 class SettingsUpdate(BaseModel):
     brand_name: Optional[str] = None
@@ -15,6 +15,7 @@ class SettingsUpdate(BaseModel):
     date_format: Optional[str] = None
     time_format: Optional[Literal["12h", "24h"]] = None
     timezone: Optional[str] = None
+    intent_phrases: Optional[Dict[str, List[str]]] = None  # Extra phrases per intent, e.g. {"human_request": [...]}
 
 class SettingsResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -33,4 +34,5 @@ class SettingsResponse(BaseModel):
     date_format: str
     time_format: str
     timezone: str
+    intent_phrases: Optional[Dict[str, List[str]]] = None
     updated_at: str
@@ -69,6 +69,33 @@ async def get_platform_stats(admin_user: dict = Depends(get_super_admin_user)):
         "tenants": tenant_stats
     }
 
+@router.get("/llm-usage")
+async def get_llm_usage(
+    group_by: Literal["tenant", "agent", "model", "feature"] = "tenant",
+    days: int = 7,
+    tenant_id: Optional[str] = None,
+    limit: int = 50,
+    admin_user: dict = Depends(get_super_admin_user)
+):
+    """Get LLM token, cost and latency rollups (super admin only)"""
+    from services.llm_usage import llm_usage
+    
+    if days < 1 or days > 90:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 90")
+    rows = await llm_usage.get_rollup(
+        group_by=group_by,
+        days=days,
+        tenant_id=tenant_id,
+        limit=max(1, min(limit, 500))
+    )
+    return {
+        "group_by": group_by,
+        "days": days,
+        "rows": rows,
+        "total_cost_usd": round(sum(row["cost_usd"] for row in rows), 4),
+        "total_tokens": sum(row["total_tokens"] for row in rows)
+    }
+
 @router.get("/platform-settings")
 async def get_platform_settings(admin_user: dict = Depends(get_super_admin_user)):
     """Get platform settings (super admin only)"""
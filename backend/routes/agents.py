@@ -886,9 +886,10 @@ async def test_woocommerce_connection(
         
         # Create client and test
         wc_service = WooCommerceService(store_url, consumer_key, consumer_secret)
-        result = await wc_service.test_connection()
-        
-        return result
+        try:
+            return await wc_service.test_connection()
+        finally:
+            await wc_service.aclose()
     except Exception as e:
         logger.error(f"WooCommerce test failed: {str(e)}")
         return {
@@ -918,8 +919,10 @@ async def test_woocommerce_direct(
             request.consumer_key,
             request.consumer_secret
         )
-        result = await wc_service.test_connection()
-        return result
+        try:
+            return await wc_service.test_connection()
+        finally:
+            await wc_service.aclose()
     except Exception as e:
         logger.error(f"WooCommerce test failed: {str(e)}")
         return {
@@ -949,8 +952,10 @@ async def test_shopify_direct(
             request.store_domain,
             request.access_token
         )
-        result = await shopify_service.test_connection()
-        return result
+        try:
+            return await shopify_service.test_connection()
+        finally:
+            await shopify_service.aclose()
     except Exception as e:
         logger.error(f"Shopify test failed: {str(e)}")
         return {
@@ -13,6 +13,7 @@ import re
 import sys
 sys.path.append('/app/backend')
 from server import db, get_current_user
+from services.search_service import search_service
 
 router = APIRouter(prefix="/company-kb", tags=["company-knowledge-base"])
 
@@ -100,11 +101,7 @@ async def get_company_kb_articles(
     if folder:
         query["folder_path"] = {"$regex": f"^{folder}"}
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"content": {"$regex": search, "$options": "i"}},
-            {"tags": {"$regex": search, "$options": "i"}}
-        ]
+        query["id"] = {"$in": await search_service.match_ids(tenant_id, "kb", search)}
     
     articles = await db.company_knowledge_base.find(
         query,
@@ -130,18 +127,21 @@ async def get_kb_articles_for_agents(
         "available_for_agents": True
     }
     
+    ranked_ids = None
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"content": {"$regex": search, "$options": "i"}},
-            {"tags": {"$regex": search, "$options": "i"}}
-        ]
+        ranked_ids = await search_service.match_ids(tenant_id, "kb", search)
+        query["id"] = {"$in": ranked_ids}
     
     articles = await db.company_knowledge_base.find(
         query,
         {"_id": 0, "id": 1, "name": 1, "slug": 1, "content": 1, "blocks": 1, "category": 1, "tags": 1}
     ).to_list(100)
     
+    # Best matches first
+    if ranked_ids:
+        rank = {article_id: i for i, article_id in enumerate(ranked_ids)}
+        articles.sort(key=lambda a: rank.get(a["id"], len(rank)))
+    
     return articles
 
 
@@ -214,6 +214,7 @@ async def create_company_kb_article(
     }
     
     await db.company_knowledge_base.insert_one(new_article)
+    await search_service.index_document("kb", new_article)
     
     # Remove MongoDB _id before returning
     new_article.pop("_id", None)
@@ -265,6 +266,7 @@ async def update_company_kb_article(
         {"tenant_id": tenant_id, "slug": article.slug or slug},
         {"_id": 0}
     )
+    await search_service.index_document("kb", updated)
     
     return updated
 
@@ -282,14 +284,16 @@ async def delete_company_kb_article(
     if not check_kb_permission(current_user):
         raise HTTPException(status_code=403, detail="You don't have permission to delete KB articles")
     
-    result = await db.company_knowledge_base.delete_one({
-        "tenant_id": tenant_id,
-        "slug": slug
-    })
+    deleted = await db.company_knowledge_base.find_one_and_delete(
+        {"tenant_id": tenant_id, "slug": slug},
+        {"_id": 0, "id": 1}
+    )
     
-    if result.deleted_count == 0:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Article not found")
     
+    await search_service.remove("kb", [deleted["id"]])
+    
     return {"message": "Article deleted successfully"}
 
 
@@ -1,18 +1,19 @@
 """
 Conversations routes
 """
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, BackgroundTasks, Query
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, BackgroundTasks, Query, Response
 from pydantic import BaseModel, EmailStr, ConfigDict
 from typing import List, Optional, Literal, Dict, Any
 from datetime import datetime, timezone, timedelta
 import uuid
 import jwt
-import os
 
 from models import ConversationResponse, MessageCreate, MessageResponse
 from middleware import get_current_user, get_super_admin_user, get_admin_or_owner_user
 from middleware.database import db
 from middleware.auth import create_token, hash_password, verify_password, is_super_admin, JWT_SECRET, JWT_ALGORITHM
+from services.conversation_turns import ConversationTurn
+from utils.pagination import newer_than, older_than, page
 
 router = APIRouter(prefix="/conversations", tags=["conversations"])
 
@@ -165,7 +166,20 @@ async def get_conversation(conversation_id: str, current_user: dict = Depends(ge
     return conversation
 
 @router.get("/{conversation_id}/messages", response_model=List[MessageResponse])
-async def get_conversation_messages(conversation_id: str, current_user: dict = Depends(get_current_user)):
+async def get_conversation_messages(
+    conversation_id: str,
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Newest page of messages in chronological order; older pages via the X-Next-Cursor header
+
+    With ``after`` (a message id) only messages newer than that message are
+    returned, oldest first, so a client polling for new messages keeps the
+    pages it already loaded.
+    """
     tenant_id = current_user.get("tenant_id")
     if not tenant_id:
         raise HTTPException(status_code=404, detail="No tenant associated")
@@ -177,10 +191,32 @@ async def get_conversation_messages(conversation_id: str, current_user: dict = D
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
+    query = {"conversation_id": conversation_id}
+    if after:
+        anchor = await db.messages.find_one(
+            {"id": after, "conversation_id": conversation_id}, {"_id": 0, "created_at": 1, "id": 1}
+        )
+        if anchor:
+            query.update(newer_than(anchor["created_at"], anchor["id"]))
+            return await db.messages.find(
+                query, {"_id": 0}
+            ).sort([("created_at", 1), ("id", 1)]).limit(limit).to_list(limit)
+        # Unknown message id: answer with the newest page
+    elif cursor:
+        try:
+            query.update(older_than(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # One extra row tells whether another page exists
     messages = await db.messages.find(
-        {"conversation_id": conversation_id}, {"_id": 0}
-    ).sort("created_at", 1).to_list(1000)
+        query, {"_id": 0}
+    ).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    messages, next_cursor = page(messages, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
+    messages.reverse()  # Chronological order
     return messages
 
 @router.get("/{conversation_id}/sentiment")
@@ -210,151 +246,36 @@ async def analyze_conversation_sentiment(
     conversation_id: str,
     current_user: dict = Depends(get_current_user)
 ):
-    """Analyze conversation sentiment and update engagement/tone scores"""
+    """Request (re)scoring of a conversation's sentiment
+    
+    Scoring runs in the batched background pipeline (services/sentiment_pipeline.py);
+    this marks the conversation as priority and returns the current scores.
+    """
     tenant_id = current_user.get("tenant_id")
     if not tenant_id:
         raise HTTPException(status_code=404, detail="No tenant associated")
     
     conversation = await db.conversations.find_one(
-        {"id": conversation_id, "tenant_id": tenant_id}, {"_id": 0}
+        {"id": conversation_id, "tenant_id": tenant_id},
+        {"_id": 0, "engagement_score": 1, "tone_score": 1, "sentiment_analyzed_at": 1,
+         "last_message_at": 1, "sentiment_watermark": 1}
     )
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Get recent messages
-    messages = await db.messages.find(
-        {"conversation_id": conversation_id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(15).to_list(15)
-    messages.reverse()
-    
-    if not messages:
-        return {"engagement": 5, "tone": 0}
-    
-    # Get agent config for AI provider
-    agent_config = await db.company_agent_configs.find_one({"tenant_id": tenant_id}, {"_id": 0})
-    agent = None
-    if agent_config and agent_config.get("selected_agent_id"):
-        agent = await db.agents.find_one({"id": agent_config["selected_agent_id"]}, {"_id": 0})
-    
-    # Analyze sentiment
-    try:
-        result = await analyze_sentiment(messages, agent)
-        
-        # Update conversation with new scores
-        now = datetime.now(timezone.utc).isoformat()
+    is_stale = (conversation.get("last_message_at") or "") > (conversation.get("sentiment_watermark") or "")
+    if is_stale:
         await db.conversations.update_one(
             {"id": conversation_id},
-            {
-                "$set": {
-                    "engagement_score": result["engagement"],
-                    "tone_score": result["tone"],
-                    "sentiment_analyzed_at": now
-                }
-            }
+            {"$set": {"sentiment_requested_at": datetime.now(timezone.utc).isoformat()}}
         )
-        
-        return result
-    except Exception as e:
-        print(f"Error analyzing sentiment: {e}")
-        return {"engagement": 5, "tone": 0}
-
-async def analyze_sentiment(messages: list, agent: dict = None) -> dict:
-    """Analyze conversation sentiment using AI"""
-    
-    # Build conversation text for analysis
-    conversation_text = ""
-    customer_messages = []
-    for msg in messages:
-        role = "Customer" if msg.get("author_type") == "customer" else "Agent"
-        content = msg.get("content", "")
-        conversation_text += f"{role}: {content}\n"
-        if msg.get("author_type") == "customer":
-            customer_messages.append(content)
-    
-    if not customer_messages:
-        return {"engagement": 5, "tone": 0}
-    
-    system_prompt = """You are an expert conversation analyst. Analyze the following customer support conversation and provide two metrics:
-
-1. ENGAGEMENT (1-10): How engaged is the customer in this conversation?
-   - 1-3: Disengaged (short responses, seems distracted, delayed responses)
-   - 4-6: Moderately engaged (normal conversation flow)
-   - 7-10: Highly engaged (detailed responses, asking questions, showing interest)
-
-2. TONE (-100 to 100): What is the emotional tone of the customer?
-   - -100 to -50: Very negative (angry, frustrated, threatening)
-   - -50 to -20: Negative (disappointed, annoyed, unhappy)
-   - -20 to 20: Neutral
-   - 20 to 50: Positive (satisfied, pleased)
-   - 50 to 100: Very positive (happy, grateful, enthusiastic)
-
-Respond ONLY with a JSON object in this exact format:
-{"engagement": <number 1-10>, "tone": <number -100 to 100>}
-
-Do not include any other text, explanation, or formatting."""
-
-    user_prompt = f"""Analyze this conversation:
-
-{conversation_text}
-
-Focus on the CUSTOMER's messages and behavior. Provide the engagement and tone scores."""
-
-    provider = agent.get("provider", "openai").lower() if agent else "openai"
-    model = agent.get("model", "gpt-4o-mini") if agent else "gpt-4o-mini"
     
-    try:
-        if provider == "openai":
-            from emergentintegrations.llm.openai import chat
-            response = await chat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                model=model,
-                system_prompt=system_prompt,
-                user_message=user_prompt,
-                temperature=0.3
-            )
-        elif provider == "anthropic":
-            from emergentintegrations.llm.anthropic import chat
-            response = await chat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                model=model,
-                system_prompt=system_prompt,
-                user_message=user_prompt,
-                temperature=0.3
-            )
-        elif provider == "google":
-            from emergentintegrations.llm.google import chat
-            response = await chat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                model=model,
-                system_prompt=system_prompt,
-                user_message=user_prompt,
-                temperature=0.3
-            )
-        else:
-            return {"engagement": 5, "tone": 0}
-        
-        # Parse JSON response
-        import json
-        # Try to extract JSON from the response
-        response = response.strip()
-        if response.startswith("```"):
-            # Remove markdown code blocks
-            response = response.split("```")[1]
-            if response.startswith("json"):
-                response = response[4:]
-        
-        result = json.loads(response)
-        
-        # Validate and clamp values
-        engagement = max(1, min(10, int(result.get("engagement", 5))))
-        tone = max(-100, min(100, int(result.get("tone", 0))))
-        
-        return {"engagement": engagement, "tone": tone}
-        
-    except Exception as e:
-        print(f"Error in analyze_sentiment: {e}")
-        return {"engagement": 5, "tone": 0}
+    return {
+        "engagement": conversation.get("engagement_score", 5),
+        "tone": conversation.get("tone_score", 0),
+        "last_analyzed": conversation.get("sentiment_analyzed_at"),
+        "queued": is_stale
+    }
 
 @router.post("/{conversation_id}/messages", response_model=MessageResponse)
 async def add_agent_message(
@@ -366,40 +287,29 @@ async def add_agent_message(
     if not tenant_id:
         raise HTTPException(status_code=404, detail="No tenant associated")
     
-    # Verify conversation belongs to tenant
-    conversation = await db.conversations.find_one(
-        {"id": conversation_id, "tenant_id": tenant_id}, {"_id": 0}
-    )
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    now = datetime.now(timezone.utc).isoformat()
-    message_id = str(uuid.uuid4())
-    
-    message_doc = {
-        "id": message_id,
+    # Update the conversation, then insert the message; scoping the update to
+    # the tenant verifies the conversation belongs to it before anything is written
+    turn = ConversationTurn(conversation_id, tenant_id)
+    message_doc = turn.add_message({
+        "id": str(uuid.uuid4()),
         "conversation_id": conversation_id,
         "author_type": "agent",
         "author_id": current_user["id"],
         "content": message_data.content,
-        "created_at": now
-    }
-    await db.messages.insert_one(message_doc)
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    conversation = await turn.commit(status="waiting")
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Update conversation
-    await db.conversations.update_one(
-        {"id": conversation_id},
-        {
-            "$set": {
-                "last_message": message_data.content[:100],
-                "last_message_at": now,
-                "updated_at": now,
-                "status": "waiting"
-            }
-        }
-    )
+    # Suggestions computed for the customer's message are answered now
+    from services.suggestion_engine import suggestion_engine
+    await suggestion_engine.on_new_message(tenant_id, conversation, message_doc)
+    
+    from services.widget_events import widget_events
+    await widget_events.publish_message(tenant_id, message_doc)
     
-    return {k: v for k, v in message_doc.items() if k != "_id"}
+    return message_doc
 
 @router.patch("/{conversation_id}/mode", response_model=ConversationResponse)
 async def update_conversation_mode(
@@ -456,6 +366,13 @@ async def update_conversation_mode(
         }
         await db.messages.insert_one(system_message)
     
+    # Push the new mode / assigned agent (and the system message) to the customer's widget
+    if old_mode != mode or current_conv.get("assigned_agent_id") != assigned_agent_id:
+        from services.widget_events import widget_events
+        await widget_events.publish_mode(tenant_id, result)
+        if old_mode != mode:
+            await widget_events.publish_message(tenant_id, system_message)
+    
     # Remove _id before returning
     result.pop("_id", None)
     return result
@@ -465,153 +382,42 @@ async def get_ai_suggestions(
     conversation_id: str,
     current_user: dict = Depends(get_current_user)
 ):
-    """Generate AI response suggestions for assisted mode"""
+    """Get AI response suggestions for assisted mode (precomputed when a customer message arrives)"""
+    from services.suggestion_engine import suggestion_engine, ERROR_SUGGESTIONS
+    
     tenant_id = current_user.get("tenant_id")
     if not tenant_id:
         raise HTTPException(status_code=404, detail="No tenant associated")
     
     # Get conversation
-    conversation = await db.conversations.find_one({"id": conversation_id, "tenant_id": tenant_id})
+    conversation = await db.conversations.find_one({"id": conversation_id, "tenant_id": tenant_id}, {"_id": 0, "id": 1})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Get recent messages for context
-    messages = await db.messages.find(
+    last_message = await db.messages.find_one(
         {"conversation_id": conversation_id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(10).to_list(10)
-    messages.reverse()  # Chronological order
-    
-    if not messages:
-        return {"suggestions": []}
-    
-    # Get the last customer message
-    last_customer_msg = None
-    for msg in reversed(messages):
-        if msg.get("author_type") == "customer":
-            last_customer_msg = msg
-            break
-    
-    if not last_customer_msg:
+        {"_id": 0, "id": 1},
+        sort=[("created_at", -1)]
+    )
+    if not last_message:
         return {"suggestions": []}
     
-    # Get agent config for this tenant
-    agent_config = await db.company_agent_configs.find_one({"tenant_id": tenant_id}, {"_id": 0})
-    if not agent_config or not agent_config.get("selected_agent_id"):
-        return {"suggestions": ["I'll look into this for you.", "Let me check that.", "Thank you for your patience."]}
-    
-    # Get the agent
-    agent = await db.agents.find_one({"id": agent_config["selected_agent_id"]}, {"_id": 0})
-    if not agent:
-        return {"suggestions": ["I'll look into this for you.", "Let me check that.", "Thank you for your patience."]}
-    
-    # Get RAG context if available
-    rag_context = ""
-    try:
-        from rag_service import get_rag_context
-        rag_context = await get_rag_context(tenant_id, last_customer_msg["content"])
-    except Exception as e:
-        print(f"RAG context error: {e}")
-    
-    # Build conversation history for context
-    conversation_history = ""
-    for msg in messages[-6:]:  # Last 6 messages for context
-        role = "Customer" if msg.get("author_type") == "customer" else "Agent"
-        conversation_history += f"{role}: {msg.get('content', '')}\n"
+    # Serve speculative suggestions computed for the current last message
+    cached = await suggestion_engine.get_cached(conversation_id, last_message["id"])
+    if cached is None:
+        cached = await suggestion_engine.wait_for_inflight(conversation_id, last_message["id"])
+    if cached is not None:
+        return {"suggestions": cached, "cached": True}
     
     # Generate suggestions using AI
     try:
-        suggestions = await generate_suggestions(
-            agent=agent,
-            customer_message=last_customer_msg["content"],
-            conversation_history=conversation_history,
-            rag_context=rag_context,
-            custom_instructions=agent_config.get("custom_instructions", "")
-        )
-        return {"suggestions": suggestions}
+        result = await suggestion_engine.build(tenant_id, conversation_id)
+        if result["cacheable"] and result["message_id"]:
+            await suggestion_engine.store(tenant_id, conversation_id, result["message_id"], result["suggestions"])
+        return {"suggestions": result["suggestions"], "cached": False}
     except Exception as e:
         print(f"Error generating suggestions: {e}")
-        return {"suggestions": ["I'll help you with that.", "Let me check this for you.", "Thank you for reaching out."]}
-
-async def generate_suggestions(agent: dict, customer_message: str, conversation_history: str, rag_context: str, custom_instructions: str) -> list:
-    """Generate 3 AI response suggestions"""
-    
-    system_prompt = f"""You are an AI assistant helping a human support agent respond to customers.
-Based on the conversation context, generate exactly 3 different response suggestions.
-Each suggestion should be:
-- Professional and helpful
-- Concise (1-2 sentences max)
-- Different in tone/approach from the others
-
-{f'Knowledge base context: {rag_context}' if rag_context else ''}
-{f'Custom instructions: {custom_instructions}' if custom_instructions else ''}
-
-Respond with exactly 3 suggestions, one per line, numbered 1-3. Do not include any other text."""
-
-    user_prompt = f"""Recent conversation:
-{conversation_history}
-
-Generate 3 response suggestions for the agent to reply to the customer's last message: "{customer_message}"
-"""
-
-    provider = agent.get("provider", "openai").lower()
-    model = agent.get("model", "gpt-4o-mini")
-    
-    try:
-        if provider == "openai":
-            from emergentintegrations.llm.openai import chat
-            response = await chat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                model=model,
-                system_prompt=system_prompt,
-                user_message=user_prompt,
-                temperature=0.7
-            )
-        elif provider == "anthropic":
-            from emergentintegrations.llm.anthropic import chat
-            response = await chat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                model=model,
-                system_prompt=system_prompt,
-                user_message=user_prompt,
-                temperature=0.7
-            )
-        elif provider == "google":
-            from emergentintegrations.llm.google import chat
-            response = await chat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                model=model,
-                system_prompt=system_prompt,
-                user_message=user_prompt,
-                temperature=0.7
-            )
-        else:
-            return ["I'll help you with that.", "Let me look into this.", "Thank you for your patience."]
-        
-        # Parse response into 3 suggestions
-        lines = response.strip().split('\n')
-        suggestions = []
-        for line in lines:
-            # Remove numbering like "1.", "1)", "1:" etc.
-            cleaned = line.strip()
-            if cleaned:
-                # Remove common prefixes
-                for prefix in ['1.', '2.', '3.', '1)', '2)', '3)', '1:', '2:', '3:']:
-                    if cleaned.startswith(prefix):
-                        cleaned = cleaned[len(prefix):].strip()
-                        break
-                if cleaned:
-                    suggestions.append(cleaned)
-        
-        # Ensure we have exactly 3 suggestions
-        while len(suggestions) < 3:
-            suggestions.append("Let me help you with that.")
-        
-        return suggestions[:3]
-        
-    except Exception as e:
-        print(f"Error in generate_suggestions: {e}")
-        return ["I'll help you with that.", "Let me look into this.", "Thank you for your patience."]
+        return {"suggestions": list(ERROR_SUGGESTIONS), "cached": False}
 
 @router.patch("/{conversation_id}/status", response_model=ConversationResponse)
 async def update_conversation_status(
@@ -14,6 +14,7 @@ import json
 
 from middleware.database import db
 from middleware import get_current_user
+from services.search_service import search_service
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/crm", tags=["crm"])
@@ -138,11 +139,7 @@ async def get_customers(
     query = {"tenant_id": tenant_id}
     
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"email": {"$regex": search, "$options": "i"}},
-            {"company": {"$regex": search, "$options": "i"}}
-        ]
+        query["id"] = {"$in": await search_service.match_ids(tenant_id, "customers", search)}
     
     if status:
         query["status"] = status
@@ -208,6 +205,7 @@ async def create_customer(
     }
     
     await db.crm_customers.insert_one(customer)
+    await search_service.index_document("customers", customer)
     
     # Log activity
     await log_activity(
@@ -263,6 +261,7 @@ async def update_customer(
         {"id": customer_id, "tenant_id": tenant_id},
         {"_id": 0}
     )
+    await search_service.index_document("customers", updated)
     
     return updated
 
@@ -284,6 +283,7 @@ async def delete_customer(
         raise HTTPException(status_code=404, detail="Customer not found")
     
     # Also delete related data
+    await search_service.remove("customers", [customer_id])
     await db.crm_followups.delete_many({"customer_id": customer_id, "tenant_id": tenant_id})
     await db.crm_activities.delete_many({"customer_id": customer_id, "tenant_id": tenant_id})
     
@@ -725,6 +725,7 @@ async def create_customer_from_conversation(
     }
     
     await db.crm_customers.insert_one(customer)
+    await search_service.index_document("customers", customer)
     
     # Link conversation to new customer
     await db.conversations.update_one(
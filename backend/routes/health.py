@@ -133,6 +133,65 @@ async def reset_performance_metrics(current_user: dict = Depends(get_super_admin
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to reset metrics: {str(e)}")
 
+@router.get("/metrics/llm-governor")
+async def get_llm_governor_metrics(current_user: dict = Depends(get_super_admin_user)):
+    """
+    Get LLM governor metrics (Super Admin only)
+    Returns per-provider/model queue depth, in-flight calls and wait times
+    """
+    from services.llm_governor import llm_governor
+    
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "governor": llm_governor.get_stats()
+    }
+
+@router.get("/metrics/llm-router")
+async def get_llm_router_metrics(current_user: dict = Depends(get_super_admin_user)):
+    """
+    Get LLM router metrics (Super Admin only)
+    Returns circuit breaker state per provider and observed p95 latency per model
+    """
+    from services.llm_router import provider_router
+    
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "router": provider_router.get_stats()
+    }
+
+
+@router.get("/metrics/agent-replies")
+async def get_agent_reply_metrics(current_user: dict = Depends(get_super_admin_user)):
+    """
+    Get channel agent reply scheduler metrics (Super Admin only)
+    Returns pending replies, per-tenant generations in flight and delivery totals
+    """
+    from services.agent_reply_scheduler import agent_reply_scheduler
+    
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "scheduler": agent_reply_scheduler.get_stats()
+    }
+
+@router.get("/metrics/websockets")
+async def get_websocket_metrics(current_user: dict = Depends(get_super_admin_user)):
+    """
+    Get WebSocket delivery metrics for this worker (Super Admin only)
+    Returns send queue depths, slow-consumer drops, send latency, bus, presence and widget totals
+    """
+    from routes.messaging import manager
+    from services.realtime_bus import realtime_bus
+    from services.presence import presence_service
+    from services.widget_events import widget_events
+    
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "connections": manager.get_stats(),
+        "bus": realtime_bus.get_stats(),
+        "presence": presence_service.get_stats(),
+        "widgets": widget_events.get_stats()
+    }
+
 @router.get("/logs/recent")
 async def get_recent_logs(
     limit: int = 100,
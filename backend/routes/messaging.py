@@ -2,19 +2,31 @@
 Messaging routes for Slack-like instant messaging system
 Supports channels, DMs, threads, reactions, file uploads, and real-time WebSocket communication
 """
-from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, UploadFile, File, Query
+from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, UploadFile, File, Query, Response
 from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict, Set
 from datetime import datetime, timezone
+from collections import OrderedDict
 import uuid
 import json
 import asyncio
 import os
+import random
+import re
 from pathlib import Path
 
 from middleware import get_current_user
 from middleware.database import db
 from middleware.auth import JWT_SECRET, JWT_ALGORITHM
+from services.agent_reply_scheduler import agent_reply_scheduler
+from services.llm_usage import llm_usage
+from services.realtime_bus import realtime_bus
+from services.ws_connection import WebSocketConnection, serialize, ws_metrics
+from services.presence import presence_service
+from services.unread_counters import unread_counters
+from services.search_service import search_service
+from utils.pagination import older_than, page
+from services.intent_matcher import get_matcher, intent_detector, COLLABORATIVE
 import jwt
 
 router = APIRouter(prefix="/messaging", tags=["messaging"])
@@ -29,80 +41,85 @@ def get_agent_image_url(agent: dict) -> str:
 
 # WebSocket Connection Manager
 class ConnectionManager:
+    """
+    Local sockets of this worker. Fan-out goes through the realtime bus so
+    users connected to other workers receive the same events; each socket is
+    written by its own queue-draining task so slow clients never block a broadcast.
+    A user may hold several connections (tabs); presence lives in presence_service.
+    """
     def __init__(self):
-        # tenant_id -> user_id -> WebSocket
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
-        # user_id -> presence status
-        self.user_presence: Dict[str, dict] = {}
-    
-    async def connect(self, websocket: WebSocket, tenant_id: str, user_id: str, user_name: str):
+        # tenant_id -> user_id -> connection id -> connection
+        self.active_connections: Dict[str, Dict[str, Dict[str, WebSocketConnection]]] = {}
+        # connection id -> connection (every open socket, for metrics)
+        self.connections: Dict[str, WebSocketConnection] = {}
+        realtime_bus.add_handler("tenant", self._deliver_remote)
+        realtime_bus.add_handler("users", self._deliver_remote)
+    
+    async def connect(self, websocket: WebSocket, tenant_id: str, user_id: str, user_name: str) -> WebSocketConnection:
         await websocket.accept()
+        connection = WebSocketConnection(websocket, str(uuid.uuid4()), tenant_id, user_id, on_close=self._unregister)
+        connection.start()
+        self.connections[connection.id] = connection
         if tenant_id not in self.active_connections:
             self.active_connections[tenant_id] = {}
-        self.active_connections[tenant_id][user_id] = websocket
-        
-        # Set user as online
-        self.user_presence[user_id] = {
-            "status": "online",
-            "user_name": user_name,
-            "last_seen": datetime.now(timezone.utc).isoformat()
-        }
-        
-        # Broadcast presence update
-        await self.broadcast_presence(tenant_id, user_id, "online")
-    
-    async def disconnect(self, tenant_id: str, user_id: str):
-        if tenant_id in self.active_connections:
-            if user_id in self.active_connections[tenant_id]:
-                del self.active_connections[tenant_id][user_id]
-            if not self.active_connections[tenant_id]:
-                del self.active_connections[tenant_id]
+            realtime_bus.subscribe(tenant_id)
+        self.active_connections[tenant_id].setdefault(user_id, {})[connection.id] = connection
         
-        # Set user as offline
-        if user_id in self.user_presence:
-            self.user_presence[user_id]["status"] = "offline"
-            self.user_presence[user_id]["last_seen"] = datetime.now(timezone.utc).isoformat()
-        
-        # Broadcast presence update
-        await self.broadcast_presence(tenant_id, user_id, "offline")
+        await presence_service.connect(tenant_id, user_id, connection.id, user_name)
+        return connection
+    
+    async def disconnect(self, connection: WebSocketConnection):
+        connection.close()
+        await presence_service.disconnect(connection.id)
+    
+    def _unregister(self, connection: WebSocketConnection):
+        """Forget a closed connection (called once by the connection itself)"""
+        self.connections.pop(connection.id, None)
+        tenant_connections = self.active_connections.get(connection.tenant_id)
+        if tenant_connections is None:
+            return
+        user_connections = tenant_connections.get(connection.user_id, {})
+        user_connections.pop(connection.id, None)
+        if not user_connections:
+            tenant_connections.pop(connection.user_id, None)
+        if not tenant_connections:
+            del self.active_connections[connection.tenant_id]
+            realtime_bus.unsubscribe(connection.tenant_id)
     
     async def broadcast_to_tenant(self, tenant_id: str, message: dict, exclude_user: str = None):
-        """Broadcast message to all users in a tenant"""
-        if tenant_id in self.active_connections:
-            for user_id, connection in self.active_connections[tenant_id].items():
-                if user_id != exclude_user:
-                    try:
-                        await connection.send_json(message)
-                    except Exception:
-                        pass
+        """Broadcast message to all users in a tenant (on every worker)"""
+        self._deliver_to_tenant(tenant_id, serialize(message), exclude_user)
+        await realtime_bus.publish(tenant_id, {"target": "tenant", "message": message, "exclude_user": exclude_user})
     
     async def send_to_users(self, tenant_id: str, user_ids: List[str], message: dict):
-        """Send message to specific users"""
-        if tenant_id in self.active_connections:
-            for user_id in user_ids:
-                if user_id in self.active_connections[tenant_id]:
-                    try:
-                        await self.active_connections[tenant_id][user_id].send_json(message)
-                    except Exception:
-                        pass
-    
-    async def broadcast_presence(self, tenant_id: str, user_id: str, status: str):
-        """Broadcast user presence change"""
-        message = {
-            "type": "presence",
-            "payload": {
-                "user_id": user_id,
-                "status": status,
-                "last_seen": datetime.now(timezone.utc).isoformat()
-            }
-        }
-        await self.broadcast_to_tenant(tenant_id, message)
+        """Send message to specific users (on every worker)"""
+        self._deliver_to_users(tenant_id, user_ids, serialize(message))
+        await realtime_bus.publish(tenant_id, {"target": "users", "message": message, "user_ids": list(user_ids)})
+    
+    async def _deliver_remote(self, envelope: dict):
+        """Deliver an event published by another worker to local sockets"""
+        data = serialize(envelope["message"])
+        if envelope.get("target") == "users":
+            self._deliver_to_users(envelope["tenant_id"], envelope.get("user_ids", []), data)
+        else:
+            self._deliver_to_tenant(envelope["tenant_id"], data, envelope.get("exclude_user"))
     
-    def get_online_users(self, tenant_id: str) -> List[str]:
-        """Get list of online user IDs for a tenant"""
-        if tenant_id in self.active_connections:
-            return list(self.active_connections[tenant_id].keys())
-        return []
+    def _deliver_to_tenant(self, tenant_id: str, data: str, exclude_user: str = None):
+        # Queues only - never waits on a socket
+        for user_id, user_connections in list(self.active_connections.get(tenant_id, {}).items()):
+            if user_id != exclude_user:
+                for connection in list(user_connections.values()):
+                    connection.send(data)
+    
+    def _deliver_to_users(self, tenant_id: str, user_ids: List[str], data: str):
+        tenant_connections = self.active_connections.get(tenant_id, {})
+        for user_id in user_ids:
+            for connection in list(tenant_connections.get(user_id, {}).values()):
+                connection.send(data)
+    
+    def get_stats(self) -> dict:
+        """Send queue metrics for this worker's sockets"""
+        return ws_metrics.get_stats(self.connections)
 
 manager = ConnectionManager()
 
@@ -163,6 +180,35 @@ async def create_channel(
     
     return channel
 
+async def get_last_messages(tenant_id: str, field: str, target_ids: List[str]) -> Dict[str, dict]:
+    """Latest top-level message per channel/DM (field is channel_id or dm_conversation_id), in one aggregation"""
+    if not target_ids:
+        return {}
+    rows = await db.messaging_messages.aggregate([
+        {"$match": {"tenant_id": tenant_id, field: {"$in": target_ids}, "parent_id": None}},
+        {"$sort": {"tenant_id": 1, field: 1, "parent_id": 1, "created_at": -1}},
+        {"$group": {"_id": f"${field}", "message": {"$first": "$$ROOT"}}}
+    ]).to_list(len(target_ids))
+    last_messages = {}
+    for row in rows:
+        row["message"].pop("_id", None)
+        last_messages[row["_id"]] = row["message"]
+    return last_messages
+
+async def get_agent_details(agent_ids: List[str]) -> List[dict]:
+    """Display details for a set of agents, in one query"""
+    if not agent_ids:
+        return []
+    agents = await db.user_agents.find(
+        {"id": {"$in": agent_ids}},
+        {"_id": 0, "id": 1, "name": 1, "icon": 1, "avatar_url": 1, "profile_image_url": 1}
+    ).to_list(len(agent_ids))
+    # Normalize avatar field for each agent
+    for agent in agents:
+        agent["avatar_url"] = get_agent_image_url(agent)
+        agent.pop("profile_image_url", None)
+    return agents
+
 @router.get("/channels")
 async def get_channels(current_user: dict = Depends(get_current_user)):
     """Get all channels for the tenant"""
@@ -178,49 +224,27 @@ async def get_channels(current_user: dict = Depends(get_current_user)):
         ]
     }, {"_id": 0}).to_list(1000)
     
-    # Get unread counts and last message for each channel
+    # Last messages, agent details and unread counts for all channels at once
+    # (counters for joined channels, counted from messages for the other public ones)
+    agent_ids = list({agent_id for c in channels for agent_id in c.get("agents", [])})
+    unjoined_ids = [c["id"] for c in channels if user_id not in c.get("members", [])]
+    last_messages, agents, unread, unjoined_unread = await asyncio.gather(
+        get_last_messages(tenant_id, "channel_id", [c["id"] for c in channels]),
+        get_agent_details(agent_ids),
+        unread_counters.get_counts(user_id),
+        unread_counters.count_unjoined(tenant_id, user_id, unjoined_ids)
+    )
+    
+    agents_by_id = {agent["id"]: agent for agent in agents}
     for channel in channels:
-        # Get last message
-        last_msg = await db.messaging_messages.find_one(
-            {"channel_id": channel["id"], "parent_id": None},
-            {"_id": 0},
-            sort=[("created_at", -1)]
-        )
-        channel["last_message"] = last_msg
-        
-        # Get agent info for channel
-        agent_ids = channel.get("agents", [])
-        if agent_ids:
-            agents = await db.user_agents.find({
-                "id": {"$in": agent_ids}
-            }, {"_id": 0, "id": 1, "name": 1, "icon": 1, "avatar_url": 1, "profile_image_url": 1}).to_list(100)
-            # Normalize avatar field for each agent
-            for agent in agents:
-                agent["avatar_url"] = get_agent_image_url(agent)
-                agent.pop("profile_image_url", None)
-            channel["agent_details"] = agents
-        else:
-            channel["agent_details"] = []
-        
-        # Get unread count
-        read_status = await db.messaging_read_status.find_one({
-            "user_id": user_id,
-            "channel_id": channel["id"]
-        })
-        last_read = read_status.get("last_read_at") if read_status else None
-        
-        if last_read:
-            unread = await db.messaging_messages.count_documents({
-                "channel_id": channel["id"],
-                "created_at": {"$gt": last_read},
-                "author_id": {"$ne": user_id}
-            })
+        channel["last_message"] = last_messages.get(channel["id"])
+        channel["agent_details"] = [
+            agents_by_id[agent_id] for agent_id in channel.get("agents", []) if agent_id in agents_by_id
+        ]
+        if user_id not in channel.get("members", []):
+            channel["unread_count"] = unjoined_unread.get(channel["id"], 0)
         else:
-            unread = await db.messaging_messages.count_documents({
-                "channel_id": channel["id"],
-                "author_id": {"$ne": user_id}
-            })
-        channel["unread_count"] = unread
+            channel["unread_count"] = unread["channels"].get(channel["id"], 0)
     
     return channels
 
@@ -299,6 +323,7 @@ async def leave_channel(channel_id: str, current_user: dict = Depends(get_curren
             "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
         }
     )
+    await db.messaging_read_status.delete_one({"user_id": user_id, "channel_id": channel_id})
     
     return {"success": True, "message": "Left channel"}
 
@@ -401,6 +426,7 @@ async def delete_channel(channel_id: str, current_user: dict = Depends(get_curre
     await db.messaging_channels.delete_one({"id": channel_id})
     await db.messaging_messages.delete_many({"channel_id": channel_id})
     await db.messaging_read_status.delete_many({"channel_id": channel_id})
+    await search_service.remove_where("messages", {"channel_id": channel_id})
     
     # Broadcast deletion
     await manager.broadcast_to_tenant(tenant_id, {
@@ -602,7 +628,15 @@ async def get_dm_conversations(current_user: dict = Depends(get_current_user)):
         "participants": user_id
     }, {"_id": 0}).to_list(1000)
     
-    # Get participant details and unread counts
+    # Last messages, unread counters and presence for all DMs at once
+    last_messages, unread, online_users = await asyncio.gather(
+        get_last_messages(tenant_id, "dm_conversation_id", [dm["id"] for dm in dms]),
+        unread_counters.get_counts(user_id),
+        presence_service.get_online_user_ids(tenant_id)
+    )
+    unread_counts = unread["dms"]
+    
+    # Get participant details for each DM
     for dm in dms:
         other_participant = [p for p in dm["participants"] if p != user_id][0]
         
@@ -629,35 +663,10 @@ async def get_dm_conversations(current_user: dict = Depends(get_current_user)):
                 {"_id": 0, "id": 1, "name": 1, "email": 1, "avatar_url": 1}
             )
             dm["other_user"] = other_user
-            dm["is_online"] = other_participant in manager.get_online_users(tenant_id)
+            dm["is_online"] = other_participant in online_users
         
-        # Get last message
-        last_msg = await db.messaging_messages.find_one(
-            {"dm_conversation_id": dm["id"], "parent_id": None},
-            {"_id": 0},
-            sort=[("created_at", -1)]
-        )
-        dm["last_message"] = last_msg
-        
-        # Get unread count
-        read_status = await db.messaging_read_status.find_one({
-            "user_id": user_id,
-            "dm_conversation_id": dm["id"]
-        })
-        last_read = read_status.get("last_read_at") if read_status else None
-        
-        if last_read:
-            unread = await db.messaging_messages.count_documents({
-                "dm_conversation_id": dm["id"],
-                "created_at": {"$gt": last_read},
-                "author_id": {"$ne": user_id}
-            })
-        else:
-            unread = await db.messaging_messages.count_documents({
-                "dm_conversation_id": dm["id"],
-                "author_id": {"$ne": user_id}
-            })
-        dm["unread_count"] = unread
+        dm["last_message"] = last_messages.get(dm["id"])
+        dm["unread_count"] = unread_counts.get(dm["id"], 0)
     
     return dms
 
@@ -708,18 +717,23 @@ async def send_message(
         "mentions": mentions or [],
         "reactions": {},
         "is_edited": False,
+        "reply_count": 0,
         "created_at": datetime.now(timezone.utc).isoformat(),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.messaging_messages.insert_one(message)
     message.pop('_id', None)
+    await search_service.index_document("messages", message)
     
-    # Update reply count if this is a thread reply
+    # Update thread summary on the parent if this is a thread reply
     if parent_id:
         await db.messaging_messages.update_one(
-            {"id": parent_id},
-            {"$inc": {"reply_count": 1}}
+            {"id": parent_id, "tenant_id": tenant_id},
+            {
+                "$inc": {"reply_count": 1},
+                "$max": {"last_reply_at": message["created_at"]}
+            }
         )
     
     # Get recipient user IDs for notifications
@@ -730,6 +744,7 @@ async def send_message(
     elif dm_conversation_id:
         dm = await db.messaging_dm_conversations.find_one({"id": dm_conversation_id})
         recipients = dm.get("participants", [])
+    await unread_counters.record_message(message, recipients)
     
     # Broadcast message via WebSocket
     await manager.send_to_users(tenant_id, recipients, {
@@ -763,6 +778,9 @@ async def send_message(
     
     # Trigger AI agent response if channel has agents
     if channel_id:
+        if not parent_id:
+            # Replies still pending for earlier messages are now stale
+            agent_reply_scheduler.note_message(channel_id, message["created_at"])
         asyncio.create_task(trigger_channel_agents(
             tenant_id=tenant_id,
             channel_id=channel_id,
@@ -787,8 +805,6 @@ async def send_message(
 
 async def trigger_dm_agent_response(tenant_id: str, dm_conversation_id: str, agent_id: str, message: dict, user_name: str):
     """Handle agent response in DM conversations"""
-    import random
-    import asyncio
     
     try:
         from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -808,6 +824,7 @@ async def trigger_dm_agent_response(tenant_id: str, dm_conversation_id: str, age
         
         # Get conversation history
         recent_messages = await db.messaging_messages.find({
+            "tenant_id": tenant_id,
             "dm_conversation_id": dm_conversation_id,
             "parent_id": None
         }, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
@@ -850,9 +867,10 @@ CONVERSATION HISTORY:
             system_message=system_prompt
         ).with_model("openai", "gpt-4o")
         
-        response = await chat.send_message(UserMessage(
-            text=f'{user_name}: "{message["content"]}"\n\nRespond naturally:'
-        ))
+        prompt = f'{user_name}: "{message["content"]}"\n\nRespond naturally:'
+        async with llm_usage.track(tenant_id, agent['id'], "openai", "gpt-4o", "dm_agent") as call:
+            response = await chat.send_message(UserMessage(text=prompt))
+            call.estimate_usage(system_prompt + prompt, response)
         
         if response:
             response = response.strip()
@@ -881,11 +899,13 @@ CONVERSATION HISTORY:
             
             await db.messaging_messages.insert_one(agent_message)
             agent_message.pop('_id', None)
+            await search_service.index_document("messages", agent_message)
             
             # Broadcast
             dm = await db.messaging_dm_conversations.find_one({"id": dm_conversation_id})
             if dm:
                 recipients = dm.get("participants", [])
+                await unread_counters.record_message(agent_message, recipients)
                 await manager.send_to_users(tenant_id, recipients, {
                     "type": "message",
                     "payload": agent_message
@@ -905,9 +925,6 @@ async def trigger_channel_agents(tenant_id: str, channel_id: str, message: dict,
     - Collaborative discussion mode
     - Human-like behavior variations
     """
-    import random
-    import asyncio
-    import re
     
     try:
         # Get channel with agents
@@ -935,42 +952,32 @@ async def trigger_channel_agents(tenant_id: str, channel_id: str, message: dict,
         print(f"[Agent Trigger] Found {len(agents)} enabled agents: {[a['name'] for a in agents]}")
         
         message_content = message["content"]
-        message_lower = message_content.lower()
         
         # Skip if this is an agent message (prevent infinite loops)
         if message.get("is_agent"):
             print("[Agent Trigger] Skipping agent message")
             return
         
-        # === PHASE 1: Detect which agents are explicitly mentioned ===
-        mentioned_agents = []
+        # === PHASE 1 + 2: Detect agent mentions and collaborative keywords in one scan ===
+        # Mention patterns: "@kaia", "@kaia smith", "kaia smith" (name with or without @)
+        tenant_phrases = await intent_detector.phrases_for_tenant(tenant_id)
+        phrase_sets = {COLLABORATIVE: tenant_phrases.get(COLLABORATIVE, [])}
         for agent in agents:
-            agent_name = agent['name']
-            agent_name_lower = agent_name.lower()
-            agent_name_no_spaces = agent_name_lower.replace(' ', '')
-            
-            # Check various mention patterns
-            patterns = [
-                f"@{agent_name_no_spaces}",  # @kaia
-                f"@{agent_name_lower}",       # @kaia (with spaces preserved)
-                agent_name_lower,              # kaia (just the name)
+            agent_name_lower = agent['name'].lower()
+            phrase_sets[f"agent:{agent['id']}"] = [
+                f"@{agent_name_lower.replace(' ', '')}",
+                agent_name_lower
             ]
-            
-            for pattern in patterns:
-                if pattern in message_lower:
-                    if agent not in mentioned_agents:
-                        mentioned_agents.append(agent)
-                        print(f"[Agent Trigger] Agent '{agent_name}' mentioned via pattern '{pattern}'")
-                    break
+        detected = get_matcher(phrase_sets).match(message_content)
         
-        # === PHASE 2: Detect collaborative keywords ===
-        collaborative_keywords = [
-            "you both", "both of you", "you two", "you all",
-            "together", "collaborate", "discuss", "come up with",
-            "work together", "figure out", "brainstorm", "team up",
-            "what do you think", "your thoughts", "everyone"
-        ]
-        is_collaborative = any(kw in message_lower for kw in collaborative_keywords)
+        mentioned_agents = []
+        for agent in agents:
+            patterns = detected.get(f"agent:{agent['id']}")
+            if patterns:
+                mentioned_agents.append(agent)
+                print(f"[Agent Trigger] Agent '{agent['name']}' mentioned via pattern '{patterns[0]}'")
+        
+        is_collaborative = COLLABORATIVE in detected
         
         if is_collaborative and len(mentioned_agents) >= 2:
             print(f"[Agent Trigger] Collaborative mode detected with {len(mentioned_agents)} agents")
@@ -984,53 +991,44 @@ async def trigger_channel_agents(tenant_id: str, channel_id: str, message: dict,
             return
         
         # === PHASE 3: Handle explicit mentions ===
+        # Replies are generated concurrently; the scheduler paces their delivery
         responded_agent_ids = set()
-        if mentioned_agents:
-            # Add slight random delays between agent responses for natural feel
-            for i, agent in enumerate(mentioned_agents):
-                if i > 0:
-                    # Random delay 1-3 seconds between responses
-                    delay = random.uniform(1.0, 3.0)
-                    await asyncio.sleep(delay)
-                
-                await generate_agent_response(
-                    tenant_id=tenant_id,
-                    channel_id=channel_id,
-                    agent=agent,
-                    trigger_message=message,
-                    user_name=user_name,
-                    all_agents=agents
-                )
-                responded_agent_ids.add(agent['id'])
-        
-        # === PHASE 4: Proactive evaluation for non-mentioned agents ===
-        # Check if any agent should proactively respond based on expertise
-        for agent in agents:
-            # Skip agents that already responded via explicit mention
-            if agent['id'] in responded_agent_ids:
-                continue
-                
-            should_respond = await evaluate_proactive_response(
-                agent=agent,
+        for i, agent in enumerate(mentioned_agents):
+            schedule_agent_reply(
+                tenant_id=tenant_id,
                 channel_id=channel_id,
-                message=message,
+                agent=agent,
+                trigger_message=message,
                 user_name=user_name,
-                all_agents=agents
+                all_agents=agents,
+                # Random delay 1-3 seconds between responses for natural feel
+                delay=(1.0, 3.0) if i > 0 else (0.0, 0.0)
             )
-            
-            if should_respond:
-                # Random delay 2-5 seconds for proactive (thinking time)
-                delay = random.uniform(2.0, 5.0)
-                await asyncio.sleep(delay)
-                
-                await generate_agent_response(
+            responded_agent_ids.add(agent['id'])
+        
+        # === PHASE 4: Proactive evaluation for non-mentioned agents ===
+        # One batched decision for every candidate (skip agents that already responded)
+        candidates = [a for a in agents if a['id'] not in responded_agent_ids]
+        decisions = await evaluate_proactive_responses(
+            candidates=candidates,
+            channel_id=channel_id,
+            message=message,
+            user_name=user_name,
+            all_agents=agents
+        )
+        
+        for agent in candidates:
+            if decisions.get(agent['id']):
+                schedule_agent_reply(
                     tenant_id=tenant_id,
                     channel_id=channel_id,
                     agent=agent,
                     trigger_message=message,
                     user_name=user_name,
                     all_agents=agents,
-                    is_proactive=True
+                    is_proactive=True,
+                    # Random delay 2-5 seconds for proactive (thinking time)
+                    delay=(2.0, 5.0)
                 )
                 
     except Exception as e:
@@ -1039,76 +1037,190 @@ async def trigger_channel_agents(tenant_id: str, channel_id: str, message: dict,
         traceback.print_exc()
 
 
-async def evaluate_proactive_response(agent: dict, channel_id: str, message: dict, user_name: str, all_agents: list) -> bool:
+# message_id -> {agent_id: should_respond}; bounded so it only covers recent messages
+_proactive_decisions: "OrderedDict[str, Dict[str, bool]]" = OrderedDict()
+_PROACTIVE_CACHE_SIZE = 500
+
+# agent_id -> (updated_at, expertise keywords)
+_agent_expertise_keywords: Dict[str, tuple] = {}
+
+_KEYWORD_RE = re.compile(r"[a-z0-9][a-z0-9+#.-]{2,}")
+_STOPWORDS = {
+    "all", "and", "any", "are", "but", "can", "did", "for", "get", "got", "had", "has", "her",
+    "him", "his", "how", "its", "let", "may", "not", "now", "our", "out", "own", "see", "she",
+    "the", "too", "use", "was", "way", "who", "why", "yes", "yet", "you",
+    "about", "above", "after", "again", "also", "always", "been", "before", "being", "both",
+    "could", "does", "doing", "each", "from", "have", "having", "here", "into", "just", "like",
+    "make", "more", "most", "much", "must", "need", "only", "other", "over", "please", "same",
+    "should", "some", "such", "than", "that", "their", "them", "then", "there", "these", "they",
+    "this", "those", "through", "very", "want", "were", "what", "when", "where", "which", "while",
+    "will", "with", "would", "your", "you're", "assistant", "help", "helpful", "anyone", "thanks",
+}
+
+
+_SUFFIXES = ("ations", "ation", "ments", "ment", "ings", "ing", "ers", "ies", "es", "ed", "er", "ly", "s")
+_MIN_STEM = 4
+_MIN_PREFIX = 4  # Shorter keywords (api, sql, aws) only match exactly
+
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def _keywords(text: str) -> Set[str]:
+    words = {w.strip(".-") for w in _KEYWORD_RE.findall((text or "").lower())} - _STOPWORDS
+    return {_stem(w) for w in words if w}
+
+
+def _keywords_overlap(message_keywords: Set[str], agent_keywords: Set[str]) -> bool:
+    """Shared stem, or one keyword prefixing the other (refund ~ refunding, deploy ~ deployment)"""
+    if message_keywords & agent_keywords:
+        return True
+    return any(
+        a.startswith(m) or m.startswith(a)
+        for m in message_keywords if len(m) >= _MIN_PREFIX
+        for a in agent_keywords if len(a) >= _MIN_PREFIX
+    )
+
+
+def _get_agent_expertise_keywords(agent: dict) -> Set[str]:
+    """Keywords describing an agent's expertise (cached per agent version)"""
+    cached = _agent_expertise_keywords.get(agent['id'])
+    if cached and cached[0] == agent.get("updated_at"):
+        return cached[1]
+    config = agent.get("config", {}) or {}
+    text = " ".join([
+        agent.get("name", ""),
+        agent.get("description", "") or "",
+        agent.get("category", "") or "",
+        " ".join(agent.get("tags", []) or []),
+        config.get("system_prompt", "") or agent.get("system_prompt", "") or ""
+    ])
+    keywords = _keywords(text)
+    _agent_expertise_keywords[agent['id']] = (agent.get("updated_at"), keywords)
+    return keywords
+
+
+async def evaluate_proactive_responses(
+    candidates: list,
+    channel_id: str,
+    message: dict,
+    user_name: str,
+    all_agents: list
+) -> Dict[str, bool]:
     """
-    Evaluate if an agent should proactively respond based on:
+    Decide which agents should proactively respond, based on:
     - Their expertise/domain
     - Conversation context
     - Whether they can add unique value
+    
+    Agents whose expertise keywords don't overlap the message are skipped locally.
+    The rest are judged together in a single classification call, and decisions
+    are cached per message.
     """
-    try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        import os
-        
-        api_key = os.environ.get("EMERGENT_LLM_KEY")
-        if not api_key:
-            return False
-        
-        # Get recent conversation context (50 messages for better awareness)
-        recent_messages = await db.messaging_messages.find({
-            "channel_id": channel_id,
-            "parent_id": None
-        }, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
-        
-        recent_messages.reverse()
-        
-        # Build conversation context
-        context = "\n".join([
-            f"[{m.get('author_name', 'Unknown')}{'(AI)' if m.get('is_agent') else ''}]: {m['content']}" 
-            for m in recent_messages[-20:]  # Last 20 for evaluation
-        ])
-        
-        agent_config = agent.get("config", {})
-        other_agents = [a['name'] for a in all_agents if a['id'] != agent['id']]
-        
-        evaluation_prompt = f"""You are {agent['name']}, an AI assistant with the following expertise:
-{agent_config.get('system_prompt', 'General assistant')}
+    if not candidates:
+        return {}
+    
+    message_id = message.get("id")
+    cached = _proactive_decisions.get(message_id) if message_id else None
+    if cached is not None and all(a['id'] in cached for a in candidates):
+        return cached
+    
+    # Local relevance pre-filter
+    message_keywords = _keywords(message.get("content", ""))
+    relevant = [a for a in candidates if _keywords_overlap(message_keywords, _get_agent_expertise_keywords(a))]
+    decisions = {a['id']: False for a in candidates}
+    if not relevant:
+        print(f"[Proactive Eval] No agent expertise matches message; skipped {len(candidates)} agents")
+    else:
+        try:
+            from emergentintegrations.llm.chat import LlmChat, UserMessage
+            import os
+            
+            api_key = os.environ.get("EMERGENT_LLM_KEY")
+            if not api_key:
+                return decisions
+            
+            # Get recent conversation context once for all agents
+            recent_messages = await db.messaging_messages.find({
+                "tenant_id": message.get("tenant_id"),
+                "channel_id": channel_id,
+                "parent_id": None
+            }, {"_id": 0, "author_name": 1, "is_agent": 1, "content": 1}).sort("created_at", -1).limit(20).to_list(20)
+            
+            recent_messages.reverse()
+            
+            # Build conversation context
+            context = "\n".join([
+                f"[{m.get('author_name', 'Unknown')}{'(AI)' if m.get('is_agent') else ''}]: {m['content']}" 
+                for m in recent_messages
+            ])
+            
+            labels = {}
+            agent_sections = []
+            for index, agent in enumerate(relevant, start=1):
+                label = f"A{index}"
+                labels[label] = agent['id']
+                expertise = (agent.get("config", {}) or {}).get('system_prompt', 'General assistant') or 'General assistant'
+                agent_sections.append(f"{label} - {agent['name']}: {expertise[:600]}")
+            
+            agents_in_channel = ', '.join(a['name'] for a in all_agents)
+            
+            evaluation_prompt = f"""Several AI assistants are in this channel: {agents_in_channel}
 
-Other agents in this channel: {', '.join(other_agents) if other_agents else 'None'}
+Candidates to evaluate (label - name: expertise):
+{chr(10).join(agent_sections)}
 
 Recent conversation:
 {context}
 
 Latest message from {user_name}: "{message['content']}"
 
-IMPORTANT: You must decide if you should proactively join this conversation.
+IMPORTANT: For EACH candidate, decide if it should proactively join this conversation.
 
-Respond with ONLY "YES" or "NO" based on these criteria:
-- Say YES if you have relevant expertise that would genuinely help
-- Say YES if you notice a potential flaw, error, or better approach
-- Say YES if you can add unique value the other participants haven't considered
-- Say NO if another agent is already handling this well
-- Say NO if your input would be redundant or unhelpful
-- Say NO if the conversation doesn't relate to your expertise
+Answer YES for a candidate if:
+- It has relevant expertise that would genuinely help
+- It notices a potential flaw, error, or better approach
+- It can add unique value the other participants haven't considered
+Answer NO if:
+- Another agent is already handling this well
+- Its input would be redundant or unhelpful
+- The conversation doesn't relate to its expertise
 
-Your decision (YES or NO):"""
+Respond with ONLY a JSON object mapping each label to "YES" or "NO", e.g. {{"A1": "NO", "A2": "YES"}}"""
 
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"eval_{channel_id}_{agent['id']}",
-            system_message="You are an evaluation assistant. Respond only with YES or NO."
-        ).with_model("openai", "gpt-4o")
-        
-        response = await chat.send_message(UserMessage(text=evaluation_prompt))
-        
-        should_respond = response and response.strip().upper().startswith("YES")
-        print(f"[Proactive Eval] Agent '{agent['name']}' decision: {response.strip() if response else 'None'} -> {should_respond}")
-        
-        return should_respond
-        
-    except Exception as e:
-        print(f"Error evaluating proactive response: {e}")
-        return False
+            chat = LlmChat(
+                api_key=api_key,
+                session_id=f"eval_{channel_id}_{message_id or uuid.uuid4()}",
+                system_message="You are an evaluation assistant. Respond only with the requested JSON object."
+            ).with_model("openai", "gpt-4o")
+            
+            async with llm_usage.track(message.get("tenant_id"), None, "openai", "gpt-4o", "proactive_eval") as call:
+                response = await chat.send_message(UserMessage(text=evaluation_prompt))
+                call.estimate_usage(evaluation_prompt, response)
+            
+            text = (response or "").strip()
+            if text.startswith("```"):
+                text = text.split("```")[1]
+                if text.startswith("json"):
+                    text = text[4:]
+            parsed = json.loads(text) if text else {}
+            for label, agent_id in labels.items():
+                decisions[agent_id] = str(parsed.get(label, "NO")).strip().upper().startswith("YES")
+            
+            print(f"[Proactive Eval] Decisions: { {a['name']: decisions[a['id']] for a in relevant} }")
+        except Exception as e:
+            print(f"Error evaluating proactive responses: {e}")
+    
+    if message_id:
+        _proactive_decisions[message_id] = decisions
+        if len(_proactive_decisions) > _PROACTIVE_CACHE_SIZE:
+            _proactive_decisions.popitem(last=False)
+    
+    return decisions
 
 
 async def handle_collaborative_discussion(tenant_id: str, channel_id: str, agents: list, trigger_message: dict, user_name: str):
@@ -1116,8 +1228,6 @@ async def handle_collaborative_discussion(tenant_id: str, channel_id: str, agent
     Handle collaborative discussions where multiple agents work together.
     Creates a natural back-and-forth discussion with 3-4 exchanges.
     """
-    import random
-    import asyncio
     
     try:
         from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -1130,6 +1240,7 @@ async def handle_collaborative_discussion(tenant_id: str, channel_id: str, agent
         
         # Get conversation history
         recent_messages = await db.messaging_messages.find({
+            "tenant_id": tenant_id,
             "channel_id": channel_id,
             "parent_id": None
         }, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
@@ -1155,11 +1266,6 @@ async def handle_collaborative_discussion(tenant_id: str, channel_id: str, agent
             is_final = (exchange == num_exchanges - 1)
             
             for i, agent in enumerate(shuffled_agents):
-                # Natural delay between responses (1.5-4 seconds)
-                if exchange > 0 or i > 0:
-                    delay = random.uniform(1.5, 4.0)
-                    await asyncio.sleep(delay)
-                
                 agent_config = agent.get("config", {})
                 other_agent_names = [a['name'] for a in shuffled_agents if a['id'] != agent['id']]
                 
@@ -1228,55 +1334,36 @@ Continue the collaborative discussion:
 
 Your response:"""
                 
-                chat = LlmChat(
-                    api_key=api_key,
-                    session_id=f"collab_{channel_id}_{agent['id']}_{exchange}",
-                    system_message=f"You are {agent['name']}, a helpful AI assistant with a warm, human personality."
-                ).with_model("openai", "gpt-4o")
+                async def generate_turn(agent=agent, prompt=prompt, exchange=exchange):
+                    chat = LlmChat(
+                        api_key=api_key,
+                        session_id=f"collab_{channel_id}_{agent['id']}_{exchange}",
+                        system_message=f"You are {agent['name']}, a helpful AI assistant with a warm, human personality."
+                    ).with_model("openai", "gpt-4o")
+                    async with llm_usage.track(tenant_id, agent['id'], "openai", "gpt-4o", "collaborative") as call:
+                        response = await chat.send_message(UserMessage(text=prompt))
+                        call.estimate_usage(prompt, response)
+                    return response.strip() if response else None
                 
-                response = await chat.send_message(UserMessage(text=prompt))
+                # The next turn is generated while this one waits for its delivery slot
+                job = agent_reply_scheduler.submit(
+                    tenant_id=tenant_id,
+                    channel_id=channel_id,
+                    trigger_message=trigger_message,
+                    generate=generate_turn,
+                    deliver=lambda content, agent=agent: post_agent_message(tenant_id, channel_id, agent, content),
+                    # Natural delay between responses (1.5-4 seconds)
+                    delay=(1.5, 4.0) if exchange > 0 or i > 0 else (0.0, 0.0),
+                    label=f"{agent['name']} (collab)"
+                )
+                response = await job.generated
+                if not response:
+                    print("[Collaborative] Discussion stopped (turn cancelled or empty)")
+                    return
                 
-                if response:
-                    # Vary response length slightly
-                    response = response.strip()
-                    
-                    # Add to discussion history
-                    discussion_history.append(f"{agent['name']}: {response}")
-                    
-                    # Save and broadcast the message
-                    agent_message = {
-                        "id": str(uuid.uuid4()),
-                        "tenant_id": tenant_id,
-                        "channel_id": channel_id,
-                        "dm_conversation_id": None,
-                        "parent_id": None,
-                        "content": response,
-                        "author_id": f"agent_{agent['id']}",
-                        "author_name": agent["name"],
-                        "author_avatar": get_agent_image_url(agent),
-                        "is_agent": True,
-                        "agent_id": agent["id"],
-                        "attachments": [],
-                        "mentions": [],
-                        "reactions": {},
-                        "is_edited": False,
-                        "created_at": datetime.now(timezone.utc).isoformat(),
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    
-                    await db.messaging_messages.insert_one(agent_message)
-                    agent_message.pop('_id', None)
-                    
-                    # Broadcast
-                    channel = await db.messaging_channels.find_one({"id": channel_id})
-                    if channel:
-                        recipients = channel.get("members", [])
-                        await manager.send_to_users(tenant_id, recipients, {
-                            "type": "message",
-                            "payload": agent_message
-                        })
-                    
-                    print(f"[Collaborative] {agent['name']} (exchange {exchange+1}): {response[:100]}...")
+                # Add to discussion history
+                discussion_history.append(f"{agent['name']}: {response}")
+                print(f"[Collaborative] {agent['name']} (exchange {exchange+1}): {response[:100]}...")
         
         print("[Collaborative] Discussion complete")
         
@@ -1286,9 +1373,75 @@ Your response:"""
         traceback.print_exc()
 
 
-async def generate_agent_response(tenant_id: str, channel_id: str, agent: dict, trigger_message: dict, user_name: str, all_agents: list = None, is_proactive: bool = False):
-    """Generate and send AI agent response with human-like behavior"""
-    import random
+def schedule_agent_reply(
+    tenant_id: str,
+    channel_id: str,
+    agent: dict,
+    trigger_message: dict,
+    user_name: str,
+    all_agents: list = None,
+    is_proactive: bool = False,
+    delay: tuple = (0.0, 0.0)
+):
+    """Queue an agent reply: generated right away, delivered after `delay` (min, max seconds)"""
+    return agent_reply_scheduler.submit(
+        tenant_id=tenant_id,
+        channel_id=channel_id,
+        trigger_message=trigger_message,
+        generate=lambda: generate_agent_response(
+            channel_id=channel_id,
+            agent=agent,
+            trigger_message=trigger_message,
+            user_name=user_name,
+            all_agents=all_agents,
+            is_proactive=is_proactive
+        ),
+        deliver=lambda content: post_agent_message(tenant_id, channel_id, agent, content),
+        delay=delay,
+        label=agent['name']
+    )
+
+
+async def post_agent_message(tenant_id: str, channel_id: str, agent: dict, content: str) -> dict:
+    """Save an agent message in a channel and broadcast it to the members"""
+    agent_message = {
+        "id": str(uuid.uuid4()),
+        "tenant_id": tenant_id,
+        "channel_id": channel_id,
+        "dm_conversation_id": None,
+        "parent_id": None,
+        "content": content,
+        "author_id": f"agent_{agent['id']}",
+        "author_name": agent["name"],
+        "author_avatar": get_agent_image_url(agent),
+        "is_agent": True,
+        "agent_id": agent["id"],
+        "attachments": [],
+        "mentions": [],
+        "reactions": {},
+        "is_edited": False,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    
+    await db.messaging_messages.insert_one(agent_message)
+    agent_message.pop('_id', None)
+    await search_service.index_document("messages", agent_message)
+    
+    # Broadcast agent message
+    channel = await db.messaging_channels.find_one({"id": channel_id}, {"_id": 0, "members": 1})
+    if channel:
+        recipients = channel.get("members", [])
+        await unread_counters.record_message(agent_message, recipients)
+        await manager.send_to_users(tenant_id, recipients, {
+            "type": "message",
+            "payload": agent_message
+        })
+    return agent_message
+
+
+async def generate_agent_response(channel_id: str, agent: dict, trigger_message: dict, user_name: str, all_agents: list = None, is_proactive: bool = False) -> Optional[str]:
+    """Generate an AI agent response with human-like behavior (delivery is up to the caller)"""
     
     try:
         from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -1299,6 +1452,7 @@ async def generate_agent_response(tenant_id: str, channel_id: str, agent: dict,
         
         # Build conversation context (50 messages for better awareness)
         recent_messages = await db.messaging_messages.find({
+            "tenant_id": trigger_message.get("tenant_id"),
             "channel_id": channel_id,
             "parent_id": None
         }, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
@@ -1392,7 +1546,7 @@ CONVERSATION HISTORY:
         api_key = os.environ.get("EMERGENT_LLM_KEY")
         if not api_key:
             print("[Agent Response] EMERGENT_LLM_KEY not found in environment")
-            return
+            return None
         
         chat = LlmChat(
             api_key=api_key,
@@ -1413,58 +1567,37 @@ Respond naturally as {agent['name']}."""
         user_message = UserMessage(text=prompt)
         
         # Generate response
-        response = await chat.send_message(user_message)
+        async with llm_usage.track(trigger_message.get("tenant_id"), agent['id'], "openai", "gpt-4o", "channel_agent") as call:
+            response = await chat.send_message(user_message)
+            call.estimate_usage(system_prompt + prompt, response)
         
         if response:
             response = response.strip()
             print(f"[Agent Response] {agent['name']}: {response[:100]}...")
-            
-            # Create agent message
-            agent_message = {
-                "id": str(uuid.uuid4()),
-                "tenant_id": tenant_id,
-                "channel_id": channel_id,
-                "dm_conversation_id": None,
-                "parent_id": None,
-                "content": response,
-                "author_id": f"agent_{agent['id']}",
-                "author_name": agent["name"],
-                "author_avatar": get_agent_image_url(agent),
-                "is_agent": True,
-                "agent_id": agent["id"],
-                "attachments": [],
-                "mentions": [],
-                "reactions": {},
-                "is_edited": False,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-            
-            await db.messaging_messages.insert_one(agent_message)
-            agent_message.pop('_id', None)
-            
-            # Broadcast agent message
-            channel = await db.messaging_channels.find_one({"id": channel_id})
-            if channel:
-                recipients = channel.get("members", [])
-                await manager.send_to_users(tenant_id, recipients, {
-                    "type": "message",
-                    "payload": agent_message
-                })
+            return response
+        return None
                 
     except Exception as e:
         print(f"Error generating agent response: {e}")
+        return None
 
 @router.get("/messages")
 async def get_messages(
+    response: Response,
     channel_id: Optional[str] = None,
     dm_conversation_id: Optional[str] = None,
     parent_id: Optional[str] = None,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     before: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get messages from a channel, DM, or thread"""
+    """Get messages from a channel, DM, or thread
+    
+    Returns the newest page in chronological order. When older messages exist
+    the ``X-Next-Cursor`` response header holds the cursor for the next page.
+    ``before`` (a created_at timestamp) is still accepted for older clients.
+    """
     tenant_id = current_user["tenant_id"]
     user_id = current_user["id"]
     
@@ -1479,35 +1612,32 @@ async def get_messages(
     else:
         query["parent_id"] = None  # Only top-level messages
     
-    if before:
+    if cursor:
+        try:
+            query.update(older_than(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    elif before:
         query["created_at"] = {"$lt": before}
     
+    # One extra row tells whether another page exists
     messages = await db.messaging_messages.find(
         query,
         {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+    ).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    messages, next_cursor = page(messages, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
-    # Get reply counts for messages with threads
+    # reply_count/last_reply_at are maintained on the parent (see backfill_reply_counts.py)
     for msg in messages:
-        if not msg.get("reply_count"):
-            count = await db.messaging_messages.count_documents({
-                "parent_id": msg["id"]
-            })
-            msg["reply_count"] = count
+        msg.setdefault("reply_count", 0)
     
     # Mark as read
     if channel_id:
-        await db.messaging_read_status.update_one(
-            {"user_id": user_id, "channel_id": channel_id},
-            {"$set": {"last_read_at": datetime.now(timezone.utc).isoformat()}},
-            upsert=True
-        )
+        await unread_counters.mark_read(user_id, channel_id=channel_id)
     if dm_conversation_id:
-        await db.messaging_read_status.update_one(
-            {"user_id": user_id, "dm_conversation_id": dm_conversation_id},
-            {"$set": {"last_read_at": datetime.now(timezone.utc).isoformat()}},
-            upsert=True
-        )
+        await unread_counters.mark_read(user_id, dm_conversation_id=dm_conversation_id)
     
     return list(reversed(messages))  # Return in chronological order
 
@@ -1544,6 +1674,7 @@ async def update_message(
     )
     
     updated = await db.messaging_messages.find_one({"id": message_id}, {"_id": 0})
+    await search_service.index_document("messages", updated)
     
     # Broadcast update
     await manager.broadcast_to_tenant(tenant_id, {
@@ -1572,12 +1703,25 @@ async def delete_message(message_id: str, current_user: dict = Depends(get_curre
     
     # Delete message and all replies
     await db.messaging_messages.delete_one({"id": message_id})
-    await db.messaging_messages.delete_many({"parent_id": message_id})
+    await db.messaging_messages.delete_many({"tenant_id": tenant_id, "parent_id": message_id})
+    await search_service.remove("messages", [message_id])
+    await search_service.remove_where("messages", {"parent_id": message_id})
     
-    # Update parent reply count if this was a reply
+    # Update parent thread summary if this was a reply
     if message.get("parent_id"):
+        latest_reply = await db.messaging_messages.find_one(
+            {"tenant_id": tenant_id, "parent_id": message["parent_id"]},
+            {"_id": 0, "created_at": 1},
+            sort=[("created_at", -1)]
+        )
+        # Parents from before reply counts were maintained may have none to decrement
+        # (see backfill_reply_counts.py), but their last_reply_at still moves
+        await db.messaging_messages.update_one(
+            {"id": message["parent_id"], "tenant_id": tenant_id},
+            {"$set": {"last_reply_at": latest_reply["created_at"] if latest_reply else None}}
+        )
         await db.messaging_messages.update_one(
-            {"id": message["parent_id"]},
+            {"id": message["parent_id"], "tenant_id": tenant_id, "reply_count": {"$gt": 0}},
             {"$inc": {"reply_count": -1}}
         )
     
@@ -1730,25 +1874,20 @@ async def search_messages(
     limit: int = 50,
     current_user: dict = Depends(get_current_user)
 ):
-    """Search messages"""
+    """Search messages (ranked; every word matches as a prefix)"""
     tenant_id = current_user["tenant_id"]
     
-    query = {
-        "tenant_id": tenant_id,
-        "content": {"$regex": q, "$options": "i"}
-    }
-    
+    filters = {}
     if channel_id:
-        query["channel_id"] = channel_id
+        filters["channel_id"] = channel_id
     if dm_conversation_id:
-        query["dm_conversation_id"] = dm_conversation_id
+        filters["dm_conversation_id"] = dm_conversation_id
     
-    messages = await db.messaging_messages.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+    results = await search_service.search(
+        tenant_id, ["messages"], q, limit=min(limit, 100), filters={"messages": filters}
+    )
     
-    return messages
+    return results["messages"]
 
 # ============== TYPING INDICATOR ==============
 
@@ -1797,15 +1936,14 @@ async def get_users(current_user: dict = Depends(get_current_user)):
     
     users = await db.users.find(
         {"tenant_id": tenant_id},
-        {"_id": 0, "id": 1, "name": 1, "email": 1, "avatar_url": 1, "role": 1}
+        {"_id": 0, "id": 1, "name": 1, "email": 1, "avatar_url": 1, "role": 1, "last_seen_at": 1}
     ).to_list(1000)
     
-    online_users = manager.get_online_users(tenant_id)
+    online_users = await presence_service.get_online_user_ids(tenant_id)
     
     for user in users:
         user["is_online"] = user["id"] in online_users
-        presence = manager.user_presence.get(user["id"], {})
-        user["last_seen"] = presence.get("last_seen")
+        user["last_seen"] = user.pop("last_seen_at", None)
     
     return users
 
@@ -1831,7 +1969,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
             return
         
         # Connect
-        await manager.connect(websocket, tenant_id, user_id, user.get("name", "Unknown"))
+        connection = await manager.connect(websocket, tenant_id, user_id, user.get("name", "Unknown"))
         
         try:
             while True:
@@ -1842,7 +1980,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 payload = data.get("payload", {})
                 
                 if msg_type == "ping":
-                    await websocket.send_json({"type": "pong"})
+                    connection.send_json({"type": "pong"})
                 
                 elif msg_type == "typing":
                     # Forward typing indicator
@@ -1866,7 +2004,9 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                     })
         
         except WebSocketDisconnect:
-            await manager.disconnect(tenant_id, user_id)
+            pass
+        finally:
+            await manager.disconnect(connection)
     
     except jwt.ExpiredSignatureError:
         await websocket.close(code=4001)
@@ -1887,61 +2027,31 @@ async def get_unread_counts(current_user: dict = Depends(get_current_user)):
     tenant_id = current_user["tenant_id"]
     user_id = current_user["id"]
     
-    total_unread = 0
-    
-    # Get channel unread counts
-    channels = await db.messaging_channels.find({
-        "tenant_id": tenant_id,
-        "$or": [
-            {"is_private": False},
-            {"members": user_id}
-        ]
-    }).to_list(1000)
-    
-    for channel in channels:
-        read_status = await db.messaging_read_status.find_one({
-            "user_id": user_id,
-            "channel_id": channel["id"]
+    counts, unjoined_ids = await asyncio.gather(
+        unread_counters.get_counts(user_id),
+        db.messaging_channels.distinct("id", {
+            "tenant_id": tenant_id,
+            "is_private": False,
+            "members": {"$ne": user_id}
         })
-        last_read = read_status.get("last_read_at") if read_status else None
-        
-        if last_read:
-            count = await db.messaging_messages.count_documents({
-                "channel_id": channel["id"],
-                "created_at": {"$gt": last_read},
-                "author_id": {"$ne": user_id}
-            })
-        else:
-            count = await db.messaging_messages.count_documents({
-                "channel_id": channel["id"],
-                "author_id": {"$ne": user_id}
-            })
-        total_unread += count
+    )
+    unjoined_unread = await unread_counters.count_unjoined(tenant_id, user_id, unjoined_ids)
     
-    # Get DM unread counts
-    dms = await db.messaging_dm_conversations.find({
+    # Counters only count for channels and DMs the user is still in
+    channel_ids = await db.messaging_channels.distinct("id", {
+        "id": {"$in": list(counts["channels"])},
+        "tenant_id": tenant_id,
+        "members": user_id
+    }) if counts["channels"] else []
+    dm_ids = await db.messaging_dm_conversations.distinct("id", {
+        "id": {"$in": list(counts["dms"])},
         "tenant_id": tenant_id,
         "participants": user_id
-    }).to_list(1000)
-    
-    for dm in dms:
-        read_status = await db.messaging_read_status.find_one({
-            "user_id": user_id,
-            "dm_conversation_id": dm["id"]
-        })
-        last_read = read_status.get("last_read_at") if read_status else None
-        
-        if last_read:
-            count = await db.messaging_messages.count_documents({
-                "dm_conversation_id": dm["id"],
-                "created_at": {"$gt": last_read},
-                "author_id": {"$ne": user_id}
-            })
-        else:
-            count = await db.messaging_messages.count_documents({
-                "dm_conversation_id": dm["id"],
-                "author_id": {"$ne": user_id}
-            })
-        total_unread += count
+    }) if counts["dms"] else []
     
+    total_unread = (
+        sum(counts["channels"][cid] for cid in channel_ids)
+        + sum(counts["dms"][did] for did in dm_ids)
+        + sum(unjoined_unread.values())
+    )
     return {"total_unread": total_unread}
@@ -12,6 +12,7 @@ from enum import Enum
 import sys
 sys.path.append('/app/backend')
 from server import db, get_current_user
+from services.search_service import search_service
 
 
 router = APIRouter(prefix="/tickets", tags=["tickets"])
@@ -192,14 +193,9 @@ async def get_tickets(
     if assigned_to_team_id:
         query["assigned_to_team_id"] = assigned_to_team_id
     
-    # Search in title and description
+    # Search in title, description and customer (prefix match on every word)
     if search:
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}},
-            {"customer_name": {"$regex": search, "$options": "i"}},
-            {"customer_email": {"$regex": search, "$options": "i"}}
-        ]
+        query["id"] = {"$in": await search_service.match_ids(tenant_id, "tickets", search)}
     
     # Get tickets with sorting (newest first, then by priority)
     tickets = await db.tickets.find(
@@ -348,6 +344,7 @@ async def create_ticket(
     }
     
     await db.tickets.insert_one(ticket)
+    await search_service.index_document("tickets", ticket)
     
     # Remove MongoDB _id before returning
     ticket.pop("_id", None)
@@ -412,6 +409,7 @@ async def update_ticket(
         {"id": ticket_id},
         {"_id": 0}
     )
+    await search_service.index_document("tickets", updated)
     
     return updated
 
@@ -435,6 +433,7 @@ async def delete_ticket(
         raise HTTPException(status_code=404, detail="Ticket not found")
     
     await db.tickets.delete_one({"id": ticket_id})
+    await search_service.remove("tickets", [ticket_id])
     
     return {"message": "Ticket deleted successfully"}
 
@@ -503,6 +502,7 @@ async def escalate_conversation_to_ticket(
     }
     
     await db.tickets.insert_one(ticket)
+    await search_service.index_document("tickets", ticket)
     
     # Update conversation to mark as escalated
     await db.conversations.update_one(
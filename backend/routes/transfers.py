@@ -10,6 +10,7 @@ import uuid
 # No models imported from models module
 from middleware import get_current_user, get_super_admin_user
 from middleware.database import db
+from services.intent_matcher import intent_detector, IntentMatcher, HUMAN_REQUEST, AI_FAILURE
 
 router = APIRouter(prefix="/transfers", tags=["transfers"])
 
@@ -82,6 +83,15 @@ async def accept_transfer(
     }
     await db.messages.insert_one(system_message)
     
+    # Tell the customer's widget right away instead of on its next poll
+    from services.widget_events import widget_events
+    await widget_events.publish_mode(transfer["tenant_id"], {
+        "id": transfer["conversation_id"],
+        "mode": "agent",
+        "assigned_agent_id": current_user["id"]
+    })
+    await widget_events.publish_message(transfer["tenant_id"], system_message)
+    
     return {"success": True, "conversation_id": transfer["conversation_id"]}
 
 @router.post("/{transfer_id}/decline")
@@ -128,80 +138,57 @@ async def create_transfer_request(conversation_id: str, tenant_id: str, reason:
     await db.transfer_requests.insert_one(transfer)
     return transfer
 
-async def check_transfer_triggers(conversation_id: str, tenant_id: str, customer_message: str, ai_response: str, sentiment: dict = None):
+async def _recent_messages_preview(conversation_id: str) -> List[str]:
+    """Short previews of the last few messages, oldest first"""
+    messages = await db.messages.find(
+        {"conversation_id": conversation_id},
+        {"_id": 0, "content": 1}
+    ).sort("created_at", -1).limit(5).to_list(5)
+    return [m.get("content", "")[:50] for m in reversed(messages[-3:])]
+
+async def check_transfer_triggers(
+    conversation_id: str,
+    tenant_id: str,
+    customer_message: str,
+    ai_response: str,
+    sentiment: dict = None,
+    matcher: IntentMatcher = None
+):
     """Check if conversation should be transferred to human agent"""
-    
-    # Trigger phrases for human request
-    human_request_phrases = [
-        "talk to human", "speak to human", "human agent", "real person",
-        "talk to someone", "speak to someone", "talk to a person",
-        "need a human", "want a human", "get me a human",
-        "transfer to agent", "live agent", "customer service",
-        "speak with representative", "talk to representative"
-    ]
-    
-    message_lower = customer_message.lower()
+    matcher = matcher or await intent_detector.for_tenant(tenant_id)
     
     # Check for explicit human request
-    for phrase in human_request_phrases:
-        if phrase in message_lower:
-            # Get conversation summary
-            messages = await db.messages.find(
-                {"conversation_id": conversation_id},
-                {"_id": 0}
-            ).sort("created_at", -1).limit(5).to_list(5)
-            
-            summary = "Customer has requested to speak with a human agent."
-            if messages:
-                last_msgs = [m.get("content", "")[:50] for m in reversed(messages[-3:])]
-                summary += f" Recent messages: {' | '.join(last_msgs)}"
-            
-            await create_transfer_request(
-                conversation_id=conversation_id,
-                tenant_id=tenant_id,
-                reason="customer_request",
-                summary=summary
-            )
-            return True
+    if matcher.has(customer_message, HUMAN_REQUEST):
+        summary = "Customer has requested to speak with a human agent."
+        last_msgs = await _recent_messages_preview(conversation_id)
+        if last_msgs:
+            summary += f" Recent messages: {' | '.join(last_msgs)}"
+        
+        await create_transfer_request(
+            conversation_id=conversation_id,
+            tenant_id=tenant_id,
+            reason="customer_request",
+            summary=summary
+        )
+        return True
     
     # Check for AI failure indicators in response
-    failure_indicators = [
-        "i don't have that information",
-        "i cannot help with",
-        "i'm not able to",
-        "outside my knowledge",
-        "please contact support",
-        "i apologize, but i cannot"
-    ]
-    
-    response_lower = ai_response.lower() if ai_response else ""
-    for indicator in failure_indicators:
-        if indicator in response_lower:
-            messages = await db.messages.find(
-                {"conversation_id": conversation_id},
-                {"_id": 0}
-            ).sort("created_at", -1).limit(5).to_list(5)
-            
-            summary = "AI was unable to adequately assist the customer."
-            if messages:
-                last_msgs = [m.get("content", "")[:50] for m in reversed(messages[-3:])]
-                summary += f" Topic: {last_msgs[0] if last_msgs else 'Unknown'}"
-            
-            await create_transfer_request(
-                conversation_id=conversation_id,
-                tenant_id=tenant_id,
-                reason="ai_limitation",
-                summary=summary
-            )
-            return True
+    if ai_response and matcher.has(ai_response, AI_FAILURE):
+        summary = "AI was unable to adequately assist the customer."
+        last_msgs = await _recent_messages_preview(conversation_id)
+        if last_msgs:
+            summary += f" Topic: {last_msgs[0]}"
+        
+        await create_transfer_request(
+            conversation_id=conversation_id,
+            tenant_id=tenant_id,
+            reason="ai_limitation",
+            summary=summary
+        )
+        return True
     
     # Check sentiment for very negative tone
     if sentiment and sentiment.get("tone", 0) < -60:
-        messages = await db.messages.find(
-            {"conversation_id": conversation_id},
-            {"_id": 0}
-        ).sort("created_at", -1).limit(5).to_list(5)
-        
         summary = "Customer appears frustrated or upset. Tone analysis indicates negative sentiment."
         
         await create_transfer_request(
@@ -213,4 +200,3 @@ async def check_transfer_triggers(conversation_id: str, tenant_id: str, customer
         return True
     
     return False
-
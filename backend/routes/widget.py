@@ -1,12 +1,13 @@
 """
 Widget routes - Public endpoints for chat widget
 """
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, BackgroundTasks, Request
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr, ConfigDict
 from typing import List, Optional, Literal, Dict, Any
 from datetime import datetime, timezone, timedelta
 import uuid
+import asyncio
 import jwt
 import logging
 import time
@@ -17,6 +18,10 @@ from middleware import get_current_user, get_super_admin_user, get_admin_or_owne
 from middleware.database import db
 from middleware.auth import create_token, hash_password, verify_password, is_super_admin, JWT_SECRET, JWT_ALGORITHM
 from routes.transfers import check_transfer_triggers
+from services.widget_events import widget_events, get_assigned_agent_info, public_message, INTERNAL_MESSAGE_FIELDS
+from services.search_service import search_service
+from services.ws_connection import WebSocketConnection
+from services.conversation_turns import ConversationTurn
 
 logger = logging.getLogger(__name__)
 
@@ -154,6 +159,7 @@ async def create_widget_session(session_data: WidgetSessionCreate, _: None = Dep
                 "updated_at": now
             }
             await db.crm_customers.insert_one(crm_customer)
+            await search_service.index_document("customers", crm_customer)
             logger.info(f"Auto-created CRM customer {crm_customer_id} from widget session")
     
     conversation_doc = {
@@ -202,43 +208,96 @@ async def create_widget_session(session_data: WidgetSessionCreate, _: None = Dep
         "settings": public_settings
     }
 
-@router.get("/messages/{conversation_id}")
-async def get_widget_messages(conversation_id: str, token: str, _: None = Depends(check_widget_rate_limit)):
-    """Get messages for widget session"""
+def _verify_widget_token(token: str, conversation_id: str) -> Dict[str, Any]:
+    """Decode a widget session token and check it belongs to the conversation"""
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        if payload.get("conversation_id") != conversation_id:
-            raise HTTPException(status_code=403, detail="Invalid session")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("conversation_id") != conversation_id:
+        raise HTTPException(status_code=403, detail="Invalid session")
+    return payload
+
+@router.get("/messages/{conversation_id}")
+async def get_widget_messages(
+    conversation_id: str,
+    token: str,
+    since: Optional[str] = None,
+    _: None = Depends(check_widget_rate_limit)
+):
+    """Get messages for widget session
+    
+    With ``since`` (a message id or ISO timestamp) only newer messages are
+    returned, so a widget reconnecting its realtime socket fetches just what it
+    missed instead of the whole conversation.
+    """
+    _verify_widget_token(token, conversation_id)
+    
+    query = {"conversation_id": conversation_id}
+    if since:
+        anchor = await db.messages.find_one(
+            {"id": since, "conversation_id": conversation_id}, {"_id": 0, "created_at": 1}
+        )
+        if anchor:
+            query["created_at"] = {"$gt": anchor["created_at"]}
+        else:
+            try:
+                since_at = datetime.fromisoformat(since.replace("Z", "+00:00"))
+                query["created_at"] = {"$gt": since_at.isoformat()}
+            except ValueError:
+                pass  # Unknown message id: return the full history
     
     messages = await db.messages.find(
-        {"conversation_id": conversation_id}, {"_id": 0}
+        query, {field: 0 for field in INTERNAL_MESSAGE_FIELDS}
     ).sort("created_at", 1).to_list(1000)
     
     # Get conversation to check mode and assigned agent
-    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
-    
-    # If an agent is assigned, get their info
-    assigned_agent_info = None
-    if conversation and conversation.get("mode") == "agent" and conversation.get("assigned_agent_id"):
-        agent_user = await db.users.find_one(
-            {"id": conversation["assigned_agent_id"]},
-            {"_id": 0, "id": 1, "name": 1, "avatar_url": 1}
-        )
-        if agent_user:
-            assigned_agent_info = {
-                "id": agent_user.get("id"),
-                "name": agent_user.get("name", "Support Agent"),
-                "avatar_url": agent_user.get("avatar_url")
-            }
+    conversation = await db.conversations.find_one(
+        {"id": conversation_id}, {"_id": 0, "mode": 1, "assigned_agent_id": 1}
+    )
     
     return {
         "messages": messages,
         "mode": conversation.get("mode", "ai") if conversation else "ai",
-        "assigned_agent": assigned_agent_info
+        "assigned_agent": await get_assigned_agent_info(conversation) if conversation else None
     }
 
+@router.websocket("/ws/{conversation_id}")
+async def widget_websocket(websocket: WebSocket, conversation_id: str, token: str):
+    """Realtime channel for a widget: pushes new messages and mode/agent changes
+    
+    Authenticated with the widget session token; on (re)connect the widget
+    catches up with ``GET /messages/{conversation_id}?since=``.
+    """
+    try:
+        payload = _verify_widget_token(token, conversation_id)
+    except HTTPException:
+        await websocket.close(code=4001)
+        return
+    
+    await websocket.accept()
+    connection = WebSocketConnection(
+        websocket,
+        str(uuid.uuid4()),
+        payload.get("tenant_id"),
+        payload.get("customer_id"),
+        on_close=lambda conn: widget_events.unregister(conn, conversation_id)
+    )
+    connection.start()
+    widget_events.register(connection, conversation_id)
+    
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if data.get("type") == "ping":
+                connection.send_json({"type": "pong"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.info(f"Widget WebSocket error: {str(e)}")
+    finally:
+        connection.close()
+
 @router.post("/messages/{conversation_id}")
 async def send_widget_message(conversation_id: str, token: str, message_data: WidgetMessageCreate, _: None = Depends(check_widget_rate_limit)):
     """Send message from widget and get AI response"""
@@ -252,100 +311,101 @@ async def send_widget_message(conversation_id: str, token: str, message_data: Wi
     
     now = datetime.now(timezone.utc).isoformat()
     
-    # Get conversation
-    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    # Score tone in-process (lexicon, no LLM) - drives negative-sentiment escalation
+    from services.fast_sentiment import fast_sentiment
+    customer_sentiment = fast_sentiment.score(message_data.content)
     
-    # Save customer message
-    customer_message_id = str(uuid.uuid4())
-    customer_message_doc = {
-        "id": customer_message_id,
+    # Save customer message and update the conversation in one commit;
+    # the conversation comes back as it was before this message
+    turn = ConversationTurn(conversation_id, tenant_id)
+    customer_message_doc = turn.add_message({
+        "id": str(uuid.uuid4()),
         "conversation_id": conversation_id,
         "author_type": "customer",
         "author_id": payload.get("customer_id"),
         "content": message_data.content,
+        "tone": customer_sentiment["tone"],
         "created_at": now
-    }
-    await db.messages.insert_one(customer_message_doc)
+    })
     
-    # Update conversation
-    await db.conversations.update_one(
-        {"id": conversation_id},
-        {
-            "$set": {
-                "last_message": message_data.content[:100],
-                "last_message_at": now,
-                "updated_at": now,
-                "status": "open"
-            }
-        }
-    )
+    def score_in_language(conv: dict):
+        # Rare: rescore with the conversation's lexicon before the message is stored
+        language = conv.get("language")
+        if language and language[:2].lower() != "en":
+            customer_sentiment.update(fast_sentiment.score(message_data.content, language))
+            customer_message_doc["tone"] = customer_sentiment["tone"]
+    
+    conversation = await turn.commit(before_insert=score_in_language, status="open")
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    await widget_events.publish_message(tenant_id, customer_message_doc)
+    
+    # Human-handled conversations get reply suggestions precomputed for the agent
+    if conversation.get("mode", "ai") != "ai":
+        from services.suggestion_engine import suggestion_engine
+        await suggestion_engine.on_new_message(tenant_id, conversation, customer_message_doc)
     
     # If conversation is in AI mode, generate AI response
     ai_message = None
     if conversation.get("mode") == "ai":
-        # Get settings
-        settings = await db.settings.find_one({"tenant_id": tenant_id}, {"_id": 0})
-        
-        # Get recent messages for context
-        recent_messages = await db.messages.find(
-            {"conversation_id": conversation_id}, {"_id": 0}
-        ).sort("created_at", -1).to_list(20)
+        # Settings and the messages not yet folded into the rolling summary (bounded tail)
+        from services.conversation_memory import conversation_memory, TAIL_MAX_MESSAGES
+        settings, recent_messages = await asyncio.gather(
+            db.settings.find_one({"tenant_id": tenant_id}, {"_id": 0}),
+            db.messages.find(
+                conversation_memory.tail_query(conversation_id, conversation),
+                {"_id": 0, "author_type": 1, "content": 1, "created_at": 1}
+            ).sort("created_at", -1).to_list(TAIL_MAX_MESSAGES)
+        )
         recent_messages.reverse()
         
         # Generate AI response (with conversation_id for orchestration support)
         from server import generate_ai_response
-        ai_response = await generate_ai_response(recent_messages, settings or {}, conversation_id)
-        
-        # Save AI message
-        ai_now = datetime.now(timezone.utc).isoformat()
+        # Open widgets see the reply as it streams; the saved message replaces the draft
         ai_message_id = str(uuid.uuid4())
+        llm_meta = {}
+        ai_response = await generate_ai_response(
+            recent_messages, settings or {}, conversation_id, response_meta=llm_meta,
+            on_token=widget_events.message_stream(tenant_id, conversation_id, ai_message_id),
+            memory_state=conversation  # Summary fields as loaded by the commit above
+        )
+        
+        # Save AI message and update the conversation
         ai_message_doc = {
             "id": ai_message_id,
             "conversation_id": conversation_id,
             "author_type": "ai",
             "author_id": None,
             "content": ai_response,
-            "created_at": ai_now
+            "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.messages.insert_one(ai_message_doc)
-        ai_message = {k: v for k, v in ai_message_doc.items() if k != "_id"}
-        
-        # Update conversation with AI response
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {
-                "$set": {
-                    "last_message": ai_response[:100],
-                    "last_message_at": ai_now,
-                    "updated_at": ai_now
-                }
-            }
-        )
+        if llm_meta:
+            # Which provider/model answered and the latency it saw
+            ai_message_doc["llm"] = llm_meta
+        turn.add_message(ai_message_doc)
+        await turn.commit()
+        ai_message = public_message(ai_message_doc)
+        await widget_events.publish_message(tenant_id, ai_message_doc)
         
         # Check for transfer triggers (human request, AI failure, negative sentiment)
         try:
-            # Quick sentiment check on customer message
-            sentiment = None
-            if len(message_data.content) > 20:  # Only analyze substantial messages
-                # Simple negative keyword check for quick trigger
-                negative_words = ["angry", "frustrated", "terrible", "horrible", "worst", "hate", "useless", "stupid", "ridiculous"]
-                if any(word in message_data.content.lower() for word in negative_words):
-                    sentiment = {"tone": -70}
+            from services.intent_matcher import intent_detector
+            matcher = await intent_detector.for_tenant(tenant_id)
             
             await check_transfer_triggers(
                 conversation_id=conversation_id,
                 tenant_id=tenant_id,
                 customer_message=message_data.content,
                 ai_response=ai_response,
-                sentiment=sentiment
+                sentiment=customer_sentiment,
+                matcher=matcher
             )
         except Exception as e:
             print(f"Error checking transfer triggers: {e}")
     
     return {
-        "customer_message": {k: v for k, v in customer_message_doc.items() if k != "_id"},
+        "customer_message": customer_message_doc,
         "ai_message": ai_message
     }
 
@@ -125,7 +125,7 @@ get_tenant_admin_user = get_admin_or_owner_user
 
 # ============== AI SERVICE ==============
 
-async def generate_ai_response(messages: List[dict], settings: dict, conversation_id: str = None) -> str:
+async def generate_ai_response(messages: List[dict], settings: dict, conversation_id: str = None, response_meta: dict = None, on_token=None, memory_state: dict = None) -> str:
     """Generate AI response using company's configured agent
     
     If orchestration is enabled, routes through the Mother agent for intelligent delegation.
@@ -133,6 +133,12 @@ async def generate_ai_response(messages: List[dict], settings: dict, conversatio
     
     Includes tiered verification: checks if sensitive info is requested and triggers
     verification flow if user is not verified.
+    
+    If response_meta is given, it is filled with the provider/model that answered
+    and the latency it saw. on_token (async, called with each text delta) receives
+    the Mother agent's answer as it streams; other paths only return the full text.
+    memory_state is the conversation's summary state (conversation_memory) when the
+    caller already has the conversation; otherwise it is loaded here.
     """
     try:
         # Get tenant_id from settings
@@ -151,9 +157,11 @@ async def generate_ai_response(messages: List[dict], settings: dict, conversatio
         if conversation_id and latest_user_message:
             try:
                 from services.verification_service import verification_service, VerificationService
+                from services.intent_matcher import intent_detector
                 
                 # Check if message requests sensitive information
-                if VerificationService.requires_verification(latest_user_message):
+                intent_matcher = await intent_detector.for_tenant(tenant_id)
+                if VerificationService.requires_verification(latest_user_message, intent_matcher):
                     # Check if conversation is verified
                     is_verified = await verification_service.is_conversation_verified(conversation_id)
                     
@@ -229,6 +237,11 @@ This helps protect your privacy and ensures I'm sharing information with the rig
         if not agent_config or not agent_config.get("agent_id"):
             return "I apologize, but no AI agent has been configured for your company yet. Please contact your administrator."
         
+        # Rolling summary + token-budgeted tail instead of a fixed message window
+        from services.conversation_memory import conversation_memory
+        if memory_state is None:
+            memory_state = await conversation_memory.get_state(conversation_id)
+        
         # Check if orchestration is enabled and try to use it
         orchestration = agent_config.get("orchestration", {})
         # Check for either admin or company-level mother agent
@@ -248,20 +261,20 @@ This helps protect your privacy and ensures I'm sharing information with the rig
                     
                     if latest_message:
                         # Build message history for context
-                        message_history = []
-                        for msg in messages[-10:]:
-                            role = "user" if msg.get("author_type") == "customer" else "assistant"
-                            message_history.append({"role": role, "content": msg.get("content", "")})
+                        message_history = conversation_memory.build_tail(messages, memory_state)
                         
                         # Process through orchestrator
                         result = await orchestrator.process_with_mother(
                             conversation_id=conversation_id or "unknown",
                             user_prompt=latest_message,
-                            message_history=message_history
+                            message_history=message_history,
+                            conversation_summary=memory_state.get("context_summary", ""),
+                            on_token=on_token
                         )
                         
                         if result.get("success"):
                             logger.info(f"Orchestration successful, delegated={result.get('delegated')}")
+                            await conversation_memory.record_turn(tenant_id, conversation_id, memory_state, orchestrator.mother_agent)
                             return result.get("response", "I apologize, but I couldn't process your request.")
                         else:
                             logger.warning(f"Orchestration failed: {result.get('error')}")
@@ -309,13 +322,7 @@ This helps protect your privacy and ensures I'm sharing information with the rig
         brand_name = settings.get("brand_name", "the company")
         
         # Build conversation history first to get latest message
-        conversation_messages = []
-        for msg in messages[-10:]:  # Last 10 messages for context
-            role = "user" if msg.get("author_type") == "customer" else "assistant"
-            conversation_messages.append({
-                "role": role,
-                "content": msg.get("content")
-            })
+        conversation_messages = conversation_memory.build_tail(messages, memory_state)
         
         # Get the latest user message for RAG retrieval
         latest_message = conversation_messages[-1]["content"] if conversation_messages else "Hello"
@@ -392,6 +399,9 @@ You are assisting customers for {brand_name}."""
             if agent_config.get("custom_instructions"):
                 base_prompt += f"\n\nCompany instructions:\n{agent_config['custom_instructions']}"
         
+        # Earlier turns are carried by the rolling summary
+        base_prompt += conversation_memory.summary_prompt(memory_state)
+        
         # Remove the latest message from history for proper context building
         history = []
         if len(conversation_messages) > 1:
@@ -409,72 +419,57 @@ You are assisting customers for {brand_name}."""
                 provider=provider,
                 base_system_prompt=base_prompt,
                 agent_config=agent,
-                max_iterations=3
+                max_iterations=3,
+                tenant_id=tenant_id
             )
             
             if wc_response:
+                await conversation_memory.record_turn(tenant_id, conversation_id, memory_state, agent)
                 return wc_response
         except Exception as e:
             logger.error(f"WooCommerce function calling error: {str(e)}")
             # Continue with standard generation if WooCommerce fails
         
-        # Generate response based on provider type
-        if provider["type"] == "openai":
-            import openai
-            client = openai.OpenAI(api_key=provider["api_key"])
-            
-            # Handle different model requirements
-            model_lower = agent["model"].lower()
-            newer_models = ["gpt-4o", "gpt-5", "o1", "o3"]
-            uses_new_param = any(model_prefix in model_lower for model_prefix in newer_models)
-            
-            restrictive_models = ["gpt-5", "o1", "o3"]
-            is_restrictive = any(model_prefix in model_lower for model_prefix in restrictive_models)
-            
-            # Build messages
-            api_messages = [{"role": "system", "content": base_prompt}]
-            api_messages.extend(history)
-            api_messages.append({"role": "user", "content": latest_message})
-            
-            params = {
-                "model": agent["model"],
-                "messages": api_messages
-            }
-            
-            # Add temperature if supported
-            if not is_restrictive:
-                params["temperature"] = agent["temperature"]
-            
-            # Add token limit
-            if uses_new_param:
-                params["max_completion_tokens"] = agent["max_tokens"]
-            else:
-                params["max_tokens"] = agent["max_tokens"]
-            
-            response = client.chat.completions.create(**params)
-            return response.choices[0].message.content
+        # Generate response over the agent's provider chain (primary + fallbacks)
+        from services.llm_router import provider_router, AllProvidersFailed
         
-        elif provider["type"] == "anthropic":
-            import anthropic
-            client = anthropic.Anthropic(api_key=provider["api_key"])
-            
-            # Build messages for Anthropic
-            api_messages = list(history)
-            api_messages.append({"role": "user", "content": latest_message})
-            
-            response = client.messages.create(
-                model=agent["model"],
-                max_tokens=agent["max_tokens"],
-                temperature=agent["temperature"],
-                system=base_prompt,
-                messages=api_messages
+        api_messages = list(history)
+        api_messages.append({"role": "user", "content": latest_message})
+        
+        try:
+            result = await provider_router.complete(
+                agent=agent,
+                system_prompt=base_prompt,
+                messages=api_messages,
+                tenant_id=tenant_id
             )
-            return response.content[0].text
+        except AllProvidersFailed as e:
+            logger.error(f"AI generation failed on every provider: {str(e)} attempts={e.attempts}")
+            return "I apologize, but I'm having trouble processing your request. Please try again or contact support."
         
-        else:
-            return "I apologize, but the configured AI provider is not supported yet."
+        if response_meta is not None:
+            response_meta.update({
+                "provider_id": result["provider_id"],
+                "provider_type": result["provider_type"],
+                "model": result["model"],
+                "latency_ms": result["latency_ms"],
+                "total_latency_ms": result["total_latency_ms"],
+                "hedged": result["hedged"],
+                "failover": result["failover"]
+            })
+        
+        if result["failover"]:
+            logger.info(f"Agent {agent['id']} answered by fallback {result['provider_type']}/{result['model']}")
+        
+        await conversation_memory.record_turn(tenant_id, conversation_id, memory_state, agent)
+        
+        return result["text"]
         
     except Exception as e:
+        from services.llm_governor import GovernorTimeout
+        if isinstance(e, GovernorTimeout):
+            logger.warning(f"AI generation deferred by LLM governor: {str(e)}")
+            return "We're experiencing high demand right now. Please give me a moment and try again."
         logger.error(f"AI generation error: {str(e)}")
         return "I apologize, but I'm having trouble processing your request. Please try again or contact support."
 
@@ -696,6 +691,10 @@ async def update_settings(settings_data: SettingsUpdate, current_user: dict = De
     await db.settings.update_one({"tenant_id": tenant_id}, {"$set": update_data})
     settings = await db.settings.find_one({"tenant_id": tenant_id}, {"_id": 0})
     
+    if "intent_phrases" in update_data:
+        from services.intent_matcher import intent_detector
+        intent_detector.invalidate(tenant_id)
+    
     # Mask the API key for security
     if settings.get("openai_api_key"):
         key = settings["openai_api_key"]
@@ -2693,6 +2692,7 @@ async def create_provider(
                 "name": provider_data.name,
                 "api_key": provider_data.api_key,
                 "base_url": provider_data.base_url,
+                "rate_limits": provider_data.rate_limits,
                 "is_active": True,
                 "updated_at": now
             }}
@@ -2706,6 +2706,7 @@ async def create_provider(
             "type": provider_data.type,
             "api_key": provider_data.api_key,
             "base_url": provider_data.base_url,
+            "rate_limits": provider_data.rate_limits,
             "is_active": True,
             "total_calls": 0,
             "total_tokens": 0,
@@ -2914,10 +2915,17 @@ async def create_agent(
         "version": 1,
         "is_active": True,
         "is_marketplace": agent_data.is_marketplace,
+        "fallback_chain": agent_data.fallback_chain,
+        "hedge_requests": agent_data.hedge_requests,
         "created_at": now,
         "updated_at": now,
         "created_by": admin_user["id"]
     }
+    # Unset budgets fall back to the router defaults
+    if agent_data.latency_budget_ms:
+        agent_doc["latency_budget_ms"] = agent_data.latency_budget_ms
+    if agent_data.hedge_delay_ms:
+        agent_doc["hedge_delay_ms"] = agent_data.hedge_delay_ms
     await db.agents.insert_one(agent_doc)
     
     # Create initial version
@@ -5018,7 +5026,7 @@ app.add_middleware(
     allow_origins=[origin.strip() for origin in cors_origins.split(',') if origin.strip()],
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Type", "Content-Length", "Content-Disposition", "X-Request-ID"],
+    expose_headers=["Content-Type", "Content-Length", "Content-Disposition", "X-Request-ID", "X-Next-Cursor"],
 )
 
 @app.on_event("startup")
@@ -5042,8 +5050,38 @@ async def startup_event():
             await rate_limiter.set_tenant_limit(tenant_id, limits)
     
     logger.info(f"Loaded {len(saved_limits)} rate limit configurations")
+    
+    # Background sentiment scoring (batched, off the request path)
+    from services.sentiment_pipeline import sentiment_pipeline
+    sentiment_pipeline.start()
+    
+    # Unread counter drift repair
+    from services.unread_counters import unread_counters
+    unread_counters.start()
+    
+    # Messaging presence heartbeats and batched presence broadcasts
+    from services.presence import presence_service
+    presence_service.start()
+    
+    # Buffered LLM token/cost/latency accounting
+    from services.llm_usage import llm_usage
+    llm_usage.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    from services.sentiment_pipeline import sentiment_pipeline
+    sentiment_pipeline.shutdown()
+    from services.unread_counters import unread_counters
+    unread_counters.shutdown()
+    from services.woocommerce_service import close_woocommerce_clients
+    await close_woocommerce_clients()
+    from services.shopify_service import close_shopify_clients
+    await close_shopify_clients()
+    from services.llm_usage import llm_usage
+    await llm_usage.shutdown()
+    from services.presence import presence_service
+    await presence_service.shutdown()
+    from services.realtime_bus import realtime_bus
+    await realtime_bus.close()
     from middleware.database import client
     client.close()
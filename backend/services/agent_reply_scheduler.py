@@ -0,0 +1,217 @@
+"""
+Agent Reply Scheduler - Bounded, paced delivery of channel agent replies
+
+Channel agents used to reply one after another, sleeping 1-5 seconds between
+replies inside an unbounded fire-and-forget coroutine. The scheduler instead
+starts every reply's generation immediately (capped per tenant by a semaphore)
+and only paces *delivery*: replies in a channel are posted in submission order,
+each after its own human-like delay following the previous one.
+
+When a newer human message arrives in a channel, replies triggered by older
+messages are cancelled - whether still generating, waiting for a slot or waiting
+to be delivered - so agents never post answers to a conversation that moved on.
+
+State is per process; each worker paces the replies it generated.
+"""
+import asyncio
+import logging
+import os
+import random
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_INFLIGHT_PER_TENANT = int(os.environ.get("AGENT_REPLY_MAX_INFLIGHT_PER_TENANT", "4"))
+CHANNEL_TRACKING_SIZE = 10000  # Channels whose latest human message time is remembered
+
+
+class ReplyJob:
+    """One agent reply: generated as soon as a slot is free, delivered in channel order"""
+
+    def __init__(
+        self,
+        tenant_id: str,
+        channel_id: str,
+        trigger_at: str,
+        generate: Callable[[], Awaitable[Any]],
+        deliver: Callable[[Any], Awaitable[None]],
+        delay: Tuple[float, float],
+        label: str
+    ):
+        self.id = str(uuid.uuid4())
+        self.tenant_id = tenant_id
+        self.channel_id = channel_id
+        self.trigger_at = trigger_at
+        self.generate = generate
+        self.deliver = deliver
+        self.delay = delay
+        self.label = label
+        self.task: Optional[asyncio.Task] = None
+        # Resolves with the generated reply (None if cancelled or failed)
+        self.generated: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Set once the job is finished, so the next reply in the channel can follow
+        self.done = asyncio.Event()
+
+
+class AgentReplyScheduler:
+    """Per-channel reply ordering with per-tenant generation limits"""
+
+    def __init__(self, max_inflight_per_tenant: int = MAX_INFLIGHT_PER_TENANT):
+        self.max_inflight_per_tenant = max_inflight_per_tenant
+        self._tenant_slots: Dict[str, asyncio.Semaphore] = {}
+        self._waiting: Dict[str, int] = {}
+        self._generating: Dict[str, int] = {}
+        self._channel_jobs: Dict[str, Set[ReplyJob]] = {}
+        self._channel_tail: Dict[str, ReplyJob] = {}
+        self._latest_message_at: "OrderedDict[str, str]" = OrderedDict()
+        self._counters = {
+            "submitted": 0,
+            "delivered": 0,
+            "cancelled_stale": 0,
+            "empty": 0,
+            "failed": 0
+        }
+
+    def note_message(self, channel_id: str, created_at: str):
+        """Record a new human message in a channel and cancel replies to older messages"""
+        self._latest_message_at[channel_id] = created_at
+        self._latest_message_at.move_to_end(channel_id)
+        if len(self._latest_message_at) > CHANNEL_TRACKING_SIZE:
+            self._latest_message_at.popitem(last=False)
+
+        for job in list(self._channel_jobs.get(channel_id, ())):
+            if job.trigger_at < created_at and job.task and not job.task.done():
+                job.task.cancel()
+
+    def is_stale(self, channel_id: str, trigger_at: str) -> bool:
+        latest = self._latest_message_at.get(channel_id)
+        return latest is not None and latest > trigger_at
+
+    def submit(
+        self,
+        tenant_id: str,
+        channel_id: str,
+        trigger_message: Dict[str, Any],
+        generate: Callable[[], Awaitable[Any]],
+        deliver: Callable[[Any], Awaitable[None]],
+        delay: Tuple[float, float] = (0.0, 0.0),
+        label: str = ""
+    ) -> ReplyJob:
+        """
+        Schedule an agent reply.
+
+        Args:
+            generate: Produces the reply (None to skip delivery)
+            deliver: Posts the generated reply
+            delay: Random pause (min, max seconds) after the previous reply in the channel
+            label: Name used in logs (e.g. the agent name)
+
+        Returns:
+            The job; await ``job.generated`` for the reply content
+        """
+        job = ReplyJob(
+            tenant_id,
+            channel_id,
+            trigger_message.get("created_at", ""),
+            generate,
+            deliver,
+            delay,
+            label
+        )
+        self._counters["submitted"] += 1
+
+        previous = self._channel_tail.get(channel_id)
+        self._channel_tail[channel_id] = job
+        self._channel_jobs.setdefault(channel_id, set()).add(job)
+        job.task = asyncio.create_task(self._run(job, previous))
+        job.task.add_done_callback(lambda task: self._finish(job, task))
+        return job
+
+    async def _run(self, job: ReplyJob, previous: Optional[ReplyJob]):
+        try:
+            if self.is_stale(job.channel_id, job.trigger_at):
+                raise asyncio.CancelledError()
+
+            result = await self._generate(job)
+            job.generated.set_result(result)
+            if result is None:
+                self._counters["empty"] += 1
+                return
+
+            # Deliver in submission order, paced after the previous reply
+            if previous is not None:
+                await previous.done.wait()
+            if job.delay[1] > 0:
+                await asyncio.sleep(random.uniform(*job.delay))
+
+            if self.is_stale(job.channel_id, job.trigger_at):
+                raise asyncio.CancelledError()
+            await job.deliver(result)
+            self._counters["delivered"] += 1
+        except asyncio.CancelledError:
+            self._counters["cancelled_stale"] += 1
+            logger.info(f"Cancelled stale reply {job.label or job.id} in channel {job.channel_id}")
+        except Exception as e:
+            self._counters["failed"] += 1
+            logger.error(f"Agent reply {job.label or job.id} failed: {str(e)}")
+
+    async def _generate(self, job: ReplyJob) -> Any:
+        """Run the generation under the tenant's in-flight limit"""
+        slots = self._tenant_slots.get(job.tenant_id)
+        if slots is None:
+            slots = self._tenant_slots[job.tenant_id] = asyncio.Semaphore(self.max_inflight_per_tenant)
+
+        self._waiting[job.tenant_id] = self._waiting.get(job.tenant_id, 0) + 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting[job.tenant_id] -= 1
+
+        self._generating[job.tenant_id] = self._generating.get(job.tenant_id, 0) + 1
+        try:
+            if self.is_stale(job.channel_id, job.trigger_at):
+                raise asyncio.CancelledError()
+            return await job.generate()
+        finally:
+            self._generating[job.tenant_id] -= 1
+            slots.release()
+
+    def _finish(self, job: ReplyJob, task: asyncio.Task):
+        # Also runs for tasks cancelled before they started
+        if task.cancelled():
+            self._counters["cancelled_stale"] += 1
+        if not job.generated.done():
+            job.generated.set_result(None)
+        job.done.set()
+
+        jobs = self._channel_jobs.get(job.channel_id)
+        if jobs is not None:
+            jobs.discard(job)
+            if not jobs:
+                del self._channel_jobs[job.channel_id]
+        if self._channel_tail.get(job.channel_id) is job:
+            del self._channel_tail[job.channel_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue metrics: totals plus current per-tenant generation and channel backlog"""
+        tenants = {}
+        for tenant_id in set(self._waiting) | set(self._generating):
+            waiting = self._waiting.get(tenant_id, 0)
+            generating = self._generating.get(tenant_id, 0)
+            if waiting or generating:
+                tenants[tenant_id] = {"generating": generating, "waiting_for_slot": waiting}
+
+        return {
+            "max_inflight_per_tenant": self.max_inflight_per_tenant,
+            "pending_replies": sum(len(jobs) for jobs in self._channel_jobs.values()),
+            "active_channels": len(self._channel_jobs),
+            "tenants": tenants,
+            "totals": dict(self._counters)
+        }
+
+
+# Global agent reply scheduler instance
+agent_reply_scheduler = AgentReplyScheduler()
@@ -1,11 +1,18 @@
 """
 AI Function Calling Service for WooCommerce Integration
 Enables agents to perform actions on behalf of customers
+
+Tools are passed to the model natively (OpenAI tools / Anthropic tool_use). All
+tool calls from one model response run concurrently, each with its own timeout,
+and their results go back to the model in a single follow-up turn.
 """
+import asyncio
 import json
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from services.woocommerce_service import get_woocommerce_client
+from services.llm_governor import llm_governor, estimate_tokens, GovernorTimeout
+from services.llm_usage import llm_usage
 
 logger = logging.getLogger(__name__)
 
@@ -15,45 +22,61 @@ WOOCOMMERCE_TOOLS = [
         "name": "search_orders",
         "description": "Search for customer orders by email address. Returns a list of orders.",
         "parameters": {
-            "email": "Customer's email address"
+            "type": "object",
+            "properties": {
+                "email": {"type": "string", "description": "Customer's email address"}
+            },
+            "required": ["email"]
         }
     },
     {
         "name": "get_order_details",
-        "description": "Get detailed information about a specific order including status, items, and shipping info.",
+        "description": "Get detailed information about one or more orders including status, items, and shipping info.",
         "parameters": {
-            "order_id": "WooCommerce order ID (number)"
+            "type": "object",
+            "properties": {
+                "order_id": {"type": "integer", "description": "WooCommerce order ID"},
+                "order_ids": {
+                    "type": "array",
+                    "items": {"type": "integer"},
+                    "description": "Several order IDs to fetch together (instead of order_id)"
+                }
+            }
         }
     },
     {
         "name": "create_refund",
         "description": "Process a refund for an order. Use this when customer requests a refund.",
         "parameters": {
-            "order_id": "WooCommerce order ID (number)",
-            "amount": "Refund amount (optional, if not provided will refund full order)",
-            "reason": "Reason for refund (optional, defaults to 'Customer request')"
+            "type": "object",
+            "properties": {
+                "order_id": {"type": "integer", "description": "WooCommerce order ID"},
+                "amount": {"type": "string", "description": "Refund amount (optional, if not provided will refund full order)"},
+                "reason": {"type": "string", "description": "Reason for refund (optional, defaults to 'Customer request')"}
+            },
+            "required": ["order_id"]
         }
     }
 ]
 
+# Per-tool execution timeouts (seconds); writes get longer since they can't be retried blindly
+TOOL_TIMEOUTS = {
+    "search_orders": 15,
+    "get_order_details": 15,
+    "create_refund": 30
+}
+DEFAULT_TOOL_TIMEOUT = 15
+
 
 def get_woocommerce_system_prompt() -> str:
     """Get system prompt instructions for WooCommerce-enabled agents"""
-    tools_desc = ""
-    for tool in WOOCOMMERCE_TOOLS:
-        params_desc = ", ".join([f"{k}: {v}" for k, v in tool["parameters"].items()])
-        tools_desc += f"\n- {tool['name']}({params_desc}): {tool['description']}"
-    
-    return f"""
+    return """
 WOOCOMMERCE INTEGRATION ENABLED:
-You have access to the following WooCommerce tools to help customers:{tools_desc}
-
-When a customer asks about orders, refunds, or order status, you can use these tools.
+You have access to WooCommerce tools to help customers with orders, refunds, and order status.
 
-To use a tool, respond with a JSON object in this format:
-{{"function": "tool_name", "parameters": {{"param1": "value1", "param2": "value2"}}}}
-
-After using a tool, you'll receive the results. Then provide a natural, conversational response to the customer based on those results.
+You can call several tools at once when you need several pieces of information (for example,
+details of two different orders). After the tools run you'll receive all the results; then
+provide a natural, conversational response to the customer based on those results.
 
 IMPORTANT:
 - Always verify customer identity by asking for their email before searching orders
@@ -102,6 +125,20 @@ async def execute_woocommerce_function(
             }
         
         elif function_name == "get_order_details":
+            order_ids = parameters.get("order_ids")
+            if order_ids:
+                # Several orders requested at once - fetch them concurrently
+                if isinstance(order_ids, str):
+                    order_ids = [o for o in order_ids.replace(" ", "").split(",") if o]
+                orders = await wc_client.get_orders_details(int(o) for o in order_ids)
+                found = {order_id: order for order_id, order in orders.items() if order}
+                missing = [order_id for order_id, order in orders.items() if not order]
+                return {
+                    "success": bool(found),
+                    "data": list(found.values()),
+                    "message": f"Retrieved details for {len(found)} orders" + (f"; not found: {missing}" if missing else "")
+                }
+            
             order_id = parameters.get("order_id")
             if not order_id:
                 return {"success": False, "error": "order_id parameter required"}
@@ -148,47 +185,181 @@ async def execute_woocommerce_function(
         }
 
 
-def detect_function_call(ai_response: str) -> Optional[Dict[str, Any]]:
+async def run_tool_calls(
+    tool_calls: List[Dict[str, Any]],
+    agent_config: Dict[str, Any]
+) -> List[Tuple[str, Dict[str, Any]]]:
     """
-    Detect if AI response contains a function call
+    Execute all tool calls from one model response concurrently
     
-    Args:
-        ai_response: AI generated response text
-        
     Returns:
-        Dict with function name and parameters if detected, None otherwise
+        [(call_id, result)] in the order of tool_calls
     """
+    async def run(call: Dict[str, Any]) -> Dict[str, Any]:
+        timeout = TOOL_TIMEOUTS.get(call["name"], DEFAULT_TOOL_TIMEOUT)
+        try:
+            return await asyncio.wait_for(
+                execute_woocommerce_function(call["name"], call["arguments"], agent_config),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Tool {call['name']} timed out after {timeout}s")
+            return {"success": False, "error": f"{call['name']} timed out"}
+    
+    logger.info(f"Executing {len(tool_calls)} tool call(s): {[c['name'] for c in tool_calls]}")
+    results = await asyncio.gather(*(run(call) for call in tool_calls))
+    return [(call["id"], result) for call, result in zip(tool_calls, results)]
+
+
+def _parse_tool_arguments(raw: Any) -> Dict[str, Any]:
+    """Parse a tool-call argument string (empty or malformed -> {})"""
+    if isinstance(raw, dict):
+        return raw
+    if not raw:
+        return {}
     try:
-        # Try to parse as JSON
-        response_stripped = ai_response.strip()
+        parsed = json.loads(raw)
+        return parsed if isinstance(parsed, dict) else {}
+    except json.JSONDecodeError:
+        logger.warning(f"Could not parse tool arguments: {str(raw)[:200]}")
+        return {}
+
+
+async def _call_llm_with_tools(
+    agent: Dict[str, Any],
+    provider: Dict[str, Any],
+    system_prompt: str,
+    messages: List[Dict[str, Any]],
+    allow_tools: bool,
+    tenant_id: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    One model round trip with the WooCommerce tools attached
+    
+    Returns:
+        {"text", "tool_calls": [{"id", "name", "arguments"}], "assistant_message"},
+        or None if the provider type is not supported
+    """
+    if provider["type"] == "openai":
+        import openai
+        client = openai.AsyncOpenAI(api_key=provider["api_key"])
         
-        # Check if response looks like a JSON object
-        if response_stripped.startswith("{") and response_stripped.endswith("}"):
-            try:
-                parsed = json.loads(response_stripped)
-                if "function" in parsed and "parameters" in parsed:
-                    return parsed
-            except json.JSONDecodeError:
-                pass
+        api_messages = [{"role": "system", "content": system_prompt}]
+        api_messages.extend(messages)
         
-        # Check for function call pattern in text
-        if "```json" in response_stripped:
-            try:
-                # Extract JSON from markdown code block
-                json_start = response_stripped.find("```json") + 7
-                json_end = response_stripped.find("```", json_start)
-                json_str = response_stripped[json_start:json_end].strip()
-                parsed = json.loads(json_str)
-                if "function" in parsed and "parameters" in parsed:
-                    return parsed
-            except (json.JSONDecodeError, ValueError):
-                pass
+        # Check for restrictive models
+        model_lower = agent["model"].lower()
+        newer_models = ["gpt-4o", "gpt-5", "o1", "o3"]
+        uses_new_param = any(model_prefix in model_lower for model_prefix in newer_models)
+        restrictive_models = ["gpt-5", "o1", "o3"]
+        is_restrictive = any(model_prefix in model_lower for model_prefix in restrictive_models)
         
-        return None
+        params = {
+            "model": agent["model"],
+            "messages": api_messages,
+            "tools": [{"type": "function", "function": tool} for tool in WOOCOMMERCE_TOOLS],
+            "tool_choice": "auto" if allow_tools else "none"
+        }
+        
+        if not is_restrictive:
+            params["temperature"] = agent["temperature"]
+        
+        if uses_new_param:
+            params["max_completion_tokens"] = agent["max_tokens"]
+        else:
+            params["max_tokens"] = agent["max_tokens"]
+        
+        estimated = estimate_tokens(api_messages, json.dumps(WOOCOMMERCE_TOOLS), agent["max_tokens"])
+        async with llm_governor.slot(provider, agent["model"], tenant_id, estimated) as slot:
+            async with llm_usage.track(tenant_id, agent.get("id"), "openai", agent["model"], "woocommerce_tools") as call:
+                response = await client.chat.completions.create(**params)
+                call.set_usage_from(getattr(response, "usage", None))
+            if getattr(response, "usage", None):
+                slot.record_usage(response.usage.total_tokens)
+        
+        message = response.choices[0].message
+        raw_calls = message.tool_calls or []
+        assistant_message: Dict[str, Any] = {"role": "assistant", "content": message.content}
+        if raw_calls:
+            assistant_message["tool_calls"] = [
+                {"id": c.id, "type": "function", "function": {"name": c.function.name, "arguments": c.function.arguments}}
+                for c in raw_calls
+            ]
+        return {
+            "text": message.content or "",
+            "tool_calls": [
+                {"id": c.id, "name": c.function.name, "arguments": _parse_tool_arguments(c.function.arguments)}
+                for c in raw_calls
+            ],
+            "assistant_message": assistant_message
+        }
     
-    except Exception as e:
-        logger.error(f"Error detecting function call: {str(e)}")
-        return None
+    elif provider["type"] == "anthropic":
+        import anthropic
+        client = anthropic.AsyncAnthropic(api_key=provider["api_key"])
+        
+        estimated = estimate_tokens(messages, system_prompt + json.dumps(WOOCOMMERCE_TOOLS), agent["max_tokens"])
+        async with llm_governor.slot(provider, agent["model"], tenant_id, estimated) as slot:
+            async with llm_usage.track(tenant_id, agent.get("id"), "anthropic", agent["model"], "woocommerce_tools") as call:
+                response = await client.messages.create(
+                    model=agent["model"],
+                    max_tokens=agent["max_tokens"],
+                    temperature=agent["temperature"],
+                    system=system_prompt,
+                    messages=messages,
+                    tools=[
+                        {"name": t["name"], "description": t["description"], "input_schema": t["parameters"]}
+                        for t in WOOCOMMERCE_TOOLS
+                    ],
+                    tool_choice={"type": "auto" if allow_tools else "none"}
+                )
+                call.set_usage_from(getattr(response, "usage", None))
+            if getattr(response, "usage", None):
+                slot.record_usage(response.usage.input_tokens + response.usage.output_tokens)
+        
+        return {
+            "text": "".join(block.text for block in response.content if block.type == "text"),
+            "tool_calls": [
+                {"id": block.id, "name": block.name, "arguments": dict(block.input or {})}
+                for block in response.content if block.type == "tool_use"
+            ],
+            "assistant_message": {
+                "role": "assistant",
+                "content": [block.model_dump(exclude_none=True) for block in response.content]
+            }
+        }
+    
+    return None
+
+
+def _append_tool_results(
+    provider: Dict[str, Any],
+    messages: List[Dict[str, Any]],
+    turn: Dict[str, Any],
+    tool_results: List[Tuple[str, Dict[str, Any]]]
+):
+    """Append the assistant tool-call message and all tool results in the provider's format"""
+    messages.append(turn["assistant_message"])
+    if provider["type"] == "anthropic":
+        messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": call_id,
+                    "content": json.dumps(result, default=str),
+                    "is_error": not result.get("success", False)
+                }
+                for call_id, result in tool_results
+            ]
+        })
+    else:
+        for call_id, result in tool_results:
+            messages.append({
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": json.dumps(result, default=str)
+            })
 
 
 async def generate_ai_response_with_tools(
@@ -198,11 +369,16 @@ async def generate_ai_response_with_tools(
     provider: Dict[str, Any],
     base_system_prompt: str,
     agent_config: Dict[str, Any],
-    max_iterations: int = 3
+    max_iterations: int = 3,
+    tenant_id: Optional[str] = None
 ) -> str:
     """
     Generate AI response with WooCommerce function calling support
     
+    Every model response may request several tools; they run concurrently and
+    all results are returned in one follow-up turn. The last iteration disallows
+    tools so the model always ends with an answer.
+    
     Args:
         latest_message: Latest user message
         conversation_history: List of previous messages
@@ -210,7 +386,8 @@ async def generate_ai_response_with_tools(
         provider: Provider configuration
         base_system_prompt: Base system prompt
         agent_config: Agent config (may contain WooCommerce settings)
-        max_iterations: Maximum function calling iterations
+        max_iterations: Maximum model round trips
+        tenant_id: Tenant making the call (used for fair LLM queueing)
         
     Returns:
         Final AI response string
@@ -224,122 +401,35 @@ async def generate_ai_response_with_tools(
     # Add WooCommerce tools to system prompt
     enhanced_prompt = base_system_prompt + "\n\n" + get_woocommerce_system_prompt()
     
-    # Track function call iterations
-    iteration = 0
-    current_history = list(conversation_history)
-    current_message = latest_message
-    function_results = []
+    messages: List[Dict[str, Any]] = list(conversation_history)
+    messages.append({"role": "user", "content": latest_message})
     
-    while iteration < max_iterations:
-        iteration += 1
-        
-        # Generate AI response
+    for iteration in range(1, max_iterations + 1):
         try:
-            if provider["type"] == "openai":
-                import openai
-                client = openai.OpenAI(api_key=provider["api_key"])
-                
-                # Build messages
-                api_messages = [{"role": "system", "content": enhanced_prompt}]
-                api_messages.extend(current_history)
-                
-                # Add function results if any
-                if function_results:
-                    results_text = "\n\n".join([
-                        f"Function: {r['function']}\nResult: {json.dumps(r['result'], indent=2)}"
-                        for r in function_results
-                    ])
-                    api_messages.append({
-                        "role": "system",
-                        "content": f"Function execution results:\n{results_text}"
-                    })
-                
-                api_messages.append({"role": "user", "content": current_message})
-                
-                # Check for restrictive models
-                model_lower = agent["model"].lower()
-                newer_models = ["gpt-4o", "gpt-5", "o1", "o3"]
-                uses_new_param = any(model_prefix in model_lower for model_prefix in newer_models)
-                restrictive_models = ["gpt-5", "o1", "o3"]
-                is_restrictive = any(model_prefix in model_lower for model_prefix in restrictive_models)
-                
-                params = {
-                    "model": agent["model"],
-                    "messages": api_messages
-                }
-                
-                if not is_restrictive:
-                    params["temperature"] = agent["temperature"]
-                
-                if uses_new_param:
-                    params["max_completion_tokens"] = agent["max_tokens"]
-                else:
-                    params["max_tokens"] = agent["max_tokens"]
-                
-                response = client.chat.completions.create(**params)
-                ai_response = response.choices[0].message.content
-                
-            elif provider["type"] == "anthropic":
-                import anthropic
-                client = anthropic.Anthropic(api_key=provider["api_key"])
-                
-                api_messages = list(current_history)
-                
-                # Add function results if any
-                if function_results:
-                    results_text = "\n\n".join([
-                        f"Function: {r['function']}\nResult: {json.dumps(r['result'], indent=2)}"
-                        for r in function_results
-                    ])
-                    api_messages.append({
-                        "role": "user",
-                        "content": f"Function execution results:\n{results_text}"
-                    })
-                
-                api_messages.append({"role": "user", "content": current_message})
-                
-                response = client.messages.create(
-                    model=agent["model"],
-                    max_tokens=agent["max_tokens"],
-                    temperature=agent["temperature"],
-                    system=enhanced_prompt,
-                    messages=api_messages
-                )
-                ai_response = response.content[0].text
-            
-            else:
+            turn = await _call_llm_with_tools(
+                agent,
+                provider,
+                enhanced_prompt,
+                messages,
+                allow_tools=iteration < max_iterations,
+                tenant_id=tenant_id
+            )
+            if turn is None:
                 return "I apologize, but the configured AI provider is not supported for WooCommerce integration."
             
-            # Check if response contains a function call
-            function_call = detect_function_call(ai_response)
+            if not turn["tool_calls"]:
+                return turn["text"]
             
-            if function_call:
-                # Execute the function
-                logger.info(f"Executing function: {function_call['function']}")
-                result = await execute_woocommerce_function(
-                    function_call["function"],
-                    function_call["parameters"],
-                    agent_config
-                )
-                
-                # Store the result
-                function_results.append({
-                    "function": function_call["function"],
-                    "parameters": function_call["parameters"],
-                    "result": result
-                })
-                
-                # Continue the loop with the function result
-                current_message = "Based on the function result, provide a natural response to the customer."
-                continue
-            else:
-                # No function call detected, return the response
-                return ai_response
+            tool_results = await run_tool_calls(turn["tool_calls"], agent_config)
+            _append_tool_results(provider, messages, turn, tool_results)
         
+        except GovernorTimeout as e:
+            logger.warning(f"Function calling deferred by LLM governor: {str(e)}")
+            return "We're experiencing high demand right now. Please give me a moment and try again."
         except Exception as e:
             logger.error(f"Error in function calling iteration {iteration}: {str(e)}")
             return "I apologize, but I'm having trouble processing your request. Please try again or contact support."
     
-    # Max iterations reached
+    # Unreachable in practice: the last iteration cannot call tools
     logger.warning(f"Max function calling iterations ({max_iterations}) reached")
-    return ai_response if 'ai_response' in locals() else "I apologize, but I'm having trouble processing your request."
+    return "I apologize, but I'm having trouble processing your request."
@@ -0,0 +1,207 @@
+"""
+Conversation Memory - Rolling summaries with a token-budgeted recent tail
+
+Rather than resending a fixed last-N message window every turn, AI prompts get:
+- a rolling summary of everything older than the recent tail, stored on the
+  conversation (context_summary, context_summary_until, context_summary_count)
+  and refreshed in the background every SUMMARY_EVERY_N_TURNS AI turns
+- the newest unsummarized messages that fit within TAIL_TOKEN_BUDGET
+
+This keeps per-turn prompt size bounded and roughly constant regardless of
+conversation length.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TAIL_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TAIL_TOKEN_BUDGET", "1500"))
+TAIL_MAX_MESSAGES = 16           # Upper bound on messages fetched/sent as the tail
+TAIL_KEEP_MESSAGES = 6           # Messages left out of the summary on each refresh
+SUMMARY_EVERY_N_TURNS = int(os.environ.get("CONVERSATION_SUMMARY_EVERY_N_TURNS", "4"))
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_BATCH_LIMIT = 200        # Max unsummarized messages folded in per refresh
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a customer support conversation.
+Update the existing summary with the new messages. Keep it under 150 words.
+Preserve facts the assistant will need later: the customer's name, email, order numbers,
+products, the problem, what has been tried or promised, and anything still unresolved.
+Write plain prose in the third person. Do not add commentary."""
+
+MEMORY_PROJECTION = {
+    "_id": 0,
+    "context_summary": 1,
+    "context_summary_until": 1,
+    "context_summary_count": 1,
+    "context_turns_since_summary": 1
+}
+
+
+def _message_tokens(content: str) -> int:
+    """Rough token estimate (~4 chars per token plus role framing)"""
+    return len(content or "") // 4 + 4
+
+
+class ConversationMemory:
+    """Builds bounded prompt context and keeps rolling summaries up to date"""
+
+    def __init__(self):
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get_state(self, conversation_id: str) -> Dict[str, Any]:
+        """Load the summary fields stored on the conversation"""
+        if not conversation_id:
+            return {}
+        conversation = await db.conversations.find_one({"id": conversation_id}, MEMORY_PROJECTION)
+        return conversation or {}
+
+    @staticmethod
+    def tail_query(conversation_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Mongo filter for messages not yet folded into the summary"""
+        query: Dict[str, Any] = {"conversation_id": conversation_id}
+        if state.get("context_summary_until"):
+            query["created_at"] = {"$gt": state["context_summary_until"]}
+        return query
+
+    @staticmethod
+    def build_tail(
+        messages: List[Dict[str, Any]],
+        state: Optional[Dict[str, Any]] = None,
+        token_budget: int = TAIL_TOKEN_BUDGET
+    ) -> List[Dict[str, str]]:
+        """
+        Pick the newest unsummarized messages that fit the token budget.
+
+        Args:
+            messages: Message docs in chronological order
+            state: Conversation memory state from get_state()
+            token_budget: Max estimated tokens for the tail
+
+        Returns:
+            Chat messages ({role, content}) in chronological order. The newest
+            message is always included even if it alone exceeds the budget.
+        """
+        until = (state or {}).get("context_summary_until")
+        tail = []
+        used = 0
+        for msg in reversed(messages):
+            if until and msg.get("created_at") and msg["created_at"] <= until:
+                break
+            content = msg.get("content") or ""
+            cost = _message_tokens(content)
+            if tail and (used + cost > token_budget or len(tail) >= TAIL_MAX_MESSAGES):
+                break
+            used += cost
+            role = "user" if msg.get("author_type") == "customer" else "assistant"
+            tail.append({"role": role, "content": content})
+        tail.reverse()
+        return tail
+
+    @staticmethod
+    def summary_prompt(state: Dict[str, Any]) -> str:
+        """System prompt section carrying the rolling summary (empty if none)"""
+        summary = (state or {}).get("context_summary")
+        if not summary:
+            return ""
+        return f"\n\nSummary of the earlier conversation:\n{summary}"
+
+    async def record_turn(
+        self,
+        tenant_id: str,
+        conversation_id: str,
+        state: Dict[str, Any],
+        agent: Dict[str, Any]
+    ):
+        """Count an AI turn and schedule a summary refresh every N turns"""
+        if not conversation_id or not agent:
+            return
+        try:
+            await db.conversations.update_one(
+                {"id": conversation_id},
+                {"$inc": {"context_turns_since_summary": 1}}
+            )
+        except Exception as e:
+            logger.warning(f"Could not record conversation turn: {str(e)}")
+            return
+
+        turns = (state.get("context_turns_since_summary") or 0) + 1
+        if turns >= SUMMARY_EVERY_N_TURNS and conversation_id not in self._refreshing:
+            self._refreshing.add(conversation_id)
+            task = asyncio.create_task(self._refresh(tenant_id, conversation_id, agent))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, tenant_id: str, conversation_id: str, agent: Dict[str, Any]):
+        """Fold messages older than the recent tail into the rolling summary"""
+        try:
+            state = await self.get_state(conversation_id)
+            pending = await db.messages.find(
+                self.tail_query(conversation_id, state),
+                {"_id": 0, "author_type": 1, "content": 1, "created_at": 1}
+            ).sort("created_at", 1).to_list(SUMMARY_BATCH_LIMIT)
+
+            to_summarize = pending[:-TAIL_KEEP_MESSAGES] if len(pending) > TAIL_KEEP_MESSAGES else []
+            if not to_summarize:
+                # Nothing old enough yet: count turns afresh rather than re-checking every turn
+                await db.conversations.update_one(
+                    {"id": conversation_id, "context_summary_until": state.get("context_summary_until")},
+                    {"$set": {"context_turns_since_summary": 0}}
+                )
+                return
+
+            lines = []
+            for msg in to_summarize:
+                role = "Customer" if msg.get("author_type") == "customer" else "Support"
+                lines.append(f"{role}: {msg.get('content', '')}")
+
+            prompt = f"""Existing summary:
+{state.get('context_summary') or '(none yet)'}
+
+New messages:
+{chr(10).join(lines)}
+
+Updated summary:"""
+
+            from services.llm_router import provider_router
+            result = await provider_router.complete(
+                agent=agent,
+                system_prompt=SUMMARY_SYSTEM_PROMPT,
+                messages=[{"role": "user", "content": prompt}],
+                tenant_id=tenant_id,
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                feature="summary"
+            )
+            summary = (result.get("text") or "").strip()
+            if not summary:
+                return
+
+            # Guard on the previous watermark so concurrent refreshes can't regress it
+            await db.conversations.update_one(
+                {"id": conversation_id, "context_summary_until": state.get("context_summary_until")},
+                {
+                    "$set": {
+                        "context_summary": summary,
+                        "context_summary_until": to_summarize[-1]["created_at"],
+                        "context_summary_updated_at": datetime.now(timezone.utc).isoformat(),
+                        "context_turns_since_summary": 0
+                    },
+                    "$inc": {"context_summary_count": len(to_summarize)}
+                }
+            )
+            logger.info(f"Refreshed summary for conversation {conversation_id} (+{len(to_summarize)} messages)")
+        except Exception as e:
+            logger.error(f"Conversation summary refresh failed for {conversation_id}: {str(e)}")
+        finally:
+            self._refreshing.discard(conversation_id)
+
+
+# Global conversation memory instance
+conversation_memory = ConversationMemory()
@@ -0,0 +1,87 @@
+"""
+Conversation Turns - Unit of work for persisting support conversation messages
+
+A widget turn used to be a chain of sequential round trips: read the
+conversation, insert the customer message, update the conversation, then insert
+the AI reply and update the conversation again. A turn now collects its
+messages and commits them with two writes: one atomic update of the
+conversation summary (``last_message``, ``last_message_at``, ``message_count``),
+then one insert for the messages. The update is scoped to the tenant and
+returns the conversation as it was before the turn, which replaces the separate
+read and the ownership check: messages are only inserted once it matched.
+
+``message_count`` counts customer, AI and agent messages; system notices
+(mode changes, transfers) don't touch the summary.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+
+class ConversationTurn:
+    """Messages of one conversation turn, written together on commit"""
+
+    def __init__(self, conversation_id: str, tenant_id: Optional[str] = None):
+        self.conversation_id = conversation_id
+        self.tenant_id = tenant_id
+        self._messages: List[Dict[str, Any]] = []
+
+    def add_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self._messages.append(message)
+        return message
+
+    async def commit(
+        self,
+        before_insert: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **conversation_fields
+    ) -> Optional[Dict[str, Any]]:
+        """Insert the pending messages and update the conversation summary
+
+        Extra keyword arguments are ``$set`` on the conversation (e.g.
+        ``status="open"``). before_insert is called with the conversation
+        once it matched, before the messages are inserted, so they can still
+        be finished from conversation fields. Returns the conversation as it
+        was before this commit, or None (and nothing is written) if it
+        doesn't exist in the tenant.
+        """
+        messages, self._messages = self._messages, []
+        if not messages:
+            return None
+
+        last = messages[-1]
+        update = {
+            "$set": {
+                "last_message": last["content"][:LAST_MESSAGE_PREVIEW_LENGTH],
+                "last_message_at": last["created_at"],
+                "updated_at": last["created_at"],
+                **conversation_fields
+            },
+            "$inc": {"message_count": len(messages)}
+        }
+        conversation_filter = {"id": self.conversation_id}
+        if self.tenant_id:
+            conversation_filter["tenant_id"] = self.tenant_id
+
+        conversation = await db.conversations.find_one_and_update(
+            conversation_filter,
+            update,
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if conversation is None:
+            logger.warning(f"Dropped {len(messages)} messages for missing conversation {self.conversation_id}")
+            return None
+
+        if before_insert:
+            before_insert(conversation)
+        await db.messages.insert_many(messages)
+        for message in messages:
+            message.pop("_id", None)
+        return conversation
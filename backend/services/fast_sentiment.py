@@ -0,0 +1,193 @@
+"""
+Fast Sentiment - In-process lexicon sentiment scoring for the per-message hot path
+
+A VADER-style scorer: word valences from a lexicon, adjusted for negation,
+intensifiers/dampeners, ALL-CAPS emphasis, "but" contrast, exclamation marks
+and emoji. Runs in microseconds, so every customer message gets a tone score
+without an LLM call (the LLM is only used by the batch sentiment pipeline).
+
+Lexicons are per language. English is built in; more can be added with
+register_lexicon() or by dropping <lang>.json files into SENTIMENT_LEXICON_DIR
+({"words": {...}, "negations": [...], "boosters": {...}}).
+"""
+import json
+import logging
+import math
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Scoring constants (from VADER)
+BOOSTER_INCREMENT = 0.293
+CAPS_INCREMENT = 0.733
+NEGATION_SCALAR = -0.74
+EXCLAMATION_INCREMENT = 0.292
+MAX_EXCLAMATIONS = 4
+NORMALIZATION_ALPHA = 15
+NEGATION_WINDOW = 3
+
+EN_WORDS = {
+    # Negative
+    "angry": -3.0, "annoyed": -2.0, "annoying": -2.2, "awful": -3.1, "bad": -2.5,
+    "broken": -2.0, "cancel": -1.0, "complain": -1.8, "complaint": -1.9, "confused": -1.3,
+    "crap": -2.8, "damaged": -2.0, "disappointed": -2.3, "disappointing": -2.3,
+    "disgusting": -3.0, "dissatisfied": -2.4, "error": -1.4, "fail": -2.4, "failed": -2.4,
+    "fraud": -3.0, "frustrated": -2.4, "frustrating": -2.6, "furious": -3.3, "garbage": -2.8,
+    "hate": -3.0, "hated": -3.0, "horrible": -3.2, "incompetent": -2.8, "joke": -1.0,
+    "lied": -2.6, "lost": -1.3, "mad": -2.2, "missing": -1.2, "never": -0.5,
+    "pathetic": -2.9, "poor": -2.1, "problem": -1.7, "refund": -0.6, "ridiculous": -2.3,
+    "rude": -2.5, "sad": -2.1, "scam": -3.1, "slow": -1.3, "stupid": -2.6, "sucks": -2.8,
+    "terrible": -3.1, "unacceptable": -2.9, "unhappy": -2.4, "upset": -2.2, "useless": -2.6,
+    "waste": -2.2, "wasted": -2.3, "worse": -2.6, "worst": -3.2, "wrong": -2.0,
+    "lawyer": -1.5, "sue": -2.0, "ignored": -2.1, "waiting": -0.8, "delayed": -1.5,
+    # Positive
+    "amazing": 2.8, "appreciate": 2.2, "appreciated": 2.2, "awesome": 3.1, "best": 3.0,
+    "brilliant": 2.8, "excellent": 3.0, "fantastic": 3.1, "fast": 1.2, "fine": 0.8,
+    "fixed": 1.5, "glad": 2.0, "good": 1.9, "grateful": 2.4, "great": 3.1, "happy": 2.7,
+    "helpful": 2.0, "impressed": 2.2, "love": 3.2, "loved": 2.9, "nice": 1.8,
+    "perfect": 2.9, "pleased": 2.3, "quick": 1.1, "resolved": 1.6, "satisfied": 2.0,
+    "solved": 1.7, "super": 2.0, "thank": 1.5, "thanks": 1.9, "wonderful": 2.9,
+    "works": 1.0, "worked": 1.2,
+}
+
+EN_NEGATIONS = {
+    "not", "no", "never", "none", "nobody", "nothing", "neither", "nor", "nowhere",
+    "cannot", "cant", "can't", "dont", "don't", "doesnt", "doesn't", "didnt", "didn't",
+    "isnt", "isn't", "wasnt", "wasn't", "wont", "won't", "wouldnt", "wouldn't",
+    "shouldnt", "shouldn't", "aint", "ain't", "without", "hardly", "barely",
+}
+
+EN_BOOSTERS = {
+    "absolutely": BOOSTER_INCREMENT, "completely": BOOSTER_INCREMENT, "extremely": BOOSTER_INCREMENT,
+    "incredibly": BOOSTER_INCREMENT, "really": BOOSTER_INCREMENT, "so": BOOSTER_INCREMENT,
+    "totally": BOOSTER_INCREMENT, "very": BOOSTER_INCREMENT, "utterly": BOOSTER_INCREMENT,
+    "most": BOOSTER_INCREMENT, "such": BOOSTER_INCREMENT,
+    "slightly": -BOOSTER_INCREMENT, "somewhat": -BOOSTER_INCREMENT, "kinda": -BOOSTER_INCREMENT,
+    "barely": -BOOSTER_INCREMENT, "little": -BOOSTER_INCREMENT, "bit": -BOOSTER_INCREMENT,
+}
+
+EMOJI_VALENCE = {
+    "😡": -3.0, "🤬": -3.2, "😠": -2.8, "😤": -2.0, "😞": -2.0, "😢": -2.2, "😭": -2.4,
+    "👎": -2.0, "💩": -2.0, "🙄": -1.5, "😒": -1.6, ":(": -1.9, ":-(": -1.9,
+    "😀": 2.0, "😃": 2.2, "😄": 2.3, "😊": 2.2, "🙂": 1.4, "😍": 2.8, "🥰": 2.8,
+    "👍": 1.9, "🙏": 1.6, "❤": 2.7, "🎉": 2.4, ":)": 1.9, ":-)": 1.9, ":D": 2.3,
+}
+
+_TOKEN_RE = re.compile(r"[\w']+|[^\w\s]", re.UNICODE)
+
+
+class Lexicon:
+    """Word valences, negators and boosters for one language"""
+
+    def __init__(self, words: Dict[str, float], negations: Iterable[str], boosters: Dict[str, float]):
+        self.words = {w.lower(): float(v) for w, v in words.items()}
+        self.negations = {n.lower() for n in negations}
+        self.boosters = {b.lower(): float(v) for b, v in boosters.items()}
+
+
+class FastSentimentScorer:
+    """Lexicon-based scorer returning a tone in -100..100"""
+
+    def __init__(self):
+        self.lexicons: Dict[str, Lexicon] = {"en": Lexicon(EN_WORDS, EN_NEGATIONS, EN_BOOSTERS)}
+        self._load_lexicon_dir(os.environ.get("SENTIMENT_LEXICON_DIR"))
+
+    def _load_lexicon_dir(self, directory: Optional[str]):
+        if not directory or not os.path.isdir(directory):
+            return
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename), "r") as f:
+                    data = json.load(f)
+                self.register_lexicon(
+                    filename[:-5],
+                    data.get("words", {}),
+                    data.get("negations", []),
+                    data.get("boosters", {})
+                )
+            except Exception as e:
+                logger.warning(f"Could not load sentiment lexicon {filename}: {str(e)}")
+
+    def register_lexicon(
+        self,
+        language: str,
+        words: Dict[str, float],
+        negations: Iterable[str] = (),
+        boosters: Optional[Dict[str, float]] = None
+    ):
+        """Add or replace the lexicon for a language"""
+        self.lexicons[language.lower()] = Lexicon(words, negations, boosters or {})
+
+    def score(self, text: str, language: str = "en") -> Dict[str, object]:
+        """
+        Score a message.
+
+        Returns:
+            {"tone": int -100..100, "compound": float -1..1,
+             "label": "negative" | "neutral" | "positive"}
+        """
+        if not text:
+            return {"tone": 0, "compound": 0.0, "label": "neutral"}
+
+        lexicon = self.lexicons.get((language or "en").lower()[:2]) or self.lexicons["en"]
+        tokens = _TOKEN_RE.findall(text)
+        words = [t for t in tokens if t[0].isalnum() or t[0] == "'"]
+        has_mixed_case = any(w.isupper() for w in words) and not all(w.isupper() for w in words if w.isalpha())
+
+        valences = []
+        for i, token in enumerate(words):
+            lower = token.lower()
+            valence = lexicon.words.get(lower)
+            if valence is None:
+                continue
+
+            # ALL-CAPS emphasis when the rest of the message isn't shouting
+            if has_mixed_case and token.isupper() and len(token) > 1:
+                valence += CAPS_INCREMENT if valence > 0 else -CAPS_INCREMENT
+
+            # Intensifiers / dampeners and negation in the preceding window
+            for distance in range(1, NEGATION_WINDOW + 1):
+                if i - distance < 0:
+                    break
+                previous = words[i - distance].lower()
+                boost = lexicon.boosters.get(previous)
+                if boost is not None:
+                    scale = 1.0 if distance == 1 else (0.95 if distance == 2 else 0.9)
+                    valence += (boost if valence > 0 else -boost) * scale
+                if previous in lexicon.negations:
+                    valence *= NEGATION_SCALAR
+                    break
+
+            valences.append([i, valence])
+
+        # "but" shifts weight to the clause after it
+        lowered = [w.lower() for w in words]
+        if "but" in lowered:
+            but_index = lowered.index("but")
+            for entry in valences:
+                entry[1] *= 0.5 if entry[0] < but_index else 1.5
+
+        total = sum(v for _, v in valences)
+        for emoji, valence in EMOJI_VALENCE.items():
+            count = text.count(emoji)
+            if count:
+                total += valence * min(count, 3)
+
+        # Exclamation marks amplify whichever direction the message leans
+        if total:
+            exclamations = min(text.count("!"), MAX_EXCLAMATIONS)
+            amplify = exclamations * EXCLAMATION_INCREMENT
+            total += amplify if total > 0 else -amplify
+
+        compound = total / math.sqrt(total * total + NORMALIZATION_ALPHA) if total else 0.0
+        compound = max(-1.0, min(1.0, compound))
+        label = "positive" if compound >= 0.05 else ("negative" if compound <= -0.05 else "neutral")
+        return {"tone": int(round(compound * 100)), "compound": round(compound, 4), "label": label}
+
+
+# Global fast sentiment scorer instance
+fast_sentiment = FastSentimentScorer()
@@ -0,0 +1,196 @@
+"""
+Intent Matcher - Compiled multi-phrase detection for hot-path message checks
+
+Verification, transfer triggers and channel agent mentions / collaboration
+requests all need to know which phrase lists a message hits. Instead of looping over each
+list with `in`, every phrase set is compiled into a single regex and one scan
+returns all matched intents.
+
+Matching keeps the original substring semantics (case-insensitive, no word
+boundaries). Tenants can extend the default phrase sets via the
+``intent_phrases`` field in their settings ({intent: [phrases]}).
+"""
+import logging
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+# Intent names
+SENSITIVE_TOPIC = "sensitive_topic"
+HUMAN_REQUEST = "human_request"
+AI_FAILURE = "ai_failure"
+COLLABORATIVE = "collaborative"
+
+DEFAULT_INTENT_PHRASES: Dict[str, List[str]] = {
+    SENSITIVE_TOPIC: [
+        # Account-related
+        "account", "balance", "payment", "billing", "invoice", "subscription",
+        "password", "login", "credential", "security",
+        # Order-related
+        "order", "purchase", "transaction", "refund", "shipping", "delivery",
+        "tracking", "cancel order", "cancel subscription", "cancel my",
+        # Personal data
+        "my address", "phone number", "email change", "personal info", "profile", "my data",
+        # Financial
+        "credit", "debit", "bank", "card number", "wallet", "money", "fund",
+        # Possessive requests
+        "my order", "my account", "my balance", "my payment", "my subscription",
+        "my profile", "where is my", "status of my", "change my", "update my",
+        "what did i", "show me my", "give me my"
+    ],
+    HUMAN_REQUEST: [
+        "talk to human", "speak to human", "human agent", "real person",
+        "talk to someone", "speak to someone", "talk to a person",
+        "need a human", "want a human", "get me a human",
+        "transfer to agent", "live agent", "customer service",
+        "speak with representative", "talk to representative"
+    ],
+    AI_FAILURE: [
+        "i don't have that information",
+        "i cannot help with",
+        "i'm not able to",
+        "outside my knowledge",
+        "please contact support",
+        "i apologize, but i cannot"
+    ],
+    COLLABORATIVE: [
+        "you both", "both of you", "you two", "you all",
+        "together", "collaborate", "discuss", "come up with",
+        "work together", "figure out", "brainstorm", "team up",
+        "what do you think", "your thoughts", "everyone"
+    ]
+}
+
+TENANT_CACHE_TTL_SECONDS = 60
+MATCH_CACHE_SIZE = 256  # Recent texts per matcher (the same message is often checked twice)
+
+
+class IntentMatcher:
+    """Matches many phrase sets against a text in a single regex scan"""
+
+    def __init__(self, phrase_sets: Dict[str, Iterable[str]]):
+        phrase_intents: Dict[str, Set[str]] = {}
+        for intent, phrases in phrase_sets.items():
+            for phrase in phrases:
+                phrase = (phrase or "").strip().lower()
+                if phrase:
+                    phrase_intents.setdefault(phrase, set()).add(intent)
+
+        # The lookahead finds matches starting at every position, but only the
+        # longest alternative per position - so fold in intents of shorter
+        # phrases that are prefixes of it.
+        self._intents_by_phrase: Dict[str, FrozenSet[str]] = {}
+        for phrase in phrase_intents:
+            intents = set()
+            for other, other_intents in phrase_intents.items():
+                if phrase.startswith(other):
+                    intents |= other_intents
+            self._intents_by_phrase[phrase] = frozenset(intents)
+
+        self.intent_names = frozenset(phrase_sets)
+        self._pattern = None
+        if phrase_intents:
+            alternation = "|".join(re.escape(p) for p in sorted(phrase_intents, key=len, reverse=True))
+            self._pattern = re.compile(f"(?=({alternation}))")
+        self._cache: "OrderedDict[str, Dict[str, Tuple[str, ...]]]" = OrderedDict()
+
+    def match(self, text: str) -> Dict[str, Tuple[str, ...]]:
+        """Return {intent: matched phrases} for every intent found in text"""
+        if not text or self._pattern is None:
+            return {}
+        text_lower = text.lower()
+        cached = self._cache.get(text_lower)
+        if cached is not None:
+            self._cache.move_to_end(text_lower)
+            return cached
+
+        found: Dict[str, List[str]] = {}
+        for m in self._pattern.finditer(text_lower):
+            phrase = m.group(1)
+            for intent in self._intents_by_phrase.get(phrase, ()):
+                found.setdefault(intent, []).append(phrase)
+        result = {intent: tuple(phrases) for intent, phrases in found.items()}
+
+        self._cache[text_lower] = result
+        if len(self._cache) > MATCH_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return result
+
+    def intents(self, text: str) -> Set[str]:
+        """Return the set of intents found in text"""
+        return set(self.match(text))
+
+    def has(self, text: str, intent: str) -> bool:
+        return intent in self.match(text)
+
+
+def _freeze(phrase_sets: Dict[str, Iterable[str]]) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    return tuple(sorted((intent, tuple(sorted(phrases))) for intent, phrases in phrase_sets.items()))
+
+
+@lru_cache(maxsize=256)
+def _build_matcher(frozen: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> IntentMatcher:
+    return IntentMatcher(dict(frozen))
+
+
+def get_matcher(phrase_sets: Dict[str, Iterable[str]]) -> IntentMatcher:
+    """Get a compiled matcher for a phrase configuration (built once per configuration)"""
+    return _build_matcher(_freeze(phrase_sets))
+
+
+class IntentDetector:
+    """Per-tenant matchers over the default phrase sets plus tenant additions"""
+
+    def __init__(self):
+        # tenant_id -> (loaded at, phrase sets, matcher)
+        self._tenants: Dict[str, Tuple[float, Dict[str, List[str]], IntentMatcher]] = {}
+
+    @property
+    def default(self) -> IntentMatcher:
+        return get_matcher(DEFAULT_INTENT_PHRASES)
+
+    async def _load(self, tenant_id: Optional[str]) -> Tuple[Dict[str, List[str]], IntentMatcher]:
+        """A tenant's phrase sets and matcher, reloading its settings at most once per TTL"""
+        if not tenant_id:
+            return DEFAULT_INTENT_PHRASES, self.default
+
+        cached = self._tenants.get(tenant_id)
+        if cached and time.monotonic() - cached[0] < TENANT_CACHE_TTL_SECONDS:
+            return cached[1], cached[2]
+
+        phrase_sets, matcher = DEFAULT_INTENT_PHRASES, self.default
+        try:
+            settings = await db.settings.find_one({"tenant_id": tenant_id}, {"_id": 0, "intent_phrases": 1})
+            custom = (settings or {}).get("intent_phrases") or {}
+            if custom:
+                merged = {intent: list(phrases) for intent, phrases in DEFAULT_INTENT_PHRASES.items()}
+                for intent, phrases in custom.items():
+                    merged.setdefault(intent, []).extend(p for p in phrases if isinstance(p, str))
+                phrase_sets, matcher = merged, get_matcher(merged)
+        except Exception as e:
+            logger.warning(f"Could not load intent phrases for tenant {tenant_id}: {str(e)}")
+
+        self._tenants[tenant_id] = (time.monotonic(), phrase_sets, matcher)
+        return phrase_sets, matcher
+
+    async def for_tenant(self, tenant_id: Optional[str]) -> IntentMatcher:
+        """Get the matcher for a tenant (default phrase sets plus its additions)"""
+        return (await self._load(tenant_id))[1]
+
+    async def phrases_for_tenant(self, tenant_id: Optional[str]) -> Dict[str, List[str]]:
+        """A tenant's phrase sets, for callers combining them with phrases of their own"""
+        return (await self._load(tenant_id))[0]
+
+    def invalidate(self, tenant_id: str):
+        """Drop a tenant's cached matcher (call after its phrase settings change)"""
+        self._tenants.pop(tenant_id, None)
+
+
+# Global intent detector instance
+intent_detector = IntentDetector()
@@ -0,0 +1,414 @@
+"""
+LLM Governor - Per-provider concurrency and token-rate limiting for outbound LLM calls
+
+Every outbound completion acquires a slot keyed by (provider_id, model) before it
+is sent. Slots are granted from two token buckets (requests per minute and tokens
+per minute) plus a concurrency cap. Calls that cannot be served immediately wait in
+per-tenant queues that are drained round-robin, so one busy tenant on a shared
+provider key cannot starve everyone else. Calls that wait longer than the max wait
+raise GovernorTimeout and the caller degrades gracefully instead of hitting a 429.
+
+Limits come from the provider document (``rate_limits``) with environment defaults:
+    LLM_DEFAULT_RPM, LLM_DEFAULT_TPM, LLM_DEFAULT_MAX_CONCURRENCY,
+    LLM_GOVERNOR_MAX_WAIT_SECONDS
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPM = int(os.environ.get("LLM_DEFAULT_RPM", "500"))
+DEFAULT_TPM = int(os.environ.get("LLM_DEFAULT_TPM", "200000"))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("LLM_DEFAULT_MAX_CONCURRENCY", "32"))
+DEFAULT_MAX_WAIT_SECONDS = float(os.environ.get("LLM_GOVERNOR_MAX_WAIT_SECONDS", "30"))
+
+# Rough characters-per-token ratio used for prompt estimation
+CHARS_PER_TOKEN = 4
+
+# Number of wait samples kept per key for percentile metrics
+WAIT_SAMPLE_SIZE = 500
+
+
+class GovernorTimeout(Exception):
+    """Raised when a call waited longer than the allowed max wait for a slot"""
+    pass
+
+
+def estimate_tokens(
+    messages: Optional[List[Dict[str, Any]]] = None,
+    system_prompt: str = "",
+    max_tokens: int = 0
+) -> int:
+    """
+    Estimate the token cost of a completion before sending it.
+
+    Counts prompt characters at ~4 chars/token plus the completion budget,
+    which is what providers reserve against the TPM limit.
+    """
+    chars = len(system_prompt or "")
+    for msg in messages or []:
+        content = msg.get("content", "")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            # Anthropic-style content blocks
+            for block in content:
+                if isinstance(block, dict):
+                    chars += len(str(block.get("text") or block.get("content") or ""))
+        # Per-message framing overhead
+        chars += 4 * CHARS_PER_TOKEN
+    return max(1, chars // CHARS_PER_TOKEN) + max(0, int(max_tokens or 0))
+
+
+class TokenBucket:
+    """Continuously refilling token bucket"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self.updated_at = now
+
+    def can_consume(self, amount: float) -> bool:
+        self._refill()
+        # Requests larger than the whole bucket are allowed once it is full
+        return self.tokens >= min(amount, self.capacity)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+    def seconds_until(self, amount: float) -> float:
+        self._refill()
+        needed = min(amount, self.capacity) - self.tokens
+        if needed <= 0:
+            return 0.0
+        if self.refill_per_second <= 0:
+            return float("inf")
+        return needed / self.refill_per_second
+
+
+class _Waiter:
+    __slots__ = ("tenant_id", "tokens", "future", "enqueued_at")
+
+    def __init__(self, tenant_id: str, tokens: int, future: asyncio.Future):
+        self.tenant_id = tenant_id
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class ProviderGovernor:
+    """Buckets, concurrency cap and fair wait queues for one (provider, model) key"""
+
+    def __init__(self, key: str, rpm: int, tpm: int, max_concurrency: int):
+        self.key = key
+        self.configure(rpm, tpm, max_concurrency)
+        self.in_flight = 0
+        # tenant_id -> queued waiters, insertion order is the round-robin order
+        self.queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        # Metrics
+        self.granted = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.wait_samples: Deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def configure(self, rpm: int, tpm: int, max_concurrency: int):
+        """Apply (possibly updated) limits without losing current bucket state"""
+        self.rpm = max(1, int(rpm))
+        self.tpm = max(1, int(tpm))
+        self.max_concurrency = max(1, int(max_concurrency))
+        if hasattr(self, "request_bucket"):
+            self.request_bucket.capacity = float(self.rpm)
+            self.request_bucket.refill_per_second = self.rpm / 60.0
+            self.token_bucket.capacity = float(self.tpm)
+            self.token_bucket.refill_per_second = self.tpm / 60.0
+        else:
+            self.request_bucket = TokenBucket(self.rpm, self.rpm / 60.0)
+            self.token_bucket = TokenBucket(self.tpm, self.tpm / 60.0)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def _has_capacity(self, tokens: int) -> bool:
+        return (
+            self.in_flight < self.max_concurrency
+            and self.request_bucket.can_consume(1)
+            and self.token_bucket.can_consume(tokens)
+        )
+
+    def _grant(self, tokens: int):
+        self.in_flight += 1
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(tokens)
+        self.granted += 1
+
+    def try_acquire_now(self, tokens: int) -> bool:
+        """Fast path - grant immediately only if nobody is queued ahead"""
+        if self.queues or not self._has_capacity(tokens):
+            return False
+        self._grant(tokens)
+        self.wait_samples.append(0.0)
+        return True
+
+    def enqueue(self, waiter: _Waiter):
+        self.queues.setdefault(waiter.tenant_id, deque()).append(waiter)
+        self.dispatch()
+
+    def remove(self, waiter: _Waiter):
+        queue = self.queues.get(waiter.tenant_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            self.queues.pop(waiter.tenant_id, None)
+
+    def dispatch(self):
+        """Grant slots to queued waiters, one tenant at a time in round-robin order"""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while self.queues:
+            tenant_id, queue = next(iter(self.queues.items()))
+            waiter = queue[0]
+
+            if waiter.future.done():
+                # Timed out or cancelled while queued
+                queue.popleft()
+                if not queue:
+                    self.queues.pop(tenant_id, None)
+                continue
+
+            if not self._has_capacity(waiter.tokens):
+                if self.in_flight < self.max_concurrency:
+                    # Blocked on a bucket - wake up once it has refilled enough
+                    delay = max(
+                        self.request_bucket.seconds_until(1),
+                        self.token_bucket.seconds_until(waiter.tokens)
+                    )
+                    if delay != float("inf"):
+                        loop = asyncio.get_running_loop()
+                        self._wakeup = loop.call_later(max(delay, 0.01), self.dispatch)
+                # Blocked on concurrency - release() will dispatch again
+                return
+
+            queue.popleft()
+            self._grant(waiter.tokens)
+            self.wait_samples.append(time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(True)
+
+            # Rotate this tenant to the back so the next tenant goes first
+            self.queues.pop(tenant_id, None)
+            if queue:
+                self.queues[tenant_id] = queue
+
+    def release(self, reserved_tokens: int, actual_tokens: Optional[int] = None):
+        self.in_flight = max(0, self.in_flight - 1)
+        if actual_tokens is not None and actual_tokens < reserved_tokens:
+            # Give back the part of the reservation the call did not use
+            self.token_bucket.refund(reserved_tokens - actual_tokens)
+        if self.queues:
+            self.dispatch()
+
+    def get_stats(self) -> Dict[str, Any]:
+        samples = sorted(self.wait_samples)
+        count = len(samples)
+        return {
+            "key": self.key,
+            "limits": {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "max_concurrency": self.max_concurrency
+            },
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queue_depth_by_tenant": {t: len(q) for t, q in self.queues.items()},
+            "available_requests": round(self.request_bucket.tokens, 1),
+            "available_tokens": round(self.token_bucket.tokens, 1),
+            "granted": self.granted,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+            "wait_seconds": {
+                "avg": round(sum(samples) / count, 4) if count else 0,
+                "p95": round(samples[int(count * 0.95)], 4) if count else 0,
+                "max": round(samples[-1], 4) if count else 0
+            }
+        }
+
+
+class LLMSlot:
+    """Handle for an acquired slot; lets the caller report actual token usage"""
+
+    def __init__(self, governor: ProviderGovernor, reserved_tokens: int, wait_seconds: float):
+        self.governor = governor
+        self.reserved_tokens = reserved_tokens
+        self.wait_seconds = wait_seconds
+        self.actual_tokens: Optional[int] = None
+
+    def record_usage(self, total_tokens: Optional[int]):
+        if total_tokens is not None:
+            self.actual_tokens = int(total_tokens)
+
+
+class LLMGovernor:
+    """Registry of per-(provider, model) governors"""
+
+    def __init__(self):
+        self.governors: Dict[str, ProviderGovernor] = {}
+
+    @staticmethod
+    def _key(provider_id: str, model: str) -> str:
+        return f"{provider_id}:{model}"
+
+    @staticmethod
+    def get_limits(provider: Dict[str, Any], model: str) -> Tuple[int, int, int]:
+        """Resolve (rpm, tpm, max_concurrency) from the provider doc with model overrides"""
+        limits = provider.get("rate_limits") or {}
+        model_limits = (limits.get("models") or {}).get(model, {})
+        rpm = model_limits.get("rpm", limits.get("rpm", DEFAULT_RPM))
+        tpm = model_limits.get("tpm", limits.get("tpm", DEFAULT_TPM))
+        max_concurrency = model_limits.get(
+            "max_concurrency", limits.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        )
+        return rpm, tpm, max_concurrency
+
+    def get_governor(self, provider: Dict[str, Any], model: str) -> ProviderGovernor:
+        provider_id = provider.get("id") or provider.get("type", "unknown")
+        key = self._key(provider_id, model)
+        rpm, tpm, max_concurrency = self.get_limits(provider, model)
+
+        governor = self.governors.get(key)
+        if governor is None:
+            governor = ProviderGovernor(key, rpm, tpm, max_concurrency)
+            self.governors[key] = governor
+        elif (governor.rpm, governor.tpm, governor.max_concurrency) != (rpm, tpm, max_concurrency):
+            governor.configure(rpm, tpm, max_concurrency)
+        return governor
+
+    async def acquire(
+        self,
+        provider: Dict[str, Any],
+        model: str,
+        tenant_id: Optional[str],
+        estimated_tokens: int,
+        max_wait: Optional[float] = None
+    ) -> LLMSlot:
+        """
+        Wait for a slot on the provider/model.
+
+        Raises:
+            GovernorTimeout: if no slot was granted within max_wait seconds
+        """
+        governor = self.get_governor(provider, model)
+        tokens = max(1, int(estimated_tokens))
+
+        if governor.try_acquire_now(tokens):
+            return LLMSlot(governor, tokens, 0.0)
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(tenant_id or "_anonymous", tokens, loop.create_future())
+        governor.enqueue(waiter)
+
+        timeout = DEFAULT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            governor.remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted at the same instant the wait expired - keep the slot
+                return LLMSlot(governor, tokens, time.monotonic() - waiter.enqueued_at)
+            waiter.future.cancel()
+            governor.timeouts += 1
+            logger.warning(
+                f"LLM governor timeout on {governor.key} for tenant {tenant_id} "
+                f"after {timeout}s (queue depth {governor.queue_depth})"
+            )
+            raise GovernorTimeout(f"No capacity on {governor.key} within {timeout}s")
+        except asyncio.CancelledError:
+            governor.remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                governor.release(tokens)
+            else:
+                waiter.future.cancel()
+            raise
+
+        return LLMSlot(governor, tokens, time.monotonic() - waiter.enqueued_at)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: Dict[str, Any],
+        model: str,
+        tenant_id: Optional[str],
+        estimated_tokens: int,
+        max_wait: Optional[float] = None
+    ):
+        """Async context manager around acquire/release; reports provider 429s raised inside it"""
+        acquired = await self.acquire(provider, model, tenant_id, estimated_tokens, max_wait)
+        try:
+            yield acquired
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.report_rate_limited(provider, model)
+            raise
+        finally:
+            acquired.governor.release(acquired.reserved_tokens, acquired.actual_tokens)
+
+    def report_rate_limited(self, provider: Dict[str, Any], model: str):
+        """Provider returned 429 - empty the buckets so queued calls back off"""
+        governor = self.get_governor(provider, model)
+        governor.rate_limited += 1
+        governor.request_bucket.drain()
+        governor.token_bucket.drain()
+
+    def get_stats(self) -> Dict[str, Any]:
+        governors = [g.get_stats() for g in self.governors.values()]
+        return {
+            "defaults": {
+                "rpm": DEFAULT_RPM,
+                "tpm": DEFAULT_TPM,
+                "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+                "max_wait_seconds": DEFAULT_MAX_WAIT_SECONDS
+            },
+            "total_queue_depth": sum(g["queue_depth"] for g in governors),
+            "total_in_flight": sum(g["in_flight"] for g in governors),
+            "governors": governors
+        }
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Detect provider 429s across SDKs without importing them"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return type(error).__name__ in ("RateLimitError",)
+
+
+# Global governor instance
+llm_governor = LLMGovernor()
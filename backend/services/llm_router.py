@@ -0,0 +1,534 @@
+"""
+LLM Router - Provider failover, circuit breaking and hedged requests
+
+Routes a completion over an agent's provider chain: the agent's own
+provider/model first, then its ``fallback_chain`` entries
+(e.g. ``[{"provider_id": "...", "model": "claude-3-5-haiku-20241022"}]``).
+
+- Circuit breakers per provider open after repeated failures. Live failures are
+  written to ``provider_errors`` tagged with the worker; each breaker adds the
+  other workers' recent failures to its own so every worker shares the same view.
+- When ``hedge_requests`` is enabled on the agent and the primary has not answered
+  by its observed p95 latency, a second request is fired at the next provider in
+  the chain and whichever answers first wins.
+- ``latency_budget_ms`` on the agent caps the total time spent across attempts.
+
+Every result records which provider/model answered and the latency it saw.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Any, Deque, Dict, List, Optional
+
+from middleware.database import db
+from services.llm_governor import llm_governor, estimate_tokens, GovernorTimeout
+from services.llm_usage import llm_usage
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker configuration
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_WINDOW_SECONDS = int(os.environ.get("LLM_BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_COOLDOWN_SECONDS = int(os.environ.get("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+BREAKER_REFRESH_SECONDS = 15  # How often provider_errors is re-read
+
+# Tags this process's provider_errors rows so breakers don't count them twice
+WORKER_ID = str(uuid.uuid4())
+
+# Latency budget / hedging configuration
+DEFAULT_LATENCY_BUDGET_MS = int(os.environ.get("LLM_LATENCY_BUDGET_MS", "45000"))
+DEFAULT_HEDGE_DELAY_MS = int(os.environ.get("LLM_HEDGE_DELAY_MS", "8000"))
+MIN_LATENCY_SAMPLES = 20  # Samples needed before trusting the observed p95
+LATENCY_SAMPLE_SIZE = 200
+
+
+class AllProvidersFailed(Exception):
+    """Raised when every provider in the chain failed or was skipped"""
+
+    def __init__(self, message: str, attempts: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+def _uses_new_token_param(model: str) -> bool:
+    model_lower = model.lower()
+    return any(prefix in model_lower for prefix in ["gpt-4o", "gpt-5", "o1", "o3", "o4"])
+
+
+def _is_restrictive_model(model: str) -> bool:
+    model_lower = model.lower()
+    return any(prefix in model_lower for prefix in ["gpt-5", "o1", "o3", "o4"])
+
+
+def _call_openai_sync(provider: Dict[str, Any], params: Dict[str, Any]):
+    import openai
+    client = openai.OpenAI(api_key=provider["api_key"], base_url=provider.get("base_url") or None)
+    return client.chat.completions.create(**params)
+
+
+def _call_anthropic_sync(provider: Dict[str, Any], params: Dict[str, Any]):
+    import anthropic
+    client = anthropic.Anthropic(api_key=provider["api_key"])
+    return client.messages.create(**params)
+
+
+def _call_timeout(timeout: Optional[float], waited: float) -> Optional[float]:
+    """Time left for the provider call after queueing for a governor slot"""
+    if timeout is None:
+        return None
+    return max(timeout - waited, 0.001)
+
+
+async def call_provider(
+    provider: Dict[str, Any],
+    model: str,
+    system_prompt: str,
+    messages: List[Dict[str, Any]],
+    temperature: Optional[float] = 0.7,
+    max_tokens: int = 2000,
+    tenant_id: Optional[str] = None,
+    json_mode: bool = False,
+    agent_id: Optional[str] = None,
+    feature: str = "chat",
+    timeout: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Make one completion call against a single provider.
+
+    The blocking SDK call runs in a worker thread so the event loop stays free
+    (required for hedging to actually race two requests). json_mode requests a
+    JSON object response where the provider supports it (OpenAI). Usage is
+    recorded under agent_id/feature in llm_usage.
+
+    ``timeout`` bounds the governor queue wait (GovernorTimeout) and whatever
+    is left of it bounds the provider call itself (asyncio.TimeoutError).
+
+    Returns:
+        {"text": str, "usage": {"prompt_tokens", "completion_tokens", "total_tokens"}}
+    """
+    provider_type = provider.get("type", "openai")
+
+    if provider_type == "openai":
+        api_messages = [{"role": "system", "content": system_prompt}] + list(messages)
+        params = {"model": model, "messages": api_messages}
+        if temperature is not None and not _is_restrictive_model(model):
+            params["temperature"] = temperature
+        if _uses_new_token_param(model):
+            params["max_completion_tokens"] = max_tokens
+        else:
+            params["max_tokens"] = max_tokens
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}
+
+        estimated = estimate_tokens(api_messages, max_tokens=max_tokens)
+        async with llm_governor.slot(provider, model, tenant_id, estimated, max_wait=timeout) as slot:
+            async with llm_usage.track(tenant_id, agent_id, provider_type, model, feature) as call:
+                response = await asyncio.wait_for(
+                    asyncio.to_thread(_call_openai_sync, provider, params),
+                    _call_timeout(timeout, slot.wait_seconds)
+                )
+                call.set_usage_from(getattr(response, "usage", None))
+            usage = getattr(response, "usage", None)
+            if usage:
+                slot.record_usage(usage.total_tokens)
+
+        return {
+            "text": response.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens if usage else None,
+                "completion_tokens": usage.completion_tokens if usage else None,
+                "total_tokens": usage.total_tokens if usage else None
+            }
+        }
+
+    elif provider_type == "anthropic":
+        # Anthropic rejects system-role messages inside the list
+        api_messages = [m for m in messages if m.get("role") != "system"]
+        if not api_messages:
+            api_messages = [{"role": "user", "content": "Please analyze and respond."}]
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "system": system_prompt,
+            "messages": api_messages
+        }
+        if temperature is not None:
+            params["temperature"] = temperature
+
+        estimated = estimate_tokens(api_messages, system_prompt, max_tokens)
+        async with llm_governor.slot(provider, model, tenant_id, estimated, max_wait=timeout) as slot:
+            async with llm_usage.track(tenant_id, agent_id, provider_type, model, feature) as call:
+                response = await asyncio.wait_for(
+                    asyncio.to_thread(_call_anthropic_sync, provider, params),
+                    _call_timeout(timeout, slot.wait_seconds)
+                )
+                call.set_usage_from(getattr(response, "usage", None))
+            usage = getattr(response, "usage", None)
+            if usage:
+                slot.record_usage(usage.input_tokens + usage.output_tokens)
+
+        return {
+            "text": response.content[0].text,
+            "usage": {
+                "prompt_tokens": usage.input_tokens if usage else None,
+                "completion_tokens": usage.output_tokens if usage else None,
+                "total_tokens": (usage.input_tokens + usage.output_tokens) if usage else None
+            }
+        }
+
+    raise ValueError(f"Unsupported provider type: {provider_type}")
+
+
+class CircuitBreaker:
+    """Closed -> open after N failures in the window -> half-open after cooldown"""
+
+    def __init__(self, provider_id: str):
+        self.provider_id = provider_id
+        self.failures: Deque[float] = deque()
+        self.opened_at: Optional[float] = None
+        self.half_open_probe = False
+        self.persisted_failures = 0  # Other workers' failures in the window
+        self.refreshed_at = 0.0
+        self.succeeded_at: Optional[datetime] = None
+
+    def _prune(self, now: float):
+        while self.failures and now - self.failures[0] > BREAKER_WINDOW_SECONDS:
+            self.failures.popleft()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_SECONDS:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.half_open_probe:
+            # Let exactly one probe through
+            self.half_open_probe = True
+            return True
+        return False
+
+    def release_probe(self):
+        """An attempt ended without a verdict (local queueing, cancelled hedge loser)"""
+        self.half_open_probe = False
+
+    def record_success(self):
+        self.failures.clear()
+        self.persisted_failures = 0
+        self.opened_at = None
+        self.half_open_probe = False
+        self.succeeded_at = datetime.now(timezone.utc)
+
+    def record_failure(self):
+        now = time.monotonic()
+        self.failures.append(now)
+        self._prune(now)
+        if self.state == "half_open" or len(self.failures) + self.persisted_failures >= BREAKER_FAILURE_THRESHOLD:
+            self.opened_at = now
+        self.half_open_probe = False
+
+    def apply_persisted_failures(self, count: int):
+        """Seed from provider_errors written by other workers since our last success"""
+        self.persisted_failures = count
+        self.refreshed_at = time.monotonic()
+        if self.opened_at is None and count >= BREAKER_FAILURE_THRESHOLD:
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Rolling latency samples per provider/model"""
+
+    def __init__(self):
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, latency_ms: float):
+        self.samples.setdefault(key, deque(maxlen=LATENCY_SAMPLE_SIZE)).append(latency_ms)
+
+    def p95(self, key: str) -> Optional[float]:
+        samples = self.samples.get(key)
+        if not samples or len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95)]
+
+
+class ProviderRouter:
+    """Routes completions over an agent's provider chain"""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latency = LatencyTracker()
+
+    def get_breaker(self, provider_id: str) -> CircuitBreaker:
+        breaker = self.breakers.get(provider_id)
+        if breaker is None:
+            breaker = CircuitBreaker(provider_id)
+            self.breakers[provider_id] = breaker
+        return breaker
+
+    async def _refresh_breaker(self, breaker: CircuitBreaker):
+        if time.monotonic() - breaker.refreshed_at < BREAKER_REFRESH_SECONDS:
+            return
+        since = datetime.now(timezone.utc) - timedelta(seconds=BREAKER_WINDOW_SECONDS)
+        if breaker.succeeded_at and breaker.succeeded_at > since:
+            # Failures before a success we saw ourselves don't count against the provider
+            since = breaker.succeeded_at
+        try:
+            count = await db.provider_errors.count_documents({
+                "provider_id": breaker.provider_id,
+                "source": "llm_router",
+                "worker_id": {"$ne": WORKER_ID},
+                "timestamp": {"$gte": since.isoformat()}
+            })
+            breaker.apply_persisted_failures(count)
+        except Exception as e:
+            logger.warning(f"Could not refresh circuit breaker for {breaker.provider_id}: {str(e)}")
+            breaker.refreshed_at = time.monotonic()
+
+    async def _record_provider_error(self, provider_id: str, model: str, error: Exception):
+        error_doc = {
+            "id": str(uuid.uuid4()),
+            "provider_id": provider_id,
+            "model": model,
+            "error_message": str(error),
+            "error_type": type(error).__name__,
+            "source": "llm_router",
+            "worker_id": WORKER_ID,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        try:
+            await db.provider_errors.insert_one(error_doc)
+        except Exception as e:
+            logger.warning(f"Could not record provider error: {str(e)}")
+
+    async def _load_chain(self, agent: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Resolve the agent's primary + fallback entries into provider docs"""
+        entries = [{"provider_id": agent["provider_id"], "model": agent["model"]}]
+        for entry in agent.get("fallback_chain") or []:
+            if entry.get("provider_id") and entry.get("model"):
+                entries.append({"provider_id": entry["provider_id"], "model": entry["model"]})
+
+        provider_ids = list({e["provider_id"] for e in entries})
+        providers = await db.providers.find(
+            {"id": {"$in": provider_ids}, "is_active": True},
+            {"_id": 0}
+        ).to_list(len(provider_ids))
+        by_id = {p["id"]: p for p in providers}
+
+        chain = []
+        for entry in entries:
+            provider = by_id.get(entry["provider_id"])
+            if provider:
+                chain.append({"provider": provider, "model": entry["model"]})
+        return chain
+
+    async def _attempt(
+        self,
+        candidate: Dict[str, Any],
+        system_prompt: str,
+        messages: List[Dict[str, Any]],
+        temperature: Optional[float],
+        max_tokens: int,
+        tenant_id: Optional[str],
+        timeout: float,
+        json_mode: bool = False,
+        agent_id: Optional[str] = None,
+        feature: str = "chat"
+    ) -> Dict[str, Any]:
+        provider = candidate["provider"]
+        model = candidate["model"]
+        breaker = self.get_breaker(provider["id"])
+        probing = breaker.state == "half_open"  # allow_request() let this attempt through as the probe
+        started = time.monotonic()
+        verdict = False
+        try:
+            result = await call_provider(
+                provider, model, system_prompt, messages, temperature, max_tokens,
+                tenant_id, json_mode, agent_id, feature, timeout
+            )
+        except GovernorTimeout:
+            # Local queueing is not a provider fault
+            raise
+        except asyncio.TimeoutError:
+            error = TimeoutError(f"{provider.get('type')}/{model} exceeded {round(timeout, 1)}s")
+            verdict = True
+            breaker.record_failure()
+            await self._record_provider_error(provider["id"], model, error)
+            raise error
+        except Exception as e:
+            verdict = True
+            breaker.record_failure()
+            await self._record_provider_error(provider["id"], model, e)
+            raise
+        else:
+            verdict = True
+            breaker.record_success()
+        finally:
+            if probing and not verdict:
+                # Otherwise the half-open breaker would wait forever on this probe
+                breaker.release_probe()
+
+        latency_ms = (time.monotonic() - started) * 1000
+        self.latency.record(f"{provider['id']}:{model}", latency_ms)
+        return {
+            **result,
+            "provider_id": provider["id"],
+            "provider_type": provider.get("type"),
+            "model": model,
+            "latency_ms": round(latency_ms, 1)
+        }
+
+    def _hedge_delay_seconds(self, candidate: Dict[str, Any], agent: Dict[str, Any]) -> float:
+        p95 = self.latency.p95(f"{candidate['provider']['id']}:{candidate['model']}")
+        delay_ms = p95 if p95 is not None else (agent.get("hedge_delay_ms") or DEFAULT_HEDGE_DELAY_MS)
+        return max(delay_ms, 250) / 1000.0
+
+    async def complete(
+        self,
+        agent: Dict[str, Any],
+        system_prompt: str,
+        messages: List[Dict[str, Any]],
+        tenant_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False,
+        feature: str = "chat"
+    ) -> Dict[str, Any]:
+        """
+        Complete a prompt using the agent's provider chain.
+
+        ``feature`` labels the call in LLM usage accounting (chat, summary, sentiment...).
+
+        Returns:
+            {"text", "usage", "provider_id", "provider_type", "model", "latency_ms",
+             "total_latency_ms", "hedged", "failover", "attempts"}
+
+        Raises:
+            AllProvidersFailed: if no provider in the chain produced a response
+        """
+        temperature = agent.get("temperature", 0.7) if temperature is None else temperature
+        max_tokens = max_tokens or agent.get("max_tokens", 2000)
+        budget_seconds = (agent.get("latency_budget_ms") or DEFAULT_LATENCY_BUDGET_MS) / 1000.0
+        deadline = time.monotonic() + budget_seconds
+        hedge_enabled = bool(agent.get("hedge_requests"))
+
+        chain = await self._load_chain(agent)
+        if not chain:
+            raise AllProvidersFailed("No active provider configured for agent", [])
+
+        for candidate in chain:
+            await self._refresh_breaker(self.get_breaker(candidate["provider"]["id"]))
+
+        attempts: List[Dict[str, Any]] = []
+        started = time.monotonic()
+        index = 0
+        last_error: Optional[Exception] = None
+
+        while index < len(chain):
+            candidate = chain[index]
+            provider_id = candidate["provider"]["id"]
+            breaker = self.get_breaker(provider_id)
+
+            if not breaker.allow_request():
+                attempts.append({"provider_id": provider_id, "model": candidate["model"], "status": "circuit_open"})
+                index += 1
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            hedge_candidate = None
+            if hedge_enabled:
+                for later in chain[index + 1:]:
+                    if self.get_breaker(later["provider"]["id"]).state == "closed":
+                        hedge_candidate = later
+                        break
+
+            args = (system_prompt, messages, temperature, max_tokens, tenant_id)
+            primary = asyncio.create_task(self._attempt(candidate, *args, remaining, json_mode, agent.get("id"), feature))
+            tasks = {primary: candidate}
+
+            if hedge_candidate is not None:
+                done, _ = await asyncio.wait({primary}, timeout=min(self._hedge_delay_seconds(candidate, agent), remaining))
+                if not done:
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        logger.info(
+                            f"Hedging {candidate['provider'].get('type')}/{candidate['model']} with "
+                            f"{hedge_candidate['provider'].get('type')}/{hedge_candidate['model']}"
+                        )
+                        hedge = asyncio.create_task(
+                            self._attempt(hedge_candidate, *args, remaining, json_mode, agent.get("id"), feature)
+                        )
+                        tasks[hedge] = hedge_candidate
+
+            pending = set(tasks)
+            winner = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tried = tasks[task]
+                    entry = {"provider_id": tried["provider"]["id"], "model": tried["model"]}
+                    if task.exception() is None:
+                        attempts.append({**entry, "status": "success", "latency_ms": task.result()["latency_ms"]})
+                        if winner is None:
+                            winner = task
+                    else:
+                        last_error = task.exception()
+                        attempts.append({**entry, "status": "error", "error": str(last_error)[:200]})
+
+            for task in pending:
+                task.cancel()
+
+            if winner is not None:
+                result = winner.result()
+                answered_by_primary = tasks[winner] is chain[0]
+                return {
+                    **result,
+                    "total_latency_ms": round((time.monotonic() - started) * 1000, 1),
+                    "hedged": len(tasks) > 1,
+                    "failover": not answered_by_primary,
+                    "attempts": attempts
+                }
+
+            # Both the attempt and its hedge (if any) failed - move past them
+            index += 1
+            if hedge_candidate is not None and len(tasks) > 1:
+                index = chain.index(hedge_candidate) + 1
+
+        if isinstance(last_error, GovernorTimeout):
+            # Every provider was saturated locally - let callers surface "high demand"
+            raise last_error
+        raise AllProvidersFailed(
+            f"All providers failed: {str(last_error) if last_error else 'no provider available'}",
+            attempts
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "breakers": {
+                provider_id: {
+                    "state": breaker.state,
+                    "recent_failures": len(breaker.failures),
+                    "persisted_failures": breaker.persisted_failures
+                }
+                for provider_id, breaker in self.breakers.items()
+            },
+            "latency_p95_ms": {
+                key: self.latency.p95(key) for key in self.latency.samples
+            }
+        }
+
+
+# Global router instance
+provider_router = ProviderRouter()
@@ -0,0 +1,340 @@
+"""
+LLM Usage - Token, cost and latency accounting for every outbound LLM call
+
+Call sites wrap each model call in ``llm_usage.track(...)``, which captures the
+provider, model, prompt/completion/cached tokens, latency, time-to-first-token
+(streaming calls) and the error class. Records are aggregated in memory and
+flushed periodically with one bulk write of ``$inc`` upserts into hourly
+buckets in the llm_usage collection, keyed by
+(bucket, tenant_id, agent_id, provider, model, feature).
+
+Latency is kept as a fixed-bucket histogram so percentiles can be rolled up
+across documents. Costs use PRICING (USD per million tokens); unknown models
+are counted with zero cost.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("LLM_USAGE_FLUSH_SECONDS", "10"))
+MAX_BUFFERED_KEYS = 5000  # Flush early once this many distinct keys are buffered
+
+# Latency histogram upper bounds (ms); the last bucket is open-ended
+LATENCY_BOUNDS_MS = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000]
+LATENCY_BUCKETS = [f"le_{bound}" for bound in LATENCY_BOUNDS_MS] + ["inf"]
+
+# USD per million tokens: (input, cached input, output). Matched by model prefix, longest first.
+PRICING: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "o1-mini": (1.10, 0.55, 4.40),
+    "o1": (15.00, 7.50, 60.00),
+    "o3-mini": (1.10, 0.55, 4.40),
+    "claude-3-5-haiku": (0.80, 0.08, 4.00),
+    "claude-3-5-sonnet": (3.00, 0.30, 15.00),
+    "claude-3-7-sonnet": (3.00, 0.30, 15.00),
+    "claude-3-haiku": (0.25, 0.03, 1.25),
+    "claude-3-opus": (15.00, 1.50, 75.00),
+    "claude-sonnet-4": (3.00, 0.30, 15.00),
+    "claude-opus-4": (15.00, 1.50, 75.00),
+}
+_PRICING_PREFIXES = sorted(PRICING, key=len, reverse=True)
+
+COUNTER_FIELDS = [
+    "calls", "errors", "estimated_calls", "prompt_tokens", "completion_tokens",
+    "cached_tokens", "total_tokens", "cost_usd", "latency_ms_sum", "ttft_ms_sum", "ttft_calls"
+]
+
+
+def _hour_bucket(now: Optional[datetime] = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    return now.replace(minute=0, second=0, microsecond=0).isoformat()
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Estimated USD cost of a call (0 for models without a price)"""
+    model_lower = (model or "").lower()
+    for prefix in _PRICING_PREFIXES:
+        if model_lower.startswith(prefix):
+            input_price, cached_price, output_price = PRICING[prefix]
+            uncached = max(0, prompt_tokens - cached_tokens)
+            return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+    return 0.0
+
+
+def latency_bucket(latency_ms: float) -> str:
+    for bound, name in zip(LATENCY_BOUNDS_MS, LATENCY_BUCKETS):
+        if latency_ms <= bound:
+            return name
+    return "inf"
+
+
+def histogram_percentile(histogram: Dict[str, int], percentile: float) -> Optional[int]:
+    """Upper bound (ms) of the histogram bucket containing the percentile"""
+    total = sum(histogram.get(name, 0) for name in LATENCY_BUCKETS)
+    if not total:
+        return None
+    target = total * percentile
+    seen = 0
+    for bound, name in zip(LATENCY_BOUNDS_MS + [None], LATENCY_BUCKETS):
+        seen += histogram.get(name, 0)
+        if seen >= target:
+            return bound if bound is not None else LATENCY_BOUNDS_MS[-1]
+    return LATENCY_BOUNDS_MS[-1]
+
+
+class LLMCall:
+    """Measurements for one tracked call; filled in by the caller"""
+
+    def __init__(self, tenant_id: Optional[str], agent_id: Optional[str], provider: str, model: str, feature: str):
+        self.tenant_id = tenant_id
+        self.agent_id = agent_id
+        self.provider = provider
+        self.model = model
+        self.feature = feature
+        self.started = time.monotonic()
+        self.ttft_ms: Optional[float] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.estimated = False
+
+    def first_token(self):
+        """Mark the arrival of the first streamed token"""
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.monotonic() - self.started) * 1000
+
+    def set_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int], cached_tokens: Optional[int] = 0):
+        self.prompt_tokens = int(prompt_tokens or 0)
+        self.completion_tokens = int(completion_tokens or 0)
+        self.cached_tokens = int(cached_tokens or 0)
+
+    def set_usage_from(self, usage: Any):
+        """Read an OpenAI or Anthropic SDK usage object"""
+        if usage is None:
+            return
+        if hasattr(usage, "input_tokens"):
+            # Anthropic: cache reads/writes are reported apart from input_tokens
+            cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+            cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+            self.set_usage(usage.input_tokens + cache_read + cache_write, usage.output_tokens, cache_read)
+        else:
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.set_usage(
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                getattr(details, "cached_tokens", 0) if details else 0
+            )
+
+    def estimate_usage(self, prompt_text: str, completion_text: Optional[str]):
+        """Fallback for clients that don't report usage (~4 characters per token)"""
+        self.set_usage(len(prompt_text or "") // 4, len(completion_text or "") // 4)
+        self.estimated = True
+
+
+class LLMUsageRecorder:
+    """Buffers per-call measurements and flushes them as hourly rollups"""
+
+    def __init__(self):
+        self._buffer: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def start(self):
+        """Start the periodic flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+            logger.info(f"LLM usage recorder started (flush every {FLUSH_INTERVAL_SECONDS}s)")
+
+    async def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    @asynccontextmanager
+    async def track(
+        self,
+        tenant_id: Optional[str],
+        agent_id: Optional[str],
+        provider: Optional[str],
+        model: Optional[str],
+        feature: str
+    ):
+        """
+        Measure one LLM call. Errors (including cancellation) are recorded by
+        class name and re-raised.
+
+        Usage:
+            async with llm_usage.track(tenant_id, agent_id, "openai", model, "chat") as call:
+                response = await client.chat.completions.create(...)
+                call.set_usage_from(response.usage)
+        """
+        call = LLMCall(tenant_id, agent_id, provider or "unknown", model or "unknown", feature)
+        try:
+            yield call
+        except BaseException as e:
+            self.record(call, type(e).__name__)
+            raise
+        else:
+            self.record(call)
+
+    def record(self, call: LLMCall, error_class: Optional[str] = None):
+        latency_ms = (time.monotonic() - call.started) * 1000
+        key = (
+            _hour_bucket(),
+            call.tenant_id or "_platform",
+            call.agent_id or "",
+            call.provider,
+            call.model,
+            call.feature
+        )
+        entry = self._buffer.get(key)
+        if entry is None:
+            entry = self._buffer[key] = {field: 0 for field in COUNTER_FIELDS}
+            entry["latency_hist"] = {}
+            entry["error_classes"] = {}
+
+        entry["calls"] += 1
+        entry["prompt_tokens"] += call.prompt_tokens
+        entry["completion_tokens"] += call.completion_tokens
+        entry["cached_tokens"] += call.cached_tokens
+        entry["total_tokens"] += call.prompt_tokens + call.completion_tokens
+        entry["cost_usd"] += estimate_cost(call.model, call.prompt_tokens, call.completion_tokens, call.cached_tokens)
+        entry["latency_ms_sum"] += latency_ms
+        if call.estimated:
+            entry["estimated_calls"] += 1
+        if call.ttft_ms is not None:
+            entry["ttft_ms_sum"] += call.ttft_ms
+            entry["ttft_calls"] += 1
+        if error_class:
+            entry["errors"] += 1
+            entry["error_classes"][error_class] = entry["error_classes"].get(error_class, 0) + 1
+        bucket = latency_bucket(latency_ms)
+        entry["latency_hist"][bucket] = entry["latency_hist"].get(bucket, 0) + 1
+
+        if len(self._buffer) >= MAX_BUFFERED_KEYS:
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Write buffered counters with a single bulk $inc upsert"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            buffer, self._buffer = self._buffer, {}
+
+            writes = []
+            for (bucket, tenant_id, agent_id, provider, model, feature), entry in buffer.items():
+                inc = {field: entry[field] for field in COUNTER_FIELDS if entry[field]}
+                inc.update({f"latency_hist.{name}": count for name, count in entry["latency_hist"].items()})
+                inc.update({f"error_classes.{name}": count for name, count in entry["error_classes"].items()})
+                writes.append(UpdateOne(
+                    {
+                        "bucket": bucket,
+                        "tenant_id": tenant_id,
+                        "agent_id": agent_id,
+                        "provider": provider,
+                        "model": model,
+                        "feature": feature
+                    },
+                    {"$inc": inc},
+                    upsert=True
+                ))
+            try:
+                await db.llm_usage.bulk_write(writes, ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to flush LLM usage ({len(writes)} rollups dropped): {str(e)}")
+
+    async def get_rollup(
+        self,
+        group_by: str = "tenant",
+        days: int = 7,
+        tenant_id: Optional[str] = None,
+        limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggregate usage by tenant, agent, model or feature.
+
+        Returns rows sorted by total tokens with averages and p50/p95 latency.
+        """
+        group_keys = {
+            "tenant": "$tenant_id",
+            "agent": {"tenant_id": "$tenant_id", "agent_id": "$agent_id"},
+            "model": {"provider": "$provider", "model": "$model"},
+            "feature": "$feature"
+        }
+        if group_by not in group_keys:
+            raise ValueError(f"group_by must be one of {list(group_keys)}")
+        group_names = {"tenant": "tenant_id", "feature": "feature"}
+
+        match: Dict[str, Any] = {"bucket": {"$gte": _hour_bucket(datetime.now(timezone.utc) - timedelta(days=days))}}
+        if tenant_id:
+            match["tenant_id"] = tenant_id
+
+        group: Dict[str, Any] = {"_id": group_keys[group_by]}
+        for field in COUNTER_FIELDS:
+            group[field] = {"$sum": f"${field}"}
+        for name in LATENCY_BUCKETS:
+            group[f"hist_{name}"] = {"$sum": f"$latency_hist.{name}"}
+
+        rows = await db.llm_usage.aggregate([
+            {"$match": match},
+            {"$group": group},
+            {"$sort": {"total_tokens": -1}},
+            {"$limit": limit}
+        ]).to_list(limit)
+
+        results = []
+        for row in rows:
+            histogram = {name: row.pop(f"hist_{name}", 0) for name in LATENCY_BUCKETS}
+            key = row.pop("_id")
+            calls = row["calls"] or 1
+            results.append({
+                **(key if isinstance(key, dict) else {group_names[group_by]: key}),
+                "calls": row["calls"],
+                "errors": row["errors"],
+                "estimated_calls": row["estimated_calls"],
+                "prompt_tokens": row["prompt_tokens"],
+                "completion_tokens": row["completion_tokens"],
+                "cached_tokens": row["cached_tokens"],
+                "total_tokens": row["total_tokens"],
+                "cost_usd": round(row["cost_usd"], 4),
+                "avg_latency_ms": round(row["latency_ms_sum"] / calls, 1),
+                "p50_latency_ms": histogram_percentile(histogram, 0.50),
+                "p95_latency_ms": histogram_percentile(histogram, 0.95),
+                "avg_ttft_ms": round(row["ttft_ms_sum"] / row["ttft_calls"], 1) if row["ttft_calls"] else None,
+                "error_rate": round(row["errors"] / calls, 4)
+            })
+        return results
+
+    async def get_tenant_tokens(self, tenant_id: str, since: datetime) -> int:
+        """Total tokens a tenant used since a time (hour granularity), e.g. for token quotas"""
+        rows = await db.llm_usage.aggregate([
+            {"$match": {"tenant_id": tenant_id, "bucket": {"$gte": _hour_bucket(since)}}},
+            {"$group": {"_id": None, "tokens": {"$sum": "$total_tokens"}}}
+        ]).to_list(1)
+        return rows[0]["tokens"] if rows else 0
+
+
+# Global LLM usage recorder instance
+llm_usage = LLMUsageRecorder()
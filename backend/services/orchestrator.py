@@ -2,21 +2,38 @@
 
 This service implements the System 1/System 2 architecture where:
 - Mother Agent (System 2): An LLM-based orchestrator that reasons about tasks
-- Child Agents (System 1): Deterministic agents that execute specific functions
+- Child Agents (System 1): Deterministic agents that execute specific functions,
+  exposed to the Mother as native tools (OpenAI function calling / Anthropic tool use)
 
 IMPORTANT: This service uses the API key from Admin Providers (stored in db.providers)
 for all LLM calls. It does NOT use the Emergent LLM key.
 """
+import asyncio
 import logging
+import re
+import time
 import uuid
 from datetime import datetime, timezone
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable, Awaitable
 import json
 
 from middleware.database import db
+from services.llm_governor import llm_governor, estimate_tokens
+from services.llm_usage import llm_usage
 
 logger = logging.getLogger(__name__)
 
+# Tool parameters for children with the woocommerce_operations capability
+WOOCOMMERCE_TOOL_PROPERTIES = {
+    "action": {
+        "type": "string",
+        "enum": ["list_products", "get_order", "list_orders"],
+        "description": "WooCommerce operation to run"
+    },
+    "order_id": {"type": "string", "description": "Order ID (for get_order)"},
+    "limit": {"type": "integer", "description": "Max results for list operations (default 10)"}
+}
+
 
 class OrchestratorService:
     """Service for orchestrating Mother/Child agent interactions"""
@@ -94,6 +111,17 @@ class OrchestratorService:
         """Get list of available children with their capabilities for the LLM prompt"""
         children_info = []
         
+        # Children with their own knowledge base can answer knowledge lookups (one query for all)
+        knowledge_child_ids = set()
+        if self.available_children:
+            knowledge_child_ids = set(await db.agent_documents.distinct(
+                "agent_id",
+                {
+                    "tenant_id": self.tenant_id,
+                    "agent_id": {"$in": [c["id"] for c in self.available_children]}
+                }
+            ))
+        
         for child in self.available_children:
             tags = child.get("tags", [])
             config = child.get("config", {})
@@ -102,6 +130,8 @@ class OrchestratorService:
             capabilities = []
             if config.get("woocommerce", {}).get("enabled"):
                 capabilities.append("woocommerce_operations")
+            if child["id"] in knowledge_child_ids:
+                capabilities.append("knowledge_search")
             
             children_info.append({
                 "id": child["id"],
@@ -147,14 +177,7 @@ When processing a request:
 1. First check if the answer is in the COMPANY KNOWLEDGE above
 2. If yes, answer ONLY from that knowledge
 3. If no, check if a child agent can handle it
-4. If a child agent can handle it, delegate using this EXACT JSON format:
-{{
-  "delegate": true,
-  "child_agent_id": "<agent_id>",
-  "action_type": "<action_type>",
-  "parameters": {{}},
-  "reasoning": "<brief explanation>"
-}}
+4. If a child agent can handle it, call that child agent's tool. If the request has several parts needing different child agents, call all of those tools at once
 5. If neither knowledge nor child agents can help, politely say you don't have that information
 
 Current user request: {user_prompt}"""
@@ -169,21 +192,12 @@ You have access to these child agents for specific tasks (orders, products only)
 {children_json}
 
 STRICT RULES:
-1. If a child agent can handle the request (like checking orders), delegate using JSON format below
+1. If a child agent can handle the request (like checking orders), call that child agent's tool (call several at once if the request has several parts)
 2. For ALL OTHER questions, you MUST respond EXACTLY with: "I don't have information about that topic in my knowledge base. Is there something else I can help you with regarding our products and services?"
 3. NEVER answer general knowledge questions (geography, history, science, math, celebrities, etc.)
 4. NEVER use your AI knowledge to answer anything
 5. If someone asks "what is the capital of France" or ANY general question, respond: "I can only help with questions about our company and services."
 
-For delegation ONLY, respond with this JSON format:
-{{
-  "delegate": true,
-  "child_agent_id": "<agent_id>",
-  "action_type": "<action_type>",
-  "parameters": {{}},
-  "reasoning": "<brief explanation>"
-}}
-
 Current user request: {user_prompt}
 
 Remember: If this is NOT about checking orders/products that a child agent can handle, you MUST refuse to answer."""
@@ -200,14 +214,7 @@ You can ONLY:
 You have access to these child agents:
 {children_json}
 
-For delegation, respond with EXACTLY this JSON format:
-{{
-  "delegate": true,
-  "child_agent_id": "<agent_id>",
-  "action_type": "<action_type>",
-  "parameters": {{}},
-  "reasoning": "<brief explanation>"
-}}
+To delegate, call the matching child agent's tool (call several at once if the request has several parts).
 
 DO NOT answer any general questions. DO NOT use your AI knowledge.
 
@@ -243,7 +250,8 @@ Current user request: {user_prompt}"""
         requested_actions: List[Dict] = None,
         executed_actions: List[Dict] = None,
         final_response: str = None,
-        status: str = None
+        status: str = None,
+        timings: Dict[str, Any] = None
     ):
         """Update the orchestration run log"""
         update_data = {}
@@ -254,6 +262,8 @@ Current user request: {user_prompt}"""
             update_data["executed_actions"] = executed_actions
         if final_response is not None:
             update_data["final_response"] = final_response
+        if timings is not None:
+            update_data["timings"] = timings
         if status is not None:
             update_data["status"] = status
             if status in ["completed", "failed"]:
@@ -288,6 +298,8 @@ Current user request: {user_prompt}"""
         # Execute based on action type
         if action_type == "woocommerce_operations":
             return await self._execute_woocommerce_action(child, parameters)
+        elif action_type == "knowledge_search":
+            return await self._execute_knowledge_search(child, parameters)
         else:
             return {
                 "success": False,
@@ -300,18 +312,16 @@ Current user request: {user_prompt}"""
         parameters: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Execute WooCommerce action via child agent"""
-        from services.woocommerce_service import decrypt_credential, WooCommerceService
+        from services.woocommerce_service import get_woocommerce_client
         
         wc_config = child.get("config", {}).get("woocommerce", {})
         if not wc_config.get("enabled"):
             return {"success": False, "error": "WooCommerce not enabled for this agent"}
         
         try:
-            store_url = wc_config.get("store_url")
-            consumer_key = decrypt_credential(wc_config.get("consumer_key_encrypted", ""))
-            consumer_secret = decrypt_credential(wc_config.get("consumer_secret_encrypted", ""))
-            
-            wc_service = WooCommerceService(store_url, consumer_key, consumer_secret)
+            wc_service = get_woocommerce_client(child.get("config", {}))
+            if not wc_service:
+                return {"success": False, "error": "WooCommerce integration not properly configured"}
             
             action = parameters.get("action", "list_products")
             
@@ -330,13 +340,74 @@ Current user request: {user_prompt}"""
             logger.error(f"WooCommerce action failed: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    async def _execute_knowledge_search(
+        self,
+        child: Dict[str, Any],
+        parameters: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Search a child agent's knowledge base"""
+        from services.rag_service import retrieve_relevant_chunks, format_context_for_agent
+        
+        query = parameters.get("query")
+        if not query:
+            return {"success": False, "error": "query parameter required"}
+        
+        chunks = await retrieve_relevant_chunks(
+            query=query,
+            company_id=self.tenant_id,
+            agent_id=child["id"],
+            db=db,
+            top_k=5
+        )
+        if not chunks:
+            return {"success": True, "data": "No relevant information found."}
+        return {"success": True, "data": format_context_for_agent(chunks)}
+    
+    async def _run_delegation(self, delegation: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Execute one delegated child action with a timeout, recording its timing"""
+        started_at = datetime.now(timezone.utc).isoformat()
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                self.execute_child_agent(
+                    delegation["child_agent_id"],
+                    delegation["action_type"],
+                    delegation["parameters"]
+                ),
+                timeout=timeout
+            )
+            status = "completed" if result.get("success") else "failed"
+        except asyncio.TimeoutError:
+            result = {"success": False, "error": f"Child agent timed out after {timeout}s"}
+            status = "timeout"
+        except Exception as e:
+            logger.error(f"Child agent {delegation['child_agent_id']} failed: {str(e)}")
+            result = {"success": False, "error": str(e)}
+            status = "failed"
+        
+        return {
+            **delegation,
+            "result": result,
+            "status": status,
+            "started_at": started_at,
+            "duration_ms": round((time.monotonic() - start) * 1000, 1)
+        }
+    
     async def process_with_mother(
         self,
         conversation_id: str,
         user_prompt: str,
-        message_history: List[Dict[str, str]] = None
+        message_history: List[Dict[str, str]] = None,
+        conversation_summary: str = "",
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
-        """Main orchestration flow - Mother agent processes request"""
+        """Main orchestration flow - Mother agent processes request
+        
+        Child agents are exposed to the Mother as native tools. If the Mother calls
+        one, the tool runs and the final answer continues the same conversation
+        turn (streamed through on_token when provided) instead of a separate
+        synthesis completion.
+        """
         if not self.mother_agent:
             return {
                 "success": False,
@@ -410,6 +481,8 @@ Current user request: {user_prompt}"""
             
             # Build orchestration prompt WITH knowledge context and knowledge base flag
             system_prompt = self.build_orchestration_prompt(user_prompt, children, knowledge_context, has_knowledge_base)
+            if conversation_summary:
+                system_prompt += f"\n\nSummary of the earlier conversation:\n{conversation_summary}"
             
             # Get provider for Mother agent
             provider = await db.providers.find_one(
@@ -421,71 +494,86 @@ Current user request: {user_prompt}"""
                 await self.update_run_log(run_id, status="failed")
                 return {"success": False, "error": "Mother agent provider not available"}
             
-            # Call the Mother agent LLM
-            response_text = await self._call_mother_llm(
-                provider,
-                system_prompt,
-                message_history or []
-            )
+            # Call the Mother agent LLM with child agents exposed as tools
+            tools, tool_children = self.build_child_tools(children)
+            policy = (self.config or {}).get("policy", {}) or {}
+            max_depth = max(int(policy.get("max_delegation_depth", 1)), 1)
+            tool_timeout = policy.get("timeout_seconds", 30)
             
-            # Check if Mother wants to delegate
-            delegation = self._parse_delegation_response(response_text)
+            messages = list(message_history or [])
+            if not messages:
+                messages = [{"role": "user", "content": user_prompt}]
             
-            if delegation:
-                # Log the requested action
-                await self.update_run_log(
-                    run_id,
-                    requested_actions=[delegation],
-                    status="processing"
-                )
-                
-                # Execute the child agent
-                result = await self.execute_child_agent(
-                    delegation["child_agent_id"],
-                    delegation["action_type"],
-                    delegation.get("parameters", {})
-                )
+            requested_actions = []
+            executed_actions = []
+            timings = {"llm_calls_ms": [], "children_rounds_ms": []}
+            run_start = time.monotonic()
+            
+            call_start = time.monotonic()
+            turn = await self._call_mother_llm(provider, system_prompt, messages, tools, on_token=on_token)
+            timings["llm_calls_ms"].append(round((time.monotonic() - call_start) * 1000, 1))
+            depth = 0
+            
+            while turn["tool_calls"] and depth < max_depth:
+                depth += 1
+                delegations = []
+                for call in turn["tool_calls"]:
+                    args = dict(call["arguments"] or {})
+                    action_type = args.pop("action_type", None) or "woocommerce_operations"
+                    reasoning = args.pop("reasoning", "")
+                    delegations.append({
+                        "tool_call_id": call["id"],
+                        "child_agent_id": tool_children.get(call["name"]),
+                        "action_type": action_type,
+                        "parameters": args,
+                        "reasoning": reasoning
+                    })
+                requested_actions.extend(delegations)
+                await self.update_run_log(run_id, requested_actions=requested_actions, status="processing")
                 
-                # Log execution
-                executed = {**delegation, "result": result}
-                await self.update_run_log(
-                    run_id,
-                    executed_actions=[executed],
-                    status="completed" if result["success"] else "failed"
-                )
+                # Run every delegated child concurrently; failures and timeouts come back as
+                # error results so the Mother can still answer from the partial results
+                round_start = time.monotonic()
+                executed = await asyncio.gather(*[
+                    self._run_delegation(delegation, tool_timeout) for delegation in delegations
+                ])
+                timings["children_rounds_ms"].append(round((time.monotonic() - round_start) * 1000, 1))
+                executed_actions.extend(executed)
+                tool_results = [(e["tool_call_id"], e["result"]) for e in executed]
                 
-                # Generate final response using Mother with the result
-                if result["success"]:
-                    final_response = await self._generate_final_response(
-                        provider,
-                        user_prompt,
-                        result["data"]
-                    )
-                else:
-                    final_response = f"I tried to help but encountered an issue: {result.get('error', 'Unknown error')}"
+                await self.update_run_log(run_id, executed_actions=executed_actions, timings=timings)
                 
-                await self.update_run_log(run_id, final_response=final_response)
+                self._append_tool_results(provider, messages, turn, tool_results)
                 
-                return {
-                    "success": True,
-                    "response": final_response,
-                    "delegated": True,
-                    "run_id": run_id
-                }
-            else:
-                # Mother responded directly
-                await self.update_run_log(
-                    run_id,
-                    final_response=response_text,
-                    status="completed"
+                # Same conversation turn: the Mother phrases the answer from the tool results.
+                # Past the delegation depth, tools stay declared but can no longer be chosen.
+                allow_tools = depth < max_depth
+                call_start = time.monotonic()
+                turn = await self._call_mother_llm(
+                    provider, system_prompt, messages, tools,
+                    on_token=on_token, allow_tools=allow_tools
                 )
-                
-                return {
-                    "success": True,
-                    "response": response_text,
-                    "delegated": False,
-                    "run_id": run_id
-                }
+                timings["llm_calls_ms"].append(round((time.monotonic() - call_start) * 1000, 1))
+            
+            final_response = turn["text"] or "I apologize, but I couldn't process your request."
+            delegated = bool(executed_actions)
+            timings["total_ms"] = round((time.monotonic() - run_start) * 1000, 1)
+            
+            # Partial success still completes the run - the answer covers what succeeded
+            any_succeeded = any(a["status"] == "completed" for a in executed_actions)
+            await self.update_run_log(
+                run_id,
+                final_response=final_response,
+                timings=timings,
+                status="completed" if not executed_actions or any_succeeded else "failed"
+            )
+            
+            return {
+                "success": True,
+                "response": final_response,
+                "delegated": delegated,
+                "run_id": run_id
+            }
                 
         except Exception as e:
             logger.error(f"Orchestration failed: {str(e)}")
@@ -496,15 +584,96 @@ Current user request: {user_prompt}"""
                 "run_id": run_id
             }
     
+    def build_child_tools(self, children: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """Describe child agents as provider-neutral tools
+        
+        Returns:
+            (tools, {tool_name: child_agent_id}). Each tool is
+            {"name", "description", "parameters": <JSON schema>}.
+        """
+        tools = []
+        tool_children = {}
+        for child in children:
+            if not child.get("capabilities"):
+                # Nothing the child could execute
+                continue
+            
+            name = "child_" + re.sub(r"[^a-zA-Z0-9_]", "", child["id"].replace("-", ""))[:32]
+            description = f"Delegate to child agent '{child['name']}'"
+            if child.get("description"):
+                description += f": {child['description']}"
+            if child.get("tags"):
+                description += f" (tags: {', '.join(child['tags'])})"
+            
+            properties: Dict[str, Any] = {
+                "action_type": {"type": "string", "enum": child["capabilities"]},
+                "reasoning": {"type": "string", "description": "Brief explanation of why this agent is needed"}
+            }
+            if "woocommerce_operations" in child["capabilities"]:
+                properties.update(WOOCOMMERCE_TOOL_PROPERTIES)
+            if "knowledge_search" in child["capabilities"]:
+                properties["query"] = {"type": "string", "description": "What to look up (for knowledge_search)"}
+            
+            tools.append({
+                "name": name,
+                "description": description[:1024],
+                "parameters": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": ["action_type"]
+                }
+            })
+            tool_children[name] = child["id"]
+        
+        return tools, tool_children
+    
+    @staticmethod
+    def _append_tool_results(
+        provider: Dict[str, Any],
+        messages: List[Dict[str, Any]],
+        turn: Dict[str, Any],
+        tool_results: List[Tuple[str, Dict[str, Any]]]
+    ):
+        """Append the assistant tool-call message and the tool results in the provider's format"""
+        messages.append(turn["assistant_message"])
+        if provider.get("type", "openai") == "anthropic":
+            messages.append({
+                "role": "user",
+                "content": [
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": call_id,
+                        "content": json.dumps(result, default=str),
+                        "is_error": not result.get("success", False)
+                    }
+                    for call_id, result in tool_results
+                ]
+            })
+        else:
+            for call_id, result in tool_results:
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": call_id,
+                    "content": json.dumps(result, default=str)
+                })
+    
     async def _call_mother_llm(
         self,
         provider: Dict[str, Any],
         system_prompt: str,
-        message_history: List[Dict[str, str]]
-    ) -> str:
-        """Call the Mother agent's LLM using the provider's API key from Admin Providers"""
-        import openai
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]] = None,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+        allow_tools: bool = True
+    ) -> Dict[str, Any]:
+        """Call the Mother agent's LLM using the provider's API key from Admin Providers
         
+        Streams the completion (forwarding text to on_token) and collects native
+        tool calls.
+        
+        Returns:
+            {"text": str, "tool_calls": [{"id", "name", "arguments"}], "assistant_message": dict}
+        """
         # IMPORTANT: Always use the API key from the Admin Provider configured for the Mother agent
         # Never use EMERGENT_LLM_KEY - always use the provider's own key
         api_key = provider.get("api_key")
@@ -513,159 +682,139 @@ Current user request: {user_prompt}"""
         
         provider_type = provider.get("type", "openai")
         model = self.mother_agent.get("model", "gpt-4o")
+        max_tokens_value = self.mother_agent.get("max_tokens", 2000)
+        temperature = self.mother_agent.get("temperature", 0.7)
         
         if provider_type == "openai":
-            client = openai.OpenAI(api_key=api_key)
+            import openai
+            client = openai.AsyncOpenAI(api_key=api_key)
             
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(message_history)
+            api_messages = [{"role": "system", "content": system_prompt}]
+            api_messages.extend(messages)
             
+            params = {
+                "model": model,
+                "messages": api_messages,
+                "temperature": temperature,
+                "stream": True,
+                "stream_options": {"include_usage": True}
+            }
             # Handle different OpenAI model parameter requirements
             # o-series models (o1, o3, etc.) and gpt-5.x use max_completion_tokens
             # Older models (gpt-4, gpt-4o) use max_tokens
-            max_tokens_value = self.mother_agent.get("max_tokens", 2000)
-            
-            # Check if model requires max_completion_tokens (newer models)
-            uses_new_param = any(prefix in model.lower() for prefix in ['o1', 'o3', 'o4', 'gpt-5'])
-            
-            if uses_new_param:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=self.mother_agent.get("temperature", 0.7),
-                    max_completion_tokens=max_tokens_value
-                )
+            if any(prefix in model.lower() for prefix in ['o1', 'o3', 'o4', 'gpt-5']):
+                params["max_completion_tokens"] = max_tokens_value
             else:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=self.mother_agent.get("temperature", 0.7),
-                    max_tokens=max_tokens_value
-                )
+                params["max_tokens"] = max_tokens_value
+            if tools:
+                params["tools"] = [
+                    {"type": "function", "function": {
+                        "name": t["name"], "description": t["description"], "parameters": t["parameters"]
+                    }}
+                    for t in tools
+                ]
+                params["tool_choice"] = "auto" if allow_tools else "none"
             
-            return response.choices[0].message.content
+            text_parts = []
+            calls: Dict[int, Dict[str, Any]] = {}
+            estimated = estimate_tokens(api_messages, json.dumps(tools or []), max_tokens_value)
+            async with llm_governor.slot(provider, model, self.tenant_id, estimated) as slot:
+                async with llm_usage.track(
+                    self.tenant_id, self.mother_agent.get("id"), provider_type, model, "orchestrator"
+                ) as usage_call:
+                    stream = await client.chat.completions.create(**params)
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            slot.record_usage(chunk.usage.total_tokens)
+                            usage_call.set_usage_from(chunk.usage)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        if delta.content or delta.tool_calls:
+                            usage_call.first_token()
+                        if delta.content:
+                            text_parts.append(delta.content)
+                            if on_token:
+                                await on_token(delta.content)
+                        for tc in delta.tool_calls or []:
+                            call = calls.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+                            if tc.id:
+                                call["id"] = tc.id
+                            if tc.function and tc.function.name:
+                                call["name"] += tc.function.name
+                            if tc.function and tc.function.arguments:
+                                call["arguments"] += tc.function.arguments
+            
+            text = "".join(text_parts)
+            tool_calls = [
+                {"id": c["id"], "name": c["name"], "arguments": _parse_tool_arguments(c["arguments"])}
+                for _, c in sorted(calls.items())
+            ]
+            assistant_message: Dict[str, Any] = {"role": "assistant", "content": text or None}
+            if tool_calls:
+                assistant_message["tool_calls"] = [
+                    {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+                    for _, c in sorted(calls.items())
+                ]
+            return {"text": text, "tool_calls": tool_calls, "assistant_message": assistant_message}
         
         elif provider_type == "anthropic":
             import anthropic
-            client = anthropic.Anthropic(api_key=api_key)
+            client = anthropic.AsyncAnthropic(api_key=api_key)
             
-            response = client.messages.create(
-                model=model,
-                max_tokens=self.mother_agent.get("max_tokens", 2000),
-                system=system_prompt,
-                messages=message_history if message_history else [{"role": "user", "content": "Please analyze and respond."}]
-            )
+            params = {
+                "model": model,
+                "max_tokens": max_tokens_value,
+                "system": system_prompt,
+                "messages": messages
+            }
+            if tools:
+                params["tools"] = [
+                    {"name": t["name"], "description": t["description"], "input_schema": t["parameters"]}
+                    for t in tools
+                ]
+                params["tool_choice"] = {"type": "auto" if allow_tools else "none"}
             
-            return response.content[0].text
+            estimated = estimate_tokens(messages, system_prompt + json.dumps(tools or []), max_tokens_value)
+            async with llm_governor.slot(provider, model, self.tenant_id, estimated) as slot:
+                async with llm_usage.track(
+                    self.tenant_id, self.mother_agent.get("id"), provider_type, model, "orchestrator"
+                ) as usage_call:
+                    async with client.messages.stream(**params) as stream:
+                        async for text_delta in stream.text_stream:
+                            usage_call.first_token()
+                            if on_token:
+                                await on_token(text_delta)
+                        final = await stream.get_final_message()
+                    usage_call.set_usage_from(getattr(final, "usage", None))
+                if getattr(final, "usage", None):
+                    slot.record_usage(final.usage.input_tokens + final.usage.output_tokens)
+            
+            text = "".join(block.text for block in final.content if block.type == "text")
+            tool_calls = [
+                {"id": block.id, "name": block.name, "arguments": dict(block.input or {})}
+                for block in final.content if block.type == "tool_use"
+            ]
+            assistant_message = {
+                "role": "assistant",
+                "content": [block.model_dump(exclude_none=True) for block in final.content]
+            }
+            return {"text": text, "tool_calls": tool_calls, "assistant_message": assistant_message}
         
         else:
             raise ValueError(f"Unsupported provider type: {provider_type}")
-    
-    def _parse_delegation_response(self, response: str) -> Optional[Dict[str, Any]]:
-        """Parse Mother's response to check for delegation intent"""
-        try:
-            # Try to parse as JSON
-            response = response.strip()
-            
-            # Handle markdown code blocks
-            if response.startswith("```json"):
-                response = response[7:]
-            if response.startswith("```"):
-                response = response[3:]
-            if response.endswith("```"):
-                response = response[:-3]
-            
-            response = response.strip()
-            
-            data = json.loads(response)
-            
-            if data.get("delegate") is True and data.get("child_agent_id"):
-                return {
-                    "child_agent_id": data["child_agent_id"],
-                    "action_type": data.get("action_type", "unknown"),
-                    "parameters": data.get("parameters", {}),
-                    "reasoning": data.get("reasoning", "")
-                }
-        except (json.JSONDecodeError, KeyError, TypeError):
-            pass
-        
-        return None
-    
-    async def _generate_final_response(
-        self,
-        provider: Dict[str, Any],
-        original_prompt: str,
-        child_result: Any
-    ) -> str:
-        """Generate a human-friendly response from the child agent's result
-        
-        Uses the provider's API key from Admin Providers - never the Emergent key
-        """
-        import openai
-        
-        result_json = json.dumps(child_result, indent=2, default=str)
-        
-        synthesis_prompt = f"""Based on the user's original request and the data retrieved, provide a helpful response.
-
-Original request: {original_prompt}
 
-Retrieved data:
-{result_json}
 
-Provide a natural, helpful response that addresses the user's request using this data."""
-        
-        # IMPORTANT: Always use the API key from the Admin Provider
-        api_key = provider.get("api_key")
-        if not api_key:
-            raise ValueError("Provider does not have an API key configured")
-        
-        provider_type = provider.get("type", "openai")
-        model = self.mother_agent.get("model", "gpt-4o")
-        
-        if provider_type == "openai":
-            client = openai.OpenAI(api_key=api_key)
-            
-            # Handle different OpenAI model parameter requirements
-            uses_new_param = any(prefix in model.lower() for prefix in ['o1', 'o3', 'o4', 'gpt-5'])
-            
-            if uses_new_param:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that synthesizes information into clear responses."},
-                        {"role": "user", "content": synthesis_prompt}
-                    ],
-                    temperature=0.7,
-                    max_completion_tokens=2000
-                )
-            else:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that synthesizes information into clear responses."},
-                        {"role": "user", "content": synthesis_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=2000
-                )
-            
-            return response.choices[0].message.content
-        
-        elif provider_type == "anthropic":
-            import anthropic
-            client = anthropic.Anthropic(api_key=api_key)
-            
-            response = client.messages.create(
-                model=model,
-                max_tokens=2000,
-                system="You are a helpful assistant that synthesizes information into clear responses.",
-                messages=[{"role": "user", "content": synthesis_prompt}]
-            )
-            
-            return response.content[0].text
-        
-        else:
-            raise ValueError(f"Unsupported provider type: {provider_type}")
+def _parse_tool_arguments(raw: str) -> Dict[str, Any]:
+    """Parse a streamed tool-call argument string (empty or malformed -> {})"""
+    if not raw:
+        return {}
+    try:
+        parsed = json.loads(raw)
+        return parsed if isinstance(parsed, dict) else {}
+    except json.JSONDecodeError:
+        logger.warning(f"Could not parse tool arguments: {raw[:200]}")
+        return {}
 
 
 async def get_orchestrator(tenant_id: str) -> Optional[OrchestratorService]:
@@ -0,0 +1,69 @@
+"""
+Pipeline Lease - One worker at a time for scheduled background jobs
+
+Every worker schedules the same jobs (sentiment scoring, unread counter
+repair); a lease document in ``pipeline_leases`` decides which one runs. A
+worker takes the lease by upserting over an expired one: the unique index on
+``id`` turns a concurrent or unexpired take into a DuplicateKeyError. Each take
+stores a fresh owner token and release only matches that token, so a worker
+whose run overran its lease can't release the lease another worker took since.
+"""
+import logging
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineLease:
+    """Expiring, owner-tagged lease on a named job"""
+
+    def __init__(self, name: str, seconds: int):
+        self.name = name
+        self.seconds = seconds
+        self.owner: Optional[str] = None
+        self._indexed = False
+
+    async def _ensure_index(self) -> bool:
+        # Without the unique index a lost upsert race inserts a second lease
+        if not self._indexed:
+            try:
+                await db.pipeline_leases.create_index("id", unique=True)
+                self._indexed = True
+            except Exception as e:
+                logger.error(f"Cannot create unique index on pipeline_leases, not running {self.name}: {str(e)}")
+        return self._indexed
+
+    async def acquire(self) -> bool:
+        if not await self._ensure_index():
+            return False
+        now = datetime.now(timezone.utc)
+        owner = str(uuid.uuid4())
+        try:
+            await db.pipeline_leases.update_one(
+                {"id": self.name, "expires_at": {"$lt": now.isoformat()}},
+                {"$set": {
+                    "expires_at": (now + timedelta(seconds=self.seconds)).isoformat(),
+                    "owner": owner
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            return False
+        self.owner = owner
+        return True
+
+    async def release(self):
+        if self.owner is None:
+            return
+        owner, self.owner = self.owner, None
+        await db.pipeline_leases.update_one(
+            {"id": self.name, "owner": owner},
+            {"$set": {"expires_at": datetime.now(timezone.utc).isoformat()}}
+        )
@@ -0,0 +1,191 @@
+"""
+Presence - Multi-connection user presence with heartbeat TTL and batched diffs
+
+Every open WebSocket is a document in messaging_presence carrying an
+``expires_at``. The worker holding the socket refreshes all of its connections
+with one write every HEARTBEAT_SECONDS; if a worker dies its connections simply
+expire. A user is online while at least one unexpired connection exists, so a
+second tab no longer replaces the first and closing one tab doesn't mark the
+user offline.
+
+Status changes are not broadcast one by one. They are collected per tenant and
+flushed every PRESENCE_FLUSH_MS as a single ``presence_batch`` event, and flaps
+inside one window (reconnects) cancel out, so a reconnect storm after a deploy
+costs one batch per tenant instead of one message per user per user.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Set
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+HEARTBEAT_SECONDS = int(os.environ.get("PRESENCE_HEARTBEAT_SECONDS", "20"))
+CONNECTION_TTL_SECONDS = HEARTBEAT_SECONDS * 3  # Missed heartbeats before a connection expires
+FLUSH_INTERVAL_SECONDS = int(os.environ.get("PRESENCE_FLUSH_MS", "500")) / 1000
+
+
+class PresenceService:
+    """Tracks connections per user and broadcasts coalesced presence diffs"""
+
+    def __init__(self):
+        # connection id -> (tenant_id, user_id) for this worker's sockets
+        self._local: Dict[str, tuple] = {}
+        # tenant_id -> user_id -> pending status
+        self._pending: Dict[str, Dict[str, str]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._counters = {"connects": 0, "disconnects": 0, "expired": 0, "batches": 0, "changes": 0}
+
+    def start(self):
+        """Start the heartbeat and flush loops"""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._heartbeat_loop()),
+                asyncio.create_task(self._flush_loop())
+            ]
+            logger.info(f"Presence started (heartbeat {HEARTBEAT_SECONDS}s, flush {FLUSH_INTERVAL_SECONDS}s)")
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        # Drop this worker's connections instead of waiting for them to expire
+        if self._local:
+            await db.messaging_presence.delete_many({"id": {"$in": list(self._local)}})
+            self._local.clear()
+
+    @staticmethod
+    def _expiry() -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=CONNECTION_TTL_SECONDS)
+
+    async def _user_connected(self, user_id: str) -> bool:
+        return await db.messaging_presence.count_documents(
+            {"user_id": user_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            limit=1
+        ) > 0
+
+    async def connect(self, tenant_id: str, user_id: str, connection_id: str, user_name: str):
+        self._counters["connects"] += 1
+        self._local[connection_id] = (tenant_id, user_id)
+        already_online = await self._user_connected(user_id)
+        await db.messaging_presence.insert_one({
+            "id": connection_id,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "user_name": user_name,
+            "connected_at": datetime.now(timezone.utc).isoformat(),
+            "expires_at": self._expiry()
+        })
+        if not already_online:
+            self._queue(tenant_id, user_id, "online")
+
+    async def disconnect(self, connection_id: str):
+        location = self._local.pop(connection_id, None)
+        if location is None:
+            return
+        self._counters["disconnects"] += 1
+        tenant_id, user_id = location
+        await db.messaging_presence.delete_one({"id": connection_id})
+        if not await self._user_connected(user_id):
+            await self._went_offline(tenant_id, user_id)
+
+    async def _went_offline(self, tenant_id: str, user_id: str):
+        await db.users.update_one(
+            {"id": user_id},
+            {"$set": {"last_seen_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        self._queue(tenant_id, user_id, "offline")
+
+    def _queue(self, tenant_id: str, user_id: str, status: str):
+        pending = self._pending.setdefault(tenant_id, {})
+        if pending.get(user_id, status) != status:
+            # Offline-then-online (or the reverse) inside one window is no change
+            del pending[user_id]
+        else:
+            pending[user_id] = status
+
+    async def get_online_user_ids(self, tenant_id: str) -> Set[str]:
+        """Users with at least one live connection on any worker"""
+        user_ids = await db.messaging_presence.distinct(
+            "user_id",
+            {"tenant_id": tenant_id, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+        )
+        return set(user_ids)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                if self._local:
+                    await db.messaging_presence.update_many(
+                        {"id": {"$in": list(self._local)}},
+                        {"$set": {"expires_at": self._expiry()}}
+                    )
+                await self._sweep_expired()
+            except Exception as e:
+                logger.warning(f"Presence heartbeat failed: {str(e)}")
+
+    async def _sweep_expired(self):
+        """Remove connections whose worker stopped heartbeating and announce who went offline"""
+        now = datetime.now(timezone.utc)
+        expired = await db.messaging_presence.find(
+            {"expires_at": {"$lte": now}},
+            {"_id": 0, "id": 1, "tenant_id": 1, "user_id": 1}
+        ).to_list(1000)
+        if not expired:
+            return
+        await db.messaging_presence.delete_many({"id": {"$in": [c["id"] for c in expired]}})
+        self._counters["expired"] += len(expired)
+        for tenant_id, user_id in {(c["tenant_id"], c["user_id"]) for c in expired}:
+            if not await self._user_connected(user_id):
+                await self._went_offline(tenant_id, user_id)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Presence flush failed: {str(e)}")
+
+    async def flush(self):
+        """Broadcast one batched presence diff per tenant"""
+        from routes.messaging import manager
+
+        pending, self._pending = self._pending, {}
+        now = datetime.now(timezone.utc).isoformat()
+        for tenant_id, statuses in pending.items():
+            if not statuses:
+                continue
+            # The user may have reconnected (or dropped) on another worker meanwhile
+            online = set(await db.messaging_presence.distinct("user_id", {
+                "user_id": {"$in": list(statuses)},
+                "expires_at": {"$gt": datetime.now(timezone.utc)}
+            }))
+            changes = [
+                {"user_id": user_id, "status": status, "last_seen": now}
+                for user_id, status in statuses.items()
+                if (status == "online") == (user_id in online)
+            ]
+            if changes:
+                self._counters["batches"] += 1
+                self._counters["changes"] += len(changes)
+                await manager.broadcast_to_tenant(tenant_id, {
+                    "type": "presence_batch",
+                    "payload": {"changes": changes}
+                })
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "local_connections": len(self._local),
+            "pending_changes": sum(len(s) for s in self._pending.values()),
+            **self._counters
+        }
+
+
+# Global presence service instance
+presence_service = PresenceService()
@@ -0,0 +1,213 @@
+"""
+Realtime Bus - Cross-worker pub/sub for WebSocket fan-out
+
+Each worker only holds its own sockets. Events for a tenant are published on
+the bus, and every worker with local connections in that tenant subscribes to
+it and delivers the event to its own sockets. The publishing worker delivers
+locally right away and ignores its own events when they come back off the bus.
+
+Backends (REALTIME_BUS):
+- ``memory``: in-process only (single worker, tests)
+- ``mongo``: events inserted into realtime_events, read with one change stream
+  per subscribed tenant (needs a replica set; old events expire via TTL index)
+- ``redis``: Redis-compatible pub/sub, one channel per tenant (REDIS_URL)
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict
+
+from middleware.database import db
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    aioredis = None
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+BUS_BACKEND = os.environ.get("REALTIME_BUS", "memory").lower()
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+EVENT_TTL_SECONDS = 60  # How long mongo bus events are kept
+RESUBSCRIBE_DELAY_SECONDS = 1.0
+
+# Called with the envelope of each event another worker published for the handler's target
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class RealtimeBus:
+    """Base bus: per-tenant subscriptions, origin tagging and self-filtering"""
+
+    name = "base"
+
+    def __init__(self):
+        self.worker_id = str(uuid.uuid4())
+        self._handlers: Dict[str, EventHandler] = {}
+        self._subscriptions: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, int] = {}
+        self._counters = {"published": 0, "received": 0, "publish_errors": 0}
+
+    def add_handler(self, target: str, handler: EventHandler):
+        """Register the callback delivering remote events of a target kind to local sockets"""
+        self._handlers[target] = handler
+
+    async def publish(self, tenant_id: str, event: Dict[str, Any]):
+        """Publish an event envelope for other workers"""
+        envelope = {**event, "tenant_id": tenant_id, "origin": self.worker_id}
+        try:
+            await self._publish(tenant_id, envelope)
+            self._counters["published"] += 1
+        except Exception as e:
+            self._counters["publish_errors"] += 1
+            logger.warning(f"Realtime bus publish failed for tenant {tenant_id}: {str(e)}")
+
+    def subscribe(self, tenant_id: str):
+        """Start receiving a tenant's events; reference counted across local users of the bus"""
+        self._subscribers[tenant_id] = self._subscribers.get(tenant_id, 0) + 1
+        task = self._subscriptions.get(tenant_id)
+        if task is None or task.done():
+            self._subscriptions[tenant_id] = asyncio.create_task(self._listen_forever(tenant_id))
+
+    def unsubscribe(self, tenant_id: str):
+        remaining = self._subscribers.get(tenant_id, 0) - 1
+        if remaining > 0:
+            self._subscribers[tenant_id] = remaining
+            return
+        self._subscribers.pop(tenant_id, None)
+        task = self._subscriptions.pop(tenant_id, None)
+        if task:
+            task.cancel()
+
+    async def close(self):
+        self._subscribers.clear()
+        for task in self._subscriptions.values():
+            task.cancel()
+        self._subscriptions.clear()
+
+    async def _listen_forever(self, tenant_id: str):
+        # Reconnect after backend errors for as long as the subscription exists
+        while True:
+            try:
+                await self._listen(tenant_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Realtime bus subscription for tenant {tenant_id} failed: {str(e)}")
+            await asyncio.sleep(RESUBSCRIBE_DELAY_SECONDS)
+
+    async def _dispatch(self, envelope: Dict[str, Any]):
+        if envelope.get("origin") == self.worker_id:
+            return
+        handler = self._handlers.get(envelope.get("target"))
+        if handler is None:
+            return
+        self._counters["received"] += 1
+        try:
+            await handler(envelope)
+        except Exception as e:
+            logger.error(f"Realtime bus handler failed: {str(e)}")
+
+    async def _publish(self, tenant_id: str, envelope: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def _listen(self, tenant_id: str):
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "worker_id": self.worker_id,
+            "subscribed_tenants": len(self._subscriptions),
+            **self._counters
+        }
+
+
+class InProcessBus(RealtimeBus):
+    """Single-process bus: the publishing worker already delivered everything"""
+
+    name = "memory"
+
+    def subscribe(self, tenant_id: str):
+        return
+
+    def unsubscribe(self, tenant_id: str):
+        return
+
+    async def _publish(self, tenant_id: str, envelope: Dict[str, Any]):
+        return
+
+
+class MongoChangeStreamBus(RealtimeBus):
+    """Events as documents in realtime_events, tailed with change streams"""
+
+    name = "mongo"
+
+    async def _publish(self, tenant_id: str, envelope: Dict[str, Any]):
+        await db.realtime_events.insert_one({
+            "tenant_id": tenant_id,
+            "origin": envelope["origin"],
+            "event": json.dumps(envelope, default=str),
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=EVENT_TTL_SECONDS)
+        })
+
+    async def _listen(self, tenant_id: str):
+        pipeline = [{"$match": {
+            "operationType": "insert",
+            "fullDocument.tenant_id": tenant_id,
+            "fullDocument.origin": {"$ne": self.worker_id}
+        }}]
+        async with db.realtime_events.watch(pipeline) as stream:
+            async for change in stream:
+                await self._dispatch(json.loads(change["fullDocument"]["event"]))
+
+
+class RedisBus(RealtimeBus):
+    """Redis-compatible pub/sub, one channel per tenant"""
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL):
+        super().__init__()
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("REALTIME_BUS=redis requires the 'redis' package")
+        self._redis = aioredis.from_url(url)
+
+    @staticmethod
+    def _channel(tenant_id: str) -> str:
+        return f"realtime:{tenant_id}"
+
+    async def _publish(self, tenant_id: str, envelope: Dict[str, Any]):
+        await self._redis.publish(self._channel(tenant_id), json.dumps(envelope, default=str))
+
+    async def _listen(self, tenant_id: str):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self._channel(tenant_id))
+        try:
+            async for item in pubsub.listen():
+                if item.get("type") == "message":
+                    await self._dispatch(json.loads(item["data"]))
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        await super().close()
+        await self._redis.aclose()
+
+
+def create_bus(backend: str = BUS_BACKEND) -> RealtimeBus:
+    if backend == "mongo":
+        return MongoChangeStreamBus()
+    if backend == "redis":
+        return RedisBus()
+    if backend != "memory":
+        logger.warning(f"Unknown REALTIME_BUS '{backend}', using in-process bus")
+    return InProcessBus()
+
+
+# Global realtime bus instance
+realtime_bus = create_bus()
@@ -0,0 +1,234 @@
+"""
+Search Service - Tenant-partitioned term index for messaging, tickets, CRM and KB
+
+Search used to be a case-insensitive, unanchored ``$regex`` over the raw user
+input, which scans the whole collection (and lets the input act as a regex).
+Searchable documents are now tokenized on write into ``search_index``: one
+entry per document holding its lowercase terms, keyed by tenant and scope.
+
+A query is tokenized the same way and every query token must prefix-match one
+of the entry's terms. Anchored, escaped prefix regexes on the
+``(tenant_id, scope, terms)`` index are bounded range scans, so latency depends
+on the number of matches rather than the size of the collection. Candidates are
+ranked in process: exact matches beat prefix matches, title-like fields beat
+body text, and newer documents win ties.
+"""
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from middleware.database import db
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_TERMS_PER_DOCUMENT = 2000  # Long KB articles are indexed on their first terms
+MAX_TERM_LENGTH = 40
+MAX_QUERY_TOKENS = 8
+MAX_CANDIDATES = 1000  # Index entries ranked per scope and query
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# scope -> source collection, indexed fields, boosted (title-like) fields,
+# fields copied into the entry for filtering, and the recency field
+SCOPES: Dict[str, Dict[str, Any]] = {
+    "messages": {
+        "collection": "messaging_messages",
+        "fields": ["content"],
+        "boost": [],
+        "attrs": ["channel_id", "dm_conversation_id", "parent_id"],
+        "sort_field": "created_at",
+    },
+    "tickets": {
+        "collection": "tickets",
+        "fields": ["title", "description", "customer_name", "customer_email"],
+        "boost": ["title", "customer_name", "customer_email"],
+        "attrs": [],
+        "sort_field": "created_at",
+    },
+    "customers": {
+        "collection": "crm_customers",
+        "fields": ["name", "email", "company"],
+        "boost": ["name", "email"],
+        "attrs": [],
+        "sort_field": "updated_at",
+    },
+    "kb": {
+        "collection": "company_knowledge_base",
+        "fields": ["name", "content", "tags"],
+        "boost": ["name", "tags"],
+        "attrs": [],
+        "sort_field": "created_at",
+    },
+}
+
+# Score per query token
+EXACT_BOOST_SCORE = 4.0
+PREFIX_BOOST_SCORE = 3.0
+EXACT_SCORE = 2.0
+PREFIX_SCORE = 1.0
+
+
+def tokenize(text: Any) -> List[str]:
+    """Lowercase word tokens of a string (or list of strings), in order"""
+    if not text:
+        return []
+    if isinstance(text, (list, tuple, set)):
+        text = " ".join(str(t) for t in text if t)
+    return [t[:MAX_TERM_LENGTH] for t in TOKEN_PATTERN.findall(str(text).lower())]
+
+
+def _unique(tokens: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(tokens))
+
+
+class SearchService:
+    """Maintains search_index entries and answers ranked prefix queries"""
+
+    def __init__(self):
+        self._counters = {"indexed": 0, "removed": 0, "queries": 0}
+
+    @staticmethod
+    def _scope(scope: str) -> Dict[str, Any]:
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown search scope '{scope}'")
+        return SCOPES[scope]
+
+    def build_entry(self, scope: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Index entry for a source document"""
+        config = self._scope(scope)
+        terms = _unique(t for field in config["fields"] for t in tokenize(document.get(field)))
+        boost_terms = _unique(t for field in config["boost"] for t in tokenize(document.get(field)))
+        entry = {
+            "scope": scope,
+            "doc_id": document["id"],
+            "tenant_id": document.get("tenant_id"),
+            "terms": terms[:MAX_TERMS_PER_DOCUMENT],
+            "boost_terms": boost_terms[:MAX_TERMS_PER_DOCUMENT],
+            "sort_at": document.get(config["sort_field"]) or datetime.now(timezone.utc).isoformat(),
+        }
+        for attr in config["attrs"]:
+            entry[attr] = document.get(attr)
+        return entry
+
+    async def index_document(self, scope: str, document: Dict[str, Any]):
+        """Create or refresh the entry for a document after it was written"""
+        try:
+            entry = self.build_entry(scope, document)
+            await db.search_index.replace_one(
+                {"scope": scope, "doc_id": entry["doc_id"]}, entry, upsert=True
+            )
+            self._counters["indexed"] += 1
+        except Exception as e:
+            # The write itself succeeded; a missing entry only hides it from search
+            logger.warning(f"Search indexing failed for {scope} {document.get('id')}: {str(e)}")
+
+    async def reindex(self, scope: str, doc_id: str):
+        """Re-read a document after a partial update and refresh its entry"""
+        config = self._scope(scope)
+        projection = {"_id": 0, "id": 1, "tenant_id": 1, config["sort_field"]: 1}
+        for field in config["fields"] + config["attrs"]:
+            projection[field] = 1
+        document = await db[config["collection"]].find_one({"id": doc_id}, projection)
+        if document:
+            await self.index_document(scope, document)
+
+    async def remove(self, scope: str, doc_ids: List[str]):
+        if doc_ids:
+            result = await db.search_index.delete_many({"scope": scope, "doc_id": {"$in": doc_ids}})
+            self._counters["removed"] += result.deleted_count
+
+    async def remove_where(self, scope: str, attrs: Dict[str, Any]):
+        """Drop entries by a copied attribute (e.g. every message of a deleted channel)"""
+        result = await db.search_index.delete_many({"scope": scope, **attrs})
+        self._counters["removed"] += result.deleted_count
+
+    @staticmethod
+    def query_tokens(query: str) -> List[str]:
+        return _unique(tokenize(query))[:MAX_QUERY_TOKENS]
+
+    @staticmethod
+    def _score(entry: Dict[str, Any], tokens: List[str]) -> float:
+        terms = entry.get("terms", [])
+        boost_terms = entry.get("boost_terms", [])
+        score = 0.0
+        for token in tokens:
+            if token in boost_terms:
+                score += EXACT_BOOST_SCORE
+            elif any(t.startswith(token) for t in boost_terms):
+                score += PREFIX_BOOST_SCORE
+            elif token in terms:
+                score += EXACT_SCORE
+            else:
+                score += PREFIX_SCORE
+        return score
+
+    async def match_ids(
+        self,
+        tenant_id: str,
+        scope: str,
+        query: str,
+        filters: Optional[Dict[str, Any]] = None,
+        limit: int = MAX_CANDIDATES
+    ) -> List[str]:
+        """Ids of the scope's documents matching every query token, best first"""
+        self._scope(scope)
+        tokens = self.query_tokens(query)
+        if not tokens:
+            return []
+        self._counters["queries"] += 1
+
+        criteria = {
+            "tenant_id": tenant_id,
+            "scope": scope,
+            "terms": {"$all": [re.compile("^" + re.escape(token)) for token in tokens]},
+        }
+        if filters:
+            criteria.update(filters)
+
+        entries = await db.search_index.find(
+            criteria,
+            {"_id": 0, "doc_id": 1, "terms": 1, "boost_terms": 1, "sort_at": 1}
+        ).limit(MAX_CANDIDATES).to_list(MAX_CANDIDATES)
+
+        # Best score first, newest first within a score
+        entries.sort(key=lambda e: e.get("sort_at") or "", reverse=True)
+        entries.sort(key=lambda e: self._score(e, tokens), reverse=True)
+        return [e["doc_id"] for e in entries[:limit]]
+
+    async def search(
+        self,
+        tenant_id: str,
+        scopes: List[str],
+        query: str,
+        limit: int = 20,
+        filters: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Ranked documents per scope
+
+        ``filters`` maps a scope to conditions on its copied attributes,
+        e.g. ``{"messages": {"channel_id": "..."}}``.
+        """
+        results = {}
+        for scope in scopes:
+            config = self._scope(scope)
+            doc_ids = await self.match_ids(tenant_id, scope, query, (filters or {}).get(scope), limit)
+            if not doc_ids:
+                results[scope] = []
+                continue
+            documents = await db[config["collection"]].find(
+                {"id": {"$in": doc_ids}, "tenant_id": tenant_id},
+                {"_id": 0}
+            ).to_list(len(doc_ids))
+            # Entries of deleted documents simply don't come back
+            by_id = {d["id"]: d for d in documents}
+            results[scope] = [by_id[doc_id] for doc_id in doc_ids if doc_id in by_id]
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"scopes": list(SCOPES), **self._counters}
+
+
+# Global search service instance
+search_service = SearchService()
@@ -0,0 +1,292 @@
+"""
+Sentiment Pipeline - Batched background scoring of conversation sentiment
+
+Conversations whose last_message_at moved past their sentiment_watermark are
+collected periodically, packed many-per-call into a single LLM request with JSON
+output, and their engagement/tone scores written back together with the new
+watermark - so each conversation is scored once per change and the request path
+never calls the LLM for sentiment.
+
+Each tenant's pipeline spend is capped by a daily token budget
+(SENTIMENT_TENANT_DAILY_TOKENS), tracked in the sentiment_usage collection.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from pymongo import UpdateOne
+
+from middleware.database import db
+from services.llm_governor import estimate_tokens
+from services.pipeline_lease import PipelineLease
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PIPELINE_INTERVAL_SECONDS = int(os.environ.get("SENTIMENT_PIPELINE_INTERVAL_SECONDS", "300"))
+TENANT_DAILY_TOKENS = int(os.environ.get("SENTIMENT_TENANT_DAILY_TOKENS", "100000"))
+BATCH_SIZE = 15                   # Conversations packed into one LLM call
+MAX_CONVERSATIONS_PER_RUN = 500
+MESSAGES_PER_CONVERSATION = 15
+CHARS_PER_CONVERSATION = 1500     # Transcript budget per conversation inside a batch
+LOOKBACK_DAYS = 7                 # Only conversations active this recently are rescored
+LEASE_SECONDS = PIPELINE_INTERVAL_SECONDS  # One worker runs the pipeline at a time
+
+SYSTEM_PROMPT = """You are an expert conversation analyst. You will receive several customer support conversations, each labelled with an id. For each one, score the CUSTOMER's messages and behavior:
+
+1. ENGAGEMENT (1-10): How engaged is the customer in this conversation?
+   - 1-3: Disengaged (short responses, seems distracted, delayed responses)
+   - 4-6: Moderately engaged (normal conversation flow)
+   - 7-10: Highly engaged (detailed responses, asking questions, showing interest)
+
+2. TONE (-100 to 100): What is the emotional tone of the customer?
+   - -100 to -50: Very negative (angry, frustrated, threatening)
+   - -50 to -20: Negative (disappointed, annoyed, unhappy)
+   - -20 to 20: Neutral
+   - 20 to 50: Positive (satisfied, pleased)
+   - 50 to 100: Very positive (happy, grateful, enthusiastic)
+
+Respond ONLY with a JSON object in this exact format, one entry per conversation id:
+{"results": [{"id": "<id>", "engagement": <number 1-10>, "tone": <number -100 to 100>}]}"""
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _format_transcript(messages: List[Dict[str, Any]]) -> str:
+    """Newest messages that fit the per-conversation budget, oldest first"""
+    lines = []
+    used = 0
+    for msg in messages:  # newest first
+        role = "Customer" if msg.get("author_type") == "customer" else "Agent"
+        line = f"{role}: {(msg.get('content') or '')[:400]}"
+        if lines and used + len(line) > CHARS_PER_CONVERSATION:
+            break
+        used += len(line)
+        lines.append(line)
+    lines.reverse()
+    return "\n".join(lines)
+
+
+def _parse_results(text: str) -> Dict[str, Dict[str, int]]:
+    """Parse {"results": [...]} into {id: {"engagement", "tone"}} with clamped values"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+    data = json.loads(text)
+    entries = data.get("results", []) if isinstance(data, dict) else data
+
+    scores = {}
+    for entry in entries:
+        try:
+            scores[str(entry["id"])] = {
+                "engagement": max(1, min(10, int(entry.get("engagement", 5)))),
+                "tone": max(-100, min(100, int(entry.get("tone", 0))))
+            }
+        except (KeyError, TypeError, ValueError):
+            continue
+    return scores
+
+
+class SentimentPipeline:
+    """Periodically scores changed conversations in packed LLM batches"""
+
+    def __init__(self):
+        self._scheduler: Optional[AsyncIOScheduler] = None
+        self.last_run: Dict[str, Any] = {}
+        self._lease = PipelineLease("sentiment_pipeline", LEASE_SECONDS)
+
+    def start(self):
+        """Start the periodic pipeline job"""
+        if self._scheduler is None:
+            self._scheduler = AsyncIOScheduler(
+                job_defaults={"coalesce": True, "max_instances": 1},
+                timezone="UTC"
+            )
+            self._scheduler.add_job(
+                self.run_once,
+                IntervalTrigger(seconds=PIPELINE_INTERVAL_SECONDS),
+                id="sentiment_pipeline"
+            )
+            self._scheduler.start()
+            logger.info(f"Sentiment pipeline started (every {PIPELINE_INTERVAL_SECONDS}s)")
+
+    def shutdown(self):
+        if self._scheduler:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Score every conversation changed since its last score (within budget)"""
+        if not await self._lease.acquire():
+            return {"skipped": "lease held by another worker"}
+
+        stats = {"scored": 0, "batches": 0, "tokens": 0, "budget_exhausted": [], "failed_tenants": {}}
+        try:
+            lookback = (datetime.now(timezone.utc) - timedelta(days=LOOKBACK_DAYS)).isoformat()
+            dirty = await db.conversations.find(
+                {
+                    "last_message_at": {"$gte": lookback},
+                    "$expr": {"$gt": ["$last_message_at", {"$ifNull": ["$sentiment_watermark", ""]}]}
+                },
+                {"_id": 0, "id": 1, "tenant_id": 1, "last_message_at": 1, "sentiment_requested_at": 1}
+            ).to_list(MAX_CONVERSATIONS_PER_RUN)
+
+            by_tenant: Dict[str, List[Dict[str, Any]]] = {}
+            for conv in dirty:
+                if conv.get("tenant_id"):
+                    by_tenant.setdefault(conv["tenant_id"], []).append(conv)
+
+            for tenant_id, conversations in by_tenant.items():
+                # Explicitly requested conversations go first
+                conversations.sort(key=lambda c: c.get("sentiment_requested_at") or "", reverse=True)
+                try:
+                    await self._process_tenant(tenant_id, conversations, stats)
+                except Exception as e:
+                    # One tenant's provider outage or bad agent config must not starve the rest
+                    logger.error(f"Sentiment pipeline failed for tenant {tenant_id}: {str(e)}")
+                    stats["failed_tenants"][tenant_id] = str(e)[:200]
+        except Exception as e:
+            logger.error(f"Sentiment pipeline run failed: {str(e)}")
+            stats["error"] = str(e)
+        finally:
+            await self._lease.release()
+
+        stats["finished_at"] = datetime.now(timezone.utc).isoformat()
+        self.last_run = stats
+        if stats["scored"]:
+            logger.info(f"Sentiment pipeline scored {stats['scored']} conversations in {stats['batches']} batches")
+        return stats
+
+    async def _get_tenant_agent(self, tenant_id: str) -> Optional[Dict[str, Any]]:
+        agent_config = await db.company_agent_configs.find_one({"company_id": tenant_id}, {"_id": 0, "agent_id": 1})
+        if not agent_config or not agent_config.get("agent_id"):
+            return None
+        agent = await db.agents.find_one({"id": agent_config["agent_id"], "is_active": True}, {"_id": 0})
+        if not agent:
+            agent = await db.user_agents.find_one({"id": agent_config["agent_id"], "is_active": True}, {"_id": 0})
+        return agent
+
+    async def _tokens_used_today(self, tenant_id: str) -> int:
+        usage = await db.sentiment_usage.find_one({"tenant_id": tenant_id, "date": _today()}, {"_id": 0, "tokens": 1})
+        return (usage or {}).get("tokens", 0)
+
+    async def _process_tenant(self, tenant_id: str, conversations: List[Dict[str, Any]], stats: Dict[str, Any]):
+        agent = await self._get_tenant_agent(tenant_id)
+        if not agent:
+            return
+
+        used = await self._tokens_used_today(tenant_id)
+        for i in range(0, len(conversations), BATCH_SIZE):
+            batch = conversations[i:i + BATCH_SIZE]
+            spent = await self._score_batch(tenant_id, agent, batch, TENANT_DAILY_TOKENS - used, stats)
+            if spent is None:
+                stats["budget_exhausted"].append(tenant_id)
+                return
+            used += spent
+
+    async def _score_batch(
+        self,
+        tenant_id: str,
+        agent: Dict[str, Any],
+        batch: List[Dict[str, Any]],
+        remaining_budget: int,
+        stats: Dict[str, Any]
+    ) -> Optional[int]:
+        """Score one packed batch. Returns tokens spent, or None if over budget."""
+        ids = [c["id"] for c in batch]
+        grouped = await db.messages.aggregate([
+            {"$match": {"conversation_id": {"$in": ids}}},
+            {"$sort": {"created_at": -1}},
+            {"$group": {
+                "_id": "$conversation_id",
+                "messages": {"$push": {"author_type": "$author_type", "content": "$content"}}
+            }},
+            {"$project": {"messages": {"$slice": ["$messages", MESSAGES_PER_CONVERSATION]}}}
+        ]).to_list(len(ids))
+        messages_by_conv = {g["_id"]: g["messages"] for g in grouped}
+
+        now = datetime.now(timezone.utc).isoformat()
+        writes = []
+        sections = []
+        labels = {}
+        for index, conv in enumerate(batch, start=1):
+            messages = messages_by_conv.get(conv["id"], [])
+            if not any(m.get("author_type") == "customer" for m in messages):
+                # Nothing to score - just advance the watermark
+                writes.append(UpdateOne(
+                    {"id": conv["id"]},
+                    {"$set": {"sentiment_watermark": conv["last_message_at"]}, "$unset": {"sentiment_requested_at": ""}}
+                ))
+                continue
+            label = f"c{index}"
+            labels[label] = conv
+            sections.append(f"### Conversation {label}\n{_format_transcript(messages)}")
+
+        if sections:
+            prompt = "\n\n".join(sections)
+            max_tokens = 40 * len(sections) + 50
+            estimated = estimate_tokens([{"role": "user", "content": prompt}], SYSTEM_PROMPT, max_tokens)
+            if estimated > remaining_budget:
+                return None
+
+            from services.llm_router import provider_router
+            result = await provider_router.complete(
+                agent=agent,
+                system_prompt=SYSTEM_PROMPT,
+                messages=[{"role": "user", "content": prompt}],
+                tenant_id=tenant_id,
+                temperature=0.3,
+                max_tokens=max_tokens,
+                json_mode=True,
+                feature="sentiment"
+            )
+            spent = (result.get("usage") or {}).get("total_tokens") or estimated
+            await db.sentiment_usage.update_one(
+                {"tenant_id": tenant_id, "date": _today()},
+                {"$inc": {"tokens": spent, "calls": 1, "conversations": len(sections)}},
+                upsert=True
+            )
+            stats["batches"] += 1
+            stats["tokens"] += spent
+
+            try:
+                scores = _parse_results(result["text"])
+            except (json.JSONDecodeError, AttributeError) as e:
+                logger.warning(f"Unparseable sentiment batch for tenant {tenant_id}: {str(e)}")
+                scores = {}
+
+            for label, conv in labels.items():
+                score = scores.get(label)
+                if not score:
+                    continue  # Retried on the next run
+                writes.append(UpdateOne(
+                    {"id": conv["id"]},
+                    {
+                        "$set": {
+                            "engagement_score": score["engagement"],
+                            "tone_score": score["tone"],
+                            "sentiment_analyzed_at": now,
+                            "sentiment_watermark": conv["last_message_at"]
+                        },
+                        "$unset": {"sentiment_requested_at": ""}
+                    }
+                ))
+                stats["scored"] += 1
+        else:
+            spent = 0
+
+        if writes:
+            await db.conversations.bulk_write(writes, ordered=False)
+        return spent
+
+
+# Global sentiment pipeline instance
+sentiment_pipeline = SentimentPipeline()
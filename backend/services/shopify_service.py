@@ -1,13 +1,29 @@
 """
 Shopify REST API Service
 Handles all Shopify operations for agents
+
+Each store gets one shared keep-alive httpx client (HTTP/2 when the h2 package
+is installed). Requests pass through a client-side leaky bucket mirroring
+Shopify's own: the X-Shopify-Shop-Api-Call-Limit header (REST) and the GraphQL
+throttleStatus keep it in sync, so we slow down before Shopify starts answering
+429. Multi-order lookups use a single GraphQL nodes() query, and customer/order
+searches by email are cached briefly.
 """
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+from collections import OrderedDict
+import asyncio
 import httpx
 import logging
+import time
 from cryptography.fernet import Fernet
 import os
 
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 # Encryption key for storing sensitive credentials
@@ -27,6 +43,91 @@ def decrypt_credential(encrypted_value: str) -> str:
     return cipher_suite.decrypt(encrypted_value.encode()).decode()
 
 
+# Client configuration
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+CONNECTION_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+REST_BUCKET_SIZE = 40            # Standard plan; resized from the call-limit header
+REST_LEAK_PER_BUCKET_SLOT = 0.05 # Leak rate = bucket size / 20 per second (40 -> 2/s, 400 -> 20/s)
+BUCKET_HEADROOM = 2              # Slots kept free for other workers sharing the store
+MAX_RATE_LIMIT_RETRIES = 2
+LOOKUP_CACHE_TTL_SECONDS = int(os.environ.get("SHOPIFY_CACHE_TTL_SECONDS", "30"))
+LOOKUP_CACHE_SIZE = 256          # Cached email lookups per store
+MAX_POOLED_STORES = 128          # Store clients kept open per process
+
+ORDER_NODE_FIELDS = """
+      ... on Order {
+        legacyResourceId
+        name
+        email
+        phone
+        createdAt
+        updatedAt
+        displayFinancialStatus
+        displayFulfillmentStatus
+        currencyCode
+        totalPriceSet { shopMoney { amount } }
+        subtotalPriceSet { shopMoney { amount } }
+        totalTaxSet { shopMoney { amount } }
+        totalDiscountsSet { shopMoney { amount } }
+        customer { legacyResourceId firstName lastName phone }
+        billingAddress { name address1 address2 city province zip country phone }
+        shippingAddress { name address1 address2 city province zip country phone }
+        lineItems(first: 50) { nodes { name quantity sku originalUnitPriceSet { shopMoney { amount } } } }
+        fulfillments(first: 10) { status trackingInfo { number url } }
+        note
+        tags
+        cancelReason
+        cancelledAt
+      }
+"""
+
+
+class LeakyBucket:
+    """
+    Client-side model of a Shopify rate-limit bucket.
+
+    `level` drains at `leak_rate` per second; each request adds its cost before
+    being sent, and waits while that would overflow the bucket. Shopify's reported
+    usage replaces our estimate whenever a response arrives.
+    """
+    
+    def __init__(self, capacity: float, leak_rate: float):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _drain(self):
+        now = time.monotonic()
+        self.level = max(0.0, self.level - (now - self._updated) * self.leak_rate)
+        self._updated = now
+    
+    async def acquire(self, cost: float = 1.0):
+        async with self._lock:
+            while True:
+                self._drain()
+                limit = max(cost, self.capacity - BUCKET_HEADROOM)
+                if self.level + cost <= limit:
+                    self.level += cost
+                    return
+                await asyncio.sleep((self.level + cost - limit) / self.leak_rate)
+    
+    def sync(self, used: float, capacity: Optional[float] = None, leak_rate: Optional[float] = None):
+        """Adopt the usage Shopify reported"""
+        if capacity:
+            self.capacity = capacity
+        if leak_rate:
+            self.leak_rate = leak_rate
+        self._drain()
+        self.level = max(0.0, used)
+    
+    def fill(self):
+        """Mark the bucket as full (after a 429)"""
+        self._updated = time.monotonic()
+        self.level = self.capacity
+
+
 class ShopifyService:
     """Service class for Shopify API interactions"""
     
@@ -52,6 +153,31 @@ class ShopifyService:
             "X-Shopify-Access-Token": access_token,
             "Content-Type": "application/json"
         }
+        
+        # One keep-alive client per store, reused for every call
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=REQUEST_TIMEOUT,
+            limits=CONNECTION_LIMITS,
+            http2=HTTP2_AVAILABLE
+        )
+        self.rest_bucket = LeakyBucket(REST_BUCKET_SIZE, REST_BUCKET_SIZE * REST_LEAK_PER_BUCKET_SLOT)
+        # GraphQL is cost-based (1000 points, 50/s restore on standard plans)
+        self.graphql_bucket = LeakyBucket(1000, 50)
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+    
+    async def aclose(self):
+        await self.client.aclose()
+    
+    def _sync_rest_bucket(self, response: httpx.Response):
+        call_limit = response.headers.get("X-Shopify-Shop-Api-Call-Limit")
+        if not call_limit:
+            return
+        try:
+            used, capacity = (float(part) for part in call_limit.split("/"))
+        except ValueError:
+            return
+        self.rest_bucket.sync(used, capacity, capacity * REST_LEAK_PER_BUCKET_SLOT)
     
     async def _make_request(
         self, 
@@ -63,23 +189,75 @@ class ShopifyService:
         """Make HTTP request to Shopify API"""
         url = f"{self.base_url}/{endpoint}"
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.request(
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await self.rest_bucket.acquire()
+            response = await self.client.request(
                 method=method,
                 url=url,
-                headers=self.headers,
                 params=params,
                 json=json_data
             )
+            self._sync_rest_bucket(response)
             
             if response.status_code == 429:
-                # Rate limited
-                retry_after = response.headers.get("Retry-After", 5)
-                raise Exception(f"Rate limited. Retry after {retry_after} seconds")
+                # Rate limited - the bucket is full; wait as told and retry
+                self.rest_bucket.fill()
+                retry_after = float(response.headers.get("Retry-After", 2))
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise Exception(f"Rate limited. Retry after {retry_after} seconds")
+                logger.warning(f"Shopify rate limited for {self.store_domain}, retrying in {retry_after}s")
+                await asyncio.sleep(retry_after)
+                continue
             
             response.raise_for_status()
             return response.json()
     
+    async def _graphql(self, query: str, variables: Dict[str, Any], estimated_cost: float) -> Dict[str, Any]:
+        """Run a GraphQL Admin API query, throttled by its cost"""
+        await self.graphql_bucket.acquire(estimated_cost)
+        response = await self.client.post(
+            f"{self.base_url}/graphql.json",
+            json={"query": query, "variables": variables}
+        )
+        response.raise_for_status()
+        result = response.json()
+        
+        throttle = result.get("extensions", {}).get("cost", {}).get("throttleStatus")
+        if throttle:
+            capacity = float(throttle["maximumAvailable"])
+            self.graphql_bucket.sync(
+                capacity - float(throttle["currentlyAvailable"]),
+                capacity,
+                float(throttle["restoreRate"])
+            )
+        if result.get("errors"):
+            if any(e.get("extensions", {}).get("code") == "THROTTLED" for e in result["errors"]):
+                self.graphql_bucket.fill()
+            raise Exception(f"GraphQL error: {result['errors']}")
+        return result.get("data", {})
+    
+    # ---- Short-TTL lookup cache ----
+    
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[Any]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > LOOKUP_CACHE_TTL_SECONDS:
+            del self._cache[key]
+            return None
+        return entry[1]
+    
+    def _cache_set(self, key: Tuple[str, str], value: Any):
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > LOOKUP_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    def invalidate_orders(self):
+        """Drop cached order searches (after an order was changed)"""
+        for key in [k for k in self._cache if k[0] == "orders_by_email"]:
+            del self._cache[key]
+    
     async def test_connection(self) -> Dict[str, Any]:
         """
         Test Shopify API connection
@@ -125,6 +303,11 @@ class ShopifyService:
         Returns:
             List of orders
         """
+        cache_key = ("orders_by_email", f"{email.strip().lower()}:{limit}")
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             result = await self._make_request(
                 "GET", 
@@ -137,7 +320,7 @@ class ShopifyService:
             )
             
             orders = result.get("orders", [])
-            return [{
+            summaries = [{
                 "id": order["id"],
                 "order_number": order.get("order_number") or order.get("name", "").replace("#", ""),
                 "name": order.get("name", f"#{order['id']}"),
@@ -168,6 +351,8 @@ class ShopifyService:
                     } for f in order.get("fulfillments", [])
                 ]
             } for order in orders]
+            self._cache_set(cache_key, summaries)
+            return summaries
         except Exception as e:
             logger.error(f"Error searching orders by email: {str(e)}")
             return []
@@ -227,6 +412,93 @@ class ShopifyService:
             logger.error(f"Error getting order details: {str(e)}")
             return None
     
+    async def get_orders_details(self, order_ids: Iterable[int]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Get details for several orders with a single GraphQL query
+        
+        Falls back to concurrent REST lookups if the GraphQL call fails.
+        
+        Returns:
+            {order_id: order details or None if not found}
+        """
+        order_ids = [int(order_id) for order_id in dict.fromkeys(order_ids)]
+        if not order_ids:
+            return {}
+        
+        query = "query($ids: [ID!]!) {\n  nodes(ids: $ids) {" + ORDER_NODE_FIELDS + "  }\n}"
+        try:
+            data = await self._graphql(
+                query,
+                {"ids": [f"gid://shopify/Order/{order_id}" for order_id in order_ids]},
+                estimated_cost=len(order_ids) * 12
+            )
+            orders = {}
+            for node in data.get("nodes", []):
+                if node:
+                    order = self._format_graphql_order(node)
+                    orders[order["id"]] = order
+            return {order_id: orders.get(order_id) for order_id in order_ids}
+        except Exception as e:
+            logger.warning(f"GraphQL order lookup failed, falling back to REST: {str(e)}")
+            results = await asyncio.gather(
+                *(self.get_order_details(order_id) for order_id in order_ids),
+                return_exceptions=True
+            )
+            return {
+                order_id: (None if isinstance(result, Exception) else result)
+                for order_id, result in zip(order_ids, results)
+            }
+    
+    @staticmethod
+    def _format_graphql_order(node: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape a GraphQL Order node like get_order_details' REST result"""
+        def money(field: str) -> Optional[str]:
+            return ((node.get(field) or {}).get("shopMoney") or {}).get("amount")
+        
+        customer = node.get("customer") or {}
+        fulfillment_status = (node.get("displayFulfillmentStatus") or "").lower()
+        return {
+            "id": int(node["legacyResourceId"]),
+            "order_number": (node.get("name") or "").replace("#", ""),
+            "name": node.get("name"),
+            "status": fulfillment_status or "unfulfilled",
+            "financial_status": (node.get("displayFinancialStatus") or "pending").lower(),
+            "date_created": node.get("createdAt"),
+            "date_updated": node.get("updatedAt"),
+            "total": money("totalPriceSet"),
+            "subtotal": money("subtotalPriceSet"),
+            "total_tax": money("totalTaxSet"),
+            "total_discounts": money("totalDiscountsSet"),
+            "currency": node.get("currencyCode"),
+            "customer": {
+                "id": int(customer["legacyResourceId"]) if customer.get("legacyResourceId") else None,
+                "email": node.get("email"),
+                "name": f"{customer.get('firstName') or ''} {customer.get('lastName') or ''}".strip(),
+                "phone": customer.get("phone")
+            },
+            "billing_address": node.get("billingAddress"),
+            "shipping_address": node.get("shippingAddress"),
+            "line_items": [
+                {
+                    "name": item.get("name"),
+                    "quantity": item.get("quantity"),
+                    "price": ((item.get("originalUnitPriceSet") or {}).get("shopMoney") or {}).get("amount"),
+                    "sku": item.get("sku")
+                } for item in (node.get("lineItems") or {}).get("nodes", [])
+            ],
+            "fulfillments": [
+                {
+                    "status": (f.get("status") or "").lower(),
+                    "tracking_number": (f.get("trackingInfo") or [{}])[0].get("number") if f.get("trackingInfo") else None,
+                    "tracking_url": (f.get("trackingInfo") or [{}])[0].get("url") if f.get("trackingInfo") else None
+                } for f in node.get("fulfillments") or []
+            ],
+            "note": node.get("note"),
+            "tags": node.get("tags") or [],
+            "cancel_reason": (node.get("cancelReason") or "").lower() or None,
+            "cancelled_at": node.get("cancelledAt")
+        }
+    
     async def create_refund(
         self, 
         order_id: int, 
@@ -283,6 +555,7 @@ class ShopifyService:
                 json_data=refund_data
             )
             
+            self.invalidate_orders()
             refund = result.get("refund", {})
             total_refunded = sum(float(t.get("amount", 0)) for t in refund.get("transactions", []))
             
@@ -343,6 +616,7 @@ class ShopifyService:
                 }
             )
             
+            self.invalidate_orders()
             return {
                 "success": True,
                 "message": "Order cancelled successfully",
@@ -389,6 +663,7 @@ class ShopifyService:
                 }
             )
             
+            self.invalidate_orders()
             return {
                 "success": True,
                 "message": "Order note updated successfully"
@@ -410,6 +685,11 @@ class ShopifyService:
         Returns:
             Customer details or None
         """
+        cache_key = ("customer_by_email", email.strip().lower())
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached or None  # {} caches "no such customer"
+        
         try:
             result = await self._make_request(
                 "GET",
@@ -419,10 +699,11 @@ class ShopifyService:
             
             customers = result.get("customers", [])
             if not customers:
+                self._cache_set(cache_key, {})
                 return None
             
             customer = customers[0]
-            return {
+            details = {
                 "id": customer.get("id"),
                 "email": customer.get("email"),
                 "first_name": customer.get("first_name"),
@@ -434,14 +715,20 @@ class ShopifyService:
                 "tags": customer.get("tags", "").split(", ") if customer.get("tags") else [],
                 "addresses": customer.get("addresses", [])
             }
+            self._cache_set(cache_key, details)
+            return details
         except Exception as e:
             logger.error(f"Error getting customer: {str(e)}")
             return None
 
 
+# Pooled clients: (store_domain, encrypted access token) -> ShopifyService
+_clients: "OrderedDict[Tuple[str, str], ShopifyService]" = OrderedDict()
+
+
 def get_shopify_client(config: Dict[str, Any]) -> Optional[ShopifyService]:
     """
-    Create Shopify client from encrypted config
+    Get the shared Shopify client for an encrypted config
     
     Args:
         config: Agent config containing Shopify credentials
@@ -455,12 +742,30 @@ def get_shopify_client(config: Dict[str, Any]) -> Optional[ShopifyService]:
             return None
         
         store_domain = shopify_config.get("store_domain")
-        access_token = decrypt_credential(shopify_config.get("access_token_encrypted", ""))
+        key = (store_domain, shopify_config.get("access_token_encrypted", ""))
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        
+        access_token = decrypt_credential(key[1])
         
         if not all([store_domain, access_token]):
             return None
         
-        return ShopifyService(store_domain, access_token)
+        client = ShopifyService(store_domain, access_token)
+        _clients[key] = client
+        if len(_clients) > MAX_POOLED_STORES:
+            _, evicted = _clients.popitem(last=False)
+            asyncio.get_running_loop().create_task(evicted.aclose())
+        return client
     except Exception as e:
         logger.error(f"Error creating Shopify client: {str(e)}")
         return None
+
+
+async def close_shopify_clients():
+    """Close every pooled store client (application shutdown)"""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
@@ -0,0 +1,274 @@
+"""
+Suggestion Engine - Speculative reply suggestions for human-handled conversations
+
+When a customer message lands in a conversation handled by a human (``agent`` or
+``assisted`` mode), suggestions are generated in the background and cached in
+the reply_suggestions collection, keyed by the conversation's last message id.
+The suggestions endpoint then answers from the cache instead of running RAG plus
+an LLM call while the agent waits, and the assigned agent's dashboard gets a
+``suggestions_ready`` WebSocket event once fresh suggestions exist.
+
+A new message in the conversation evicts the cached entry (and cancels a
+precomputation still running for an older message).
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from middleware.database import db
+from services.llm_usage import llm_usage
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_MODES = ("agent", "assisted")
+CACHE_TTL_HOURS = 24  # Abandoned entries are removed by a TTL index
+FALLBACK_SUGGESTIONS = ["I'll look into this for you.", "Let me check that.", "Thank you for your patience."]
+ERROR_SUGGESTIONS = ["I'll help you with that.", "Let me look into this.", "Thank you for your patience."]
+
+
+async def generate_suggestions(
+    agent: dict,
+    customer_message: str,
+    conversation_history: str,
+    rag_context: str,
+    custom_instructions: str,
+    tenant_id: Optional[str] = None
+) -> list:
+    """Generate 3 AI response suggestions"""
+
+    system_prompt = f"""You are an AI assistant helping a human support agent respond to customers.
+Based on the conversation context, generate exactly 3 different response suggestions.
+Each suggestion should be:
+- Professional and helpful
+- Concise (1-2 sentences max)
+- Different in tone/approach from the others
+
+{f'Knowledge base context: {rag_context}' if rag_context else ''}
+{f'Custom instructions: {custom_instructions}' if custom_instructions else ''}
+
+Respond with exactly 3 suggestions, one per line, numbered 1-3. Do not include any other text."""
+
+    user_prompt = f"""Recent conversation:
+{conversation_history}
+
+Generate 3 response suggestions for the agent to reply to the customer's last message: "{customer_message}"
+"""
+
+    provider = agent.get("provider", "openai").lower()
+    model = agent.get("model", "gpt-4o-mini")
+
+    try:
+        if provider == "openai":
+            from emergentintegrations.llm.openai import chat
+        elif provider == "anthropic":
+            from emergentintegrations.llm.anthropic import chat
+        elif provider == "google":
+            from emergentintegrations.llm.google import chat
+        else:
+            return list(ERROR_SUGGESTIONS)
+
+        async with llm_usage.track(tenant_id, agent.get("id"), provider, model, "suggestions") as call:
+            response = await chat(
+                api_key=os.environ.get("EMERGENT_LLM_KEY"),
+                model=model,
+                system_prompt=system_prompt,
+                user_message=user_prompt,
+                temperature=0.7
+            )
+            call.estimate_usage(system_prompt + user_prompt, response)
+
+        # Parse response into 3 suggestions
+        lines = response.strip().split('\n')
+        suggestions = []
+        for line in lines:
+            # Remove numbering like "1.", "1)", "1:" etc.
+            cleaned = line.strip()
+            if cleaned:
+                # Remove common prefixes
+                for prefix in ['1.', '2.', '3.', '1)', '2)', '3)', '1:', '2:', '3:']:
+                    if cleaned.startswith(prefix):
+                        cleaned = cleaned[len(prefix):].strip()
+                        break
+                if cleaned:
+                    suggestions.append(cleaned)
+
+        # Ensure we have exactly 3 suggestions
+        while len(suggestions) < 3:
+            suggestions.append("Let me help you with that.")
+
+        return suggestions[:3]
+
+    except Exception as e:
+        logger.error(f"Error in generate_suggestions: {str(e)}")
+        return list(ERROR_SUGGESTIONS)
+
+
+class SuggestionEngine:
+    """Precomputes and caches reply suggestions per conversation"""
+
+    def __init__(self):
+        # conversation_id -> (message_id, precompute task)
+        self._inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+    async def build(self, tenant_id: str, conversation_id: str) -> Dict[str, Any]:
+        """
+        Generate suggestions for the conversation's latest customer message.
+
+        Returns:
+            {"message_id": last message id the suggestions answer to (None if no messages),
+             "suggestions": [...], "cacheable": whether an LLM produced them}
+        """
+        # Get recent messages for context
+        messages = await db.messages.find(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "id": 1, "author_type": 1, "content": 1}
+        ).sort("created_at", -1).limit(10).to_list(10)
+        messages.reverse()  # Chronological order
+
+        if not messages:
+            return {"message_id": None, "suggestions": [], "cacheable": False}
+        message_id = messages[-1].get("id")
+
+        # Get the last customer message
+        last_customer_msg = None
+        for msg in reversed(messages):
+            if msg.get("author_type") == "customer":
+                last_customer_msg = msg
+                break
+
+        if not last_customer_msg:
+            return {"message_id": message_id, "suggestions": [], "cacheable": False}
+
+        # Get agent config for this tenant
+        agent_config = await db.company_agent_configs.find_one({"company_id": tenant_id}, {"_id": 0})
+        if not agent_config or not agent_config.get("agent_id"):
+            return {"message_id": message_id, "suggestions": list(FALLBACK_SUGGESTIONS), "cacheable": False}
+
+        # Get the agent (admin agents first, then the company's own)
+        agent = await db.agents.find_one({"id": agent_config["agent_id"], "is_active": True}, {"_id": 0})
+        if not agent:
+            agent = await db.user_agents.find_one({"id": agent_config["agent_id"], "is_active": True}, {"_id": 0})
+        if not agent:
+            return {"message_id": message_id, "suggestions": list(FALLBACK_SUGGESTIONS), "cacheable": False}
+
+        # Get RAG context if available
+        rag_context = ""
+        try:
+            from rag_service import get_rag_context
+            rag_context = await get_rag_context(tenant_id, last_customer_msg["content"])
+        except Exception as e:
+            logger.debug(f"RAG context error: {str(e)}")
+
+        # Build conversation history for context
+        conversation_history = ""
+        for msg in messages[-6:]:  # Last 6 messages for context
+            role = "Customer" if msg.get("author_type") == "customer" else "Agent"
+            conversation_history += f"{role}: {msg.get('content', '')}\n"
+
+        suggestions = await generate_suggestions(
+            agent=agent,
+            customer_message=last_customer_msg["content"],
+            conversation_history=conversation_history,
+            rag_context=rag_context,
+            custom_instructions=agent_config.get("custom_instructions", ""),
+            tenant_id=tenant_id
+        )
+        return {"message_id": message_id, "suggestions": suggestions, "cacheable": suggestions != ERROR_SUGGESTIONS}
+
+    async def get_cached(self, conversation_id: str, message_id: str) -> Optional[List[str]]:
+        """Cached suggestions for the conversation, if computed for this last message"""
+        entry = await db.reply_suggestions.find_one(
+            {"conversation_id": conversation_id, "message_id": message_id},
+            {"_id": 0, "suggestions": 1}
+        )
+        return entry["suggestions"] if entry else None
+
+    async def wait_for_inflight(self, conversation_id: str, message_id: str) -> Optional[List[str]]:
+        """Wait for a precomputation already running for this message (on this worker)"""
+        inflight = self._inflight.get(conversation_id)
+        if not inflight or inflight[0] != message_id:
+            return None
+        try:
+            await asyncio.shield(inflight[1])
+        except Exception:
+            return None
+        return await self.get_cached(conversation_id, message_id)
+
+    async def store(self, tenant_id: str, conversation_id: str, message_id: str, suggestions: List[str]):
+        now = datetime.now(timezone.utc)
+        await db.reply_suggestions.update_one(
+            {"conversation_id": conversation_id},
+            {"$set": {
+                "tenant_id": tenant_id,
+                "message_id": message_id,
+                "suggestions": suggestions,
+                "created_at": now.isoformat(),
+                "expires_at": now + timedelta(hours=CACHE_TTL_HOURS)
+            }},
+            upsert=True
+        )
+
+    async def evict(self, conversation_id: str, keep_message_id: Optional[str] = None):
+        """Drop cached suggestions (and precomputations) not made for keep_message_id"""
+        inflight = self._inflight.get(conversation_id)
+        if inflight and inflight[0] != keep_message_id:
+            inflight[1].cancel()
+            self._inflight.pop(conversation_id, None)
+        await db.reply_suggestions.delete_one(
+            {"conversation_id": conversation_id, "message_id": {"$ne": keep_message_id}}
+        )
+
+    async def on_new_message(self, tenant_id: str, conversation: Dict[str, Any], message: Dict[str, Any]):
+        """
+        React to a new message: evict stale suggestions and, for customer messages in
+        human-handled conversations, start precomputing fresh ones.
+        """
+        conversation_id = conversation["id"]
+        try:
+            await self.evict(conversation_id, keep_message_id=message["id"])
+        except Exception as e:
+            logger.warning(f"Could not evict suggestions for {conversation_id}: {str(e)}")
+
+        if message.get("author_type") == "customer" and conversation.get("mode") in SUGGESTION_MODES:
+            task = asyncio.create_task(self._precompute(tenant_id, conversation, message["id"]))
+            self._inflight[conversation_id] = (message["id"], task)
+
+    async def _precompute(self, tenant_id: str, conversation: Dict[str, Any], message_id: str):
+        conversation_id = conversation["id"]
+        try:
+            result = await self.build(tenant_id, conversation_id)
+            if result["message_id"] != message_id or not result["cacheable"]:
+                return  # A newer message arrived meanwhile, or nothing worth caching
+            await self.store(tenant_id, conversation_id, message_id, result["suggestions"])
+            await self._notify(tenant_id, conversation, message_id, result["suggestions"])
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Suggestion precompute failed for {conversation_id}: {str(e)}")
+        finally:
+            inflight = self._inflight.get(conversation_id)
+            if inflight and inflight[0] == message_id:
+                self._inflight.pop(conversation_id, None)
+
+    async def _notify(self, tenant_id: str, conversation: Dict[str, Any], message_id: str, suggestions: List[str]):
+        """Tell the dashboard fresh suggestions are ready"""
+        from routes.messaging import manager
+
+        event = {
+            "type": "suggestions_ready",
+            "payload": {
+                "conversation_id": conversation["id"],
+                "message_id": message_id,
+                "suggestions": suggestions
+            }
+        }
+        if conversation.get("assigned_agent_id"):
+            await manager.send_to_users(tenant_id, [conversation["assigned_agent_id"]], event)
+        else:
+            await manager.broadcast_to_tenant(tenant_id, event)
+
+
+# Global suggestion engine instance
+suggestion_engine = SuggestionEngine()
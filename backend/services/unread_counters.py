@@ -0,0 +1,244 @@
+"""
+Unread Counters - Materialized per-user unread counts for messaging
+
+Each messaging_read_status document ({user_id, channel_id | dm_conversation_id,
+last_read_at}) also carries an ``unread_count``. Posting a message increments it
+for every recipient (channel members / DM participants other than the author)
+with one bulk write, reading a channel or DM resets it, and the unread endpoints
+read all of a user's counters with a single indexed query instead of counting
+messages per channel.
+
+Public channels are visible to the whole tenant, but only members get
+counters: fanning every public message out to every user would not scale. A
+user's public channels they haven't joined are counted from the messages on
+read instead, all of them in one aggregation (``count_unjoined``).
+
+Counters can drift (deleted messages, membership changes, a reset racing an
+increment), so a periodic reconciliation job recounts them from the messages,
+a slice of channels and DMs per run, oldest-reconciled first.
+"""
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from pymongo import UpdateOne
+
+from middleware.database import db
+from services.pipeline_lease import PipelineLease
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get("UNREAD_RECONCILE_INTERVAL_SECONDS", "900"))
+TARGETS_PER_RUN = 200  # Channels plus DMs recounted per reconciliation run
+LEASE_SECONDS = RECONCILE_INTERVAL_SECONDS  # One worker reconciles at a time
+
+
+def _target_field(message: Dict[str, Any]) -> Optional[str]:
+    if message.get("channel_id"):
+        return "channel_id"
+    if message.get("dm_conversation_id"):
+        return "dm_conversation_id"
+    return None
+
+
+def _human_recipients(participants: Iterable[str], author_id: Optional[str]) -> List[str]:
+    """Users who get an unread count: everyone but the author and agents"""
+    return [p for p in participants if p and p != author_id and not p.startswith("agent_")]
+
+
+class UnreadCounters:
+    """Per-user unread counters stored on messaging_read_status"""
+
+    def __init__(self):
+        self._scheduler: Optional[AsyncIOScheduler] = None
+        self.last_run: Dict[str, Any] = {}
+        self._lease = PipelineLease("unread_reconcile", LEASE_SECONDS)
+
+    def start(self):
+        """Start the periodic reconciliation job"""
+        if self._scheduler is None:
+            self._scheduler = AsyncIOScheduler(
+                job_defaults={"coalesce": True, "max_instances": 1},
+                timezone="UTC"
+            )
+            self._scheduler.add_job(
+                self.reconcile_once,
+                IntervalTrigger(seconds=RECONCILE_INTERVAL_SECONDS),
+                id="unread_reconcile"
+            )
+            self._scheduler.start()
+            logger.info(f"Unread counter reconciliation started (every {RECONCILE_INTERVAL_SECONDS}s)")
+
+    def shutdown(self):
+        if self._scheduler:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
+
+    async def record_message(self, message: Dict[str, Any], participants: Iterable[str]):
+        """Increment the unread count of every recipient of a new message"""
+        field = _target_field(message)
+        recipients = _human_recipients(participants, message.get("author_id"))
+        if not field or not recipients:
+            return
+
+        writes = [
+            UpdateOne(
+                {"user_id": user_id, field: message[field]},
+                {
+                    "$inc": {"unread_count": 1},
+                    "$setOnInsert": {"tenant_id": message.get("tenant_id")}
+                },
+                upsert=True
+            )
+            for user_id in recipients
+        ]
+        try:
+            await db.messaging_read_status.bulk_write(writes, ordered=False)
+        except Exception as e:
+            # Reconciliation repairs whatever was missed
+            logger.warning(f"Failed to increment unread counters for {field}={message[field]}: {str(e)}")
+
+    async def mark_read(self, user_id: str, channel_id: Optional[str] = None, dm_conversation_id: Optional[str] = None):
+        """Reset the user's counter and move their read marker to now"""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if channel_id:
+            query["channel_id"] = channel_id
+        elif dm_conversation_id:
+            query["dm_conversation_id"] = dm_conversation_id
+        else:
+            return
+        await db.messaging_read_status.update_one(
+            query,
+            {"$set": {"last_read_at": datetime.now(timezone.utc).isoformat(), "unread_count": 0}},
+            upsert=True
+        )
+
+    async def count_unjoined(self, tenant_id: str, user_id: str, channel_ids: List[str]) -> Dict[str, int]:
+        """Unread counts of public channels the user can see without being a member"""
+        if not channel_ids:
+            return {}
+        statuses = await db.messaging_read_status.find(
+            {"user_id": user_id, "channel_id": {"$in": channel_ids}},
+            {"_id": 0, "channel_id": 1, "last_read_at": 1}
+        ).to_list(len(channel_ids))
+        last_read = {s["channel_id"]: s.get("last_read_at") for s in statuses}
+
+        conditions = []
+        for channel_id in channel_ids:
+            condition: Dict[str, Any] = {"channel_id": channel_id}
+            if last_read.get(channel_id):
+                condition["created_at"] = {"$gt": last_read[channel_id]}
+            conditions.append(condition)
+        rows = await db.messaging_messages.aggregate([
+            {"$match": {"tenant_id": tenant_id, "author_id": {"$ne": user_id}, "$or": conditions}},
+            {"$group": {"_id": "$channel_id", "count": {"$sum": 1}}}
+        ]).to_list(len(channel_ids))
+        return {row["_id"]: row["count"] for row in rows}
+
+    async def get_counts(self, user_id: str) -> Dict[str, Dict[str, int]]:
+        """
+        All non-zero counters of a user in one query.
+
+        Returns:
+            {"channels": {channel_id: count}, "dms": {dm_conversation_id: count}}
+        """
+        rows = await db.messaging_read_status.find(
+            {"user_id": user_id, "unread_count": {"$gt": 0}},
+            {"_id": 0, "channel_id": 1, "dm_conversation_id": 1, "unread_count": 1}
+        ).to_list(5000)
+
+        counts: Dict[str, Dict[str, int]] = {"channels": {}, "dms": {}}
+        for row in rows:
+            if row.get("channel_id"):
+                counts["channels"][row["channel_id"]] = row["unread_count"]
+            elif row.get("dm_conversation_id"):
+                counts["dms"][row["dm_conversation_id"]] = row["unread_count"]
+        return counts
+
+    async def reconcile_once(self) -> Dict[str, Any]:
+        """Recount the counters of the channels and DMs reconciled longest ago"""
+        if not await self._lease.acquire():
+            return {"skipped": "lease held by another worker"}
+
+        stats = {"targets": 0, "counters": 0, "repaired": 0}
+        try:
+            per_kind = TARGETS_PER_RUN // 2
+            channels = await db.messaging_channels.find(
+                {}, {"_id": 0, "id": 1, "tenant_id": 1, "members": 1}
+            ).sort("unread_reconciled_at", 1).limit(per_kind).to_list(per_kind)
+            for channel in channels:
+                await self.reconcile_target(
+                    "channel_id", channel, channel.get("members", []), db.messaging_channels, stats
+                )
+
+            dms = await db.messaging_dm_conversations.find(
+                {}, {"_id": 0, "id": 1, "tenant_id": 1, "participants": 1}
+            ).sort("unread_reconciled_at", 1).limit(per_kind).to_list(per_kind)
+            for dm in dms:
+                await self.reconcile_target(
+                    "dm_conversation_id", dm, dm.get("participants", []), db.messaging_dm_conversations, stats
+                )
+        except Exception as e:
+            logger.error(f"Unread counter reconciliation failed: {str(e)}")
+            stats["error"] = str(e)
+        finally:
+            await self._lease.release()
+
+        stats["finished_at"] = datetime.now(timezone.utc).isoformat()
+        self.last_run = stats
+        if stats["repaired"]:
+            logger.info(f"Unread reconciliation repaired {stats['repaired']} of {stats['counters']} counters")
+        return stats
+
+    async def reconcile_target(
+        self,
+        field: str,
+        target: Dict[str, Any],
+        participants: List[str],
+        collection,
+        stats: Dict[str, Any]
+    ):
+        """Recount every counter of one channel or DM (``field``: channel_id / dm_conversation_id)"""
+        target_id = target["id"]
+        statuses = await db.messaging_read_status.find(
+            {field: target_id},
+            {"_id": 0, "user_id": 1, "last_read_at": 1, "unread_count": 1}
+        ).to_list(5000)
+        by_user = {s["user_id"]: s for s in statuses}
+
+        # Members plus anyone holding a stale counter (e.g. left the channel)
+        users = set(_human_recipients(participants, None))
+        users.update(uid for uid, s in by_user.items() if s.get("unread_count"))
+
+        writes = []
+        for user_id in users:
+            status = by_user.get(user_id, {})
+            query: Dict[str, Any] = {field: target_id, "author_id": {"$ne": user_id}}
+            if status.get("last_read_at"):
+                query["created_at"] = {"$gt": status["last_read_at"]}
+            count = await db.messaging_messages.count_documents(query) if user_id in participants else 0
+
+            stats["counters"] += 1
+            if status.get("unread_count") != count:
+                stats["repaired"] += 1
+                writes.append(UpdateOne(
+                    {"user_id": user_id, field: target_id},
+                    {"$set": {"unread_count": count}, "$setOnInsert": {"tenant_id": target.get("tenant_id")}},
+                    upsert=True
+                ))
+        if writes:
+            await db.messaging_read_status.bulk_write(writes, ordered=False)
+
+        await collection.update_one(
+            {"id": target_id},
+            {"$set": {"unread_reconciled_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        stats["targets"] += 1
+
+
+# Global unread counters instance
+unread_counters = UnreadCounters()
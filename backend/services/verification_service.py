@@ -11,6 +11,7 @@ from typing import Optional, Dict, Any, Tuple
 
 from middleware.database import db
 from services.email_service import EmailService
+from services.intent_matcher import intent_detector, IntentMatcher, DEFAULT_INTENT_PHRASES, SENSITIVE_TOPIC
 
 logger = logging.getLogger(__name__)
 
@@ -21,18 +22,7 @@ MAX_OTP_ATTEMPTS = 3
 OTP_COOLDOWN_SECONDS = 60  # Minimum time between OTP requests
 
 # Sensitive topics that require verification
-SENSITIVE_TOPICS = [
-    # Account-related
-    "account", "balance", "payment", "billing", "invoice", "subscription",
-    "password", "login", "credential", "security",
-    # Order-related  
-    "order", "purchase", "transaction", "refund", "shipping", "delivery",
-    "tracking", "cancel order", "cancel subscription", "cancel my",
-    # Personal data
-    "my address", "phone number", "email change", "personal info", "profile", "my data",
-    # Financial
-    "credit", "debit", "bank", "card number", "wallet", "money", "fund"
-]
+SENSITIVE_TOPICS = DEFAULT_INTENT_PHRASES[SENSITIVE_TOPIC]
 
 
 class VerificationService:
@@ -193,47 +183,19 @@ class VerificationService:
         }
     
     @staticmethod
-    def requires_verification(message: str) -> bool:
+    def requires_verification(message: str, matcher: Optional[IntentMatcher] = None) -> bool:
         """
         Check if a message is asking about sensitive topics that require verification
         
         Args:
             message: The customer's message
+            matcher: Tenant intent matcher (defaults to the built-in phrase sets)
             
         Returns:
             True if the message likely requires verification
         """
-        message_lower = message.lower()
-        
-        # Check for sensitive topics
-        for topic in SENSITIVE_TOPICS:
-            if topic in message_lower:
-                return True
-        
-        # Check for specific patterns
-        sensitive_patterns = [
-            "my order",
-            "my account", 
-            "my balance",
-            "my payment",
-            "my subscription",
-            "my address",
-            "my profile",
-            "where is my",
-            "status of my",
-            "cancel my",
-            "change my",
-            "update my",
-            "what did i",
-            "show me my",
-            "give me my"
-        ]
-        
-        for pattern in sensitive_patterns:
-            if pattern in message_lower:
-                return True
-        
-        return False
+        matcher = matcher or intent_detector.default
+        return matcher.has(message, SENSITIVE_TOPIC)
     
     @staticmethod
     async def _send_otp_email(email: str, otp_code: str, tenant_id: str) -> bool:
@@ -0,0 +1,149 @@
+"""
+Widget Events - Realtime push to customer chat widgets
+
+Widgets used to poll ``GET /widget/messages/{id}`` every few seconds, which
+reloaded the whole conversation each time. Now each open widget holds a
+WebSocket (authenticated with its session token) subscribed to its conversation
+and receives:
+
+- ``message``: a new message in the conversation (customer, AI, agent, system)
+- ``message_delta``: text of an AI reply still being generated
+  (``{"id", "delta"}``); the ``message`` event with the same id replaces it
+- ``mode_changed``: the conversation's mode and assigned human agent
+
+Events are published through the realtime bus so a widget connected to any
+worker receives them. On (re)connect the widget fetches what it missed with
+``GET /widget/messages/{id}?since=<message id or timestamp>``.
+"""
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from middleware.database import db
+from services.realtime_bus import realtime_bus
+from services.ws_connection import WebSocketConnection, serialize
+
+logger = logging.getLogger(__name__)
+
+STREAM_FLUSH_SECONDS = 0.1  # Deltas are batched so the bus isn't hit once per token
+
+# Message fields kept server-side (``llm``: which provider/model answered)
+INTERNAL_MESSAGE_FIELDS = ("_id", "llm")
+
+
+def public_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """A message as customers may see it"""
+    return {k: v for k, v in message.items() if k not in INTERNAL_MESSAGE_FIELDS}
+
+
+async def get_assigned_agent_info(conversation: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Public details of the human agent handling the conversation, if any"""
+    if conversation.get("mode") != "agent" or not conversation.get("assigned_agent_id"):
+        return None
+    agent_user = await db.users.find_one(
+        {"id": conversation["assigned_agent_id"]},
+        {"_id": 0, "id": 1, "name": 1, "avatar_url": 1}
+    )
+    if not agent_user:
+        return None
+    return {
+        "id": agent_user.get("id"),
+        "name": agent_user.get("name", "Support Agent"),
+        "avatar_url": agent_user.get("avatar_url")
+    }
+
+
+class MessageStream:
+    """on_token callback publishing an AI reply's text as message_delta events"""
+
+    def __init__(self, hub: "WidgetEventHub", tenant_id: str, conversation_id: str, message_id: str):
+        self.hub = hub
+        self.tenant_id = tenant_id
+        self.conversation_id = conversation_id
+        self.message_id = message_id
+        self._pending: List[str] = []
+        self._flushed_at = 0.0
+
+    async def __call__(self, text: str):
+        self._pending.append(text)
+        if time.monotonic() - self._flushed_at >= STREAM_FLUSH_SECONDS:
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        delta = "".join(self._pending)
+        self._pending = []
+        self._flushed_at = time.monotonic()
+        await self.hub.publish(self.tenant_id, self.conversation_id, {
+            "type": "message_delta",
+            "payload": {"id": self.message_id, "delta": delta}
+        })
+
+
+class WidgetEventHub:
+    """Widget sockets on this worker, grouped by conversation"""
+
+    def __init__(self):
+        # conversation_id -> connections
+        self._connections: Dict[str, Set[WebSocketConnection]] = {}
+        realtime_bus.add_handler("widget", self._deliver_remote)
+
+    def register(self, connection: WebSocketConnection, conversation_id: str):
+        self._connections.setdefault(conversation_id, set()).add(connection)
+        realtime_bus.subscribe(connection.tenant_id)
+
+    def unregister(self, connection: WebSocketConnection, conversation_id: str):
+        connections = self._connections.get(conversation_id)
+        if connections is None or connection not in connections:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self._connections[conversation_id]
+        realtime_bus.unsubscribe(connection.tenant_id)
+
+    async def publish(self, tenant_id: str, conversation_id: str, event: Dict[str, Any]):
+        """Push an event to every widget open on the conversation (on every worker)"""
+        self._deliver(conversation_id, serialize(event))
+        await realtime_bus.publish(tenant_id, {
+            "target": "widget",
+            "conversation_id": conversation_id,
+            "message": event
+        })
+
+    async def publish_message(self, tenant_id: str, message: Dict[str, Any]):
+        await self.publish(tenant_id, message["conversation_id"], {
+            "type": "message",
+            "payload": public_message(message)
+        })
+
+    def message_stream(self, tenant_id: str, conversation_id: str, message_id: str) -> MessageStream:
+        """Stream for an AI reply that will be saved (and published) as message_id"""
+        return MessageStream(self, tenant_id, conversation_id, message_id)
+
+    async def publish_mode(self, tenant_id: str, conversation: Dict[str, Any]):
+        """Announce the conversation's (new) mode and assigned agent"""
+        await self.publish(tenant_id, conversation["id"], {
+            "type": "mode_changed",
+            "payload": {
+                "mode": conversation.get("mode", "ai"),
+                "assigned_agent": await get_assigned_agent_info(conversation)
+            }
+        })
+
+    async def _deliver_remote(self, envelope: Dict[str, Any]):
+        self._deliver(envelope["conversation_id"], serialize(envelope["message"]))
+
+    def _deliver(self, conversation_id: str, data: str):
+        for connection in list(self._connections.get(conversation_id, ())):
+            connection.send(data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "conversations": len(self._connections),
+            "connections": sum(len(c) for c in self._connections.values())
+        }
+
+
+# Global widget event hub instance
+widget_events = WidgetEventHub()
@@ -1,13 +1,25 @@
 """
 WooCommerce REST API Service
 Handles all WooCommerce operations for agents
+
+Requests go through a native async httpx client (no event loop blocking), pooled
+per store so connections and decrypted credentials are reused across calls.
+Order lookups are cached for a short TTL and invalidated after writes.
 """
-from typing import Dict, List, Optional, Any
-from woocommerce import API
+import asyncio
+import base64
+import hashlib
+import hmac
 import logging
-from cryptography.fernet import Fernet
 import os
-import base64
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+from urllib.parse import quote
+
+import httpx
+from cryptography.fernet import Fernet
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +30,14 @@ if isinstance(ENCRYPTION_KEY, str):
     ENCRYPTION_KEY = ENCRYPTION_KEY.encode()
 cipher_suite = Fernet(ENCRYPTION_KEY)
 
+# Client configuration
+API_VERSION = "wc/v3"
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+CONNECTION_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+ORDER_CACHE_TTL_SECONDS = int(os.environ.get("WOOCOMMERCE_CACHE_TTL_SECONDS", "30"))
+ORDER_CACHE_SIZE = 256        # Cached lookups per store
+MAX_POOLED_STORES = 128       # Store clients kept open per process
+
 
 def encrypt_credential(value: str) -> str:
     """Encrypt sensitive credential"""
@@ -42,13 +62,76 @@ class WooCommerceService:
             consumer_secret: Consumer secret from WooCommerce REST API settings
         """
         self.store_url = store_url.rstrip('/')
-        self.wcapi = API(
-            url=self.store_url,
-            consumer_key=consumer_key,
-            consumer_secret=consumer_secret,
-            version="wc/v3",
-            timeout=30
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.api_url = f"{self.store_url}/wp-json/{API_VERSION}/"
+        self.is_ssl = self.store_url.startswith("https")
+        
+        # HTTPS stores use basic auth; plain HTTP stores need OAuth 1.0a signed requests
+        self.client = httpx.AsyncClient(
+            auth=(consumer_key, consumer_secret) if self.is_ssl else None,
+            timeout=REQUEST_TIMEOUT,
+            limits=CONNECTION_LIMITS,
+            headers={"Accept": "application/json", "User-Agent": "WooCommerce-Python-REST-API/3.0.0"}
         )
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+    
+    async def aclose(self):
+        await self.client.aclose()
+    
+    def _oauth_params(self, method: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """One-legged OAuth 1.0a signature (what WooCommerce requires over plain HTTP)"""
+        oauth = dict(params)
+        oauth.update({
+            "oauth_consumer_key": self.consumer_key,
+            "oauth_timestamp": str(int(time.time())),
+            "oauth_nonce": hashlib.sha1(uuid.uuid4().bytes).hexdigest(),
+            "oauth_signature_method": "HMAC-SHA256"
+        })
+        # Same normalization as the official woocommerce client
+        normalize = lambda value: quote(str(value)).replace("%", "%25")
+        query = "%26".join(f"{normalize(k)}%3D{normalize(v)}" for k, v in sorted(oauth.items()))
+        base_string = f"{method.upper()}&{quote(url, safe='')}&{query}"
+        key = f"{self.consumer_secret}&".encode()
+        digest = hmac.new(key, base_string.encode(), hashlib.sha256).digest()
+        oauth["oauth_signature"] = base64.b64encode(digest).decode()
+        return oauth
+    
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        data: Optional[Dict[str, Any]] = None
+    ) -> httpx.Response:
+        url = self.api_url + endpoint
+        params = params or {}
+        if not self.is_ssl:
+            params = self._oauth_params(method, url, params)
+        return await self.client.request(method, url, params=params, json=data)
+    
+    # ---- Short-TTL lookup cache ----
+    
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[Any]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > ORDER_CACHE_TTL_SECONDS:
+            del self._cache[key]
+            return None
+        return entry[1]
+    
+    def _cache_set(self, key: Tuple[str, str], value: Any):
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > ORDER_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    def invalidate_order(self, order_id: Any):
+        """Drop cached data for an order (and email searches, which embed order state)"""
+        self._cache.pop(("order", str(order_id)), None)
+        for key in [k for k in self._cache if k[0] == "orders_by_email"]:
+            del self._cache[key]
     
     async def test_connection(self) -> Dict[str, Any]:
         """
@@ -58,7 +141,7 @@ class WooCommerceService:
             Dict with success status and message
         """
         try:
-            response = self.wcapi.get("system_status")
+            response = await self._request("GET", "system_status")
             if response.status_code == 200:
                 return {
                     "success": True,
@@ -86,11 +169,16 @@ class WooCommerceService:
         Returns:
             List of orders
         """
+        cache_key = ("orders_by_email", email.strip().lower())
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            response = self.wcapi.get("orders", params={"customer": email, "per_page": 50})
+            response = await self._request("GET", "orders", params={"customer": email, "per_page": 50})
             if response.status_code == 200:
                 orders = response.json()
-                return [{
+                result = [{
                     "id": order["id"],
                     "order_number": order["number"],
                     "status": order["status"],
@@ -107,6 +195,8 @@ class WooCommerceService:
                         } for item in order["line_items"]
                     ]
                 } for order in orders]
+                self._cache_set(cache_key, result)
+                return result
             else:
                 logger.error(f"Failed to search orders: {response.status_code}")
                 return []
@@ -124,11 +214,16 @@ class WooCommerceService:
         Returns:
             Order details or None if not found
         """
+        cache_key = ("order", str(order_id))
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            response = self.wcapi.get(f"orders/{order_id}")
+            response = await self._request("GET", f"orders/{order_id}")
             if response.status_code == 200:
                 order = response.json()
-                return {
+                result = {
                     "id": order["id"],
                     "order_number": order["number"],
                     "status": order["status"],
@@ -142,6 +237,8 @@ class WooCommerceService:
                     "shipping_lines": order["shipping_lines"],
                     "customer_note": order.get("customer_note", "")
                 }
+                self._cache_set(cache_key, result)
+                return result
             else:
                 logger.error(f"Order {order_id} not found: {response.status_code}")
                 return None
@@ -149,6 +246,46 @@ class WooCommerceService:
             logger.error(f"Error getting order details: {str(e)}")
             return None
     
+    async def get_orders_details(self, order_ids: Iterable[int]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Get details for several orders concurrently
+        
+        Returns:
+            {order_id: order details or None if not found}
+        """
+        order_ids = list(dict.fromkeys(order_ids))
+        results = await asyncio.gather(*(self.get_order_details(order_id) for order_id in order_ids))
+        return dict(zip(order_ids, results))
+    
+    async def get_order(self, order_id: Any) -> Optional[Dict[str, Any]]:
+        """Alias used by orchestrator child actions"""
+        return await self.get_order_details(int(order_id))
+    
+    async def list_orders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """List the most recent orders"""
+        response = await self._request("GET", "orders", params={"per_page": min(int(limit), 100)})
+        response.raise_for_status()
+        return [{
+            "id": order["id"],
+            "order_number": order["number"],
+            "status": order["status"],
+            "date_created": order["date_created"],
+            "total": order["total"],
+            "currency": order["currency"]
+        } for order in response.json()]
+    
+    async def list_products(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """List products"""
+        response = await self._request("GET", "products", params={"per_page": min(int(limit), 100)})
+        response.raise_for_status()
+        return [{
+            "id": product["id"],
+            "name": product["name"],
+            "price": product.get("price"),
+            "stock_status": product.get("stock_status"),
+            "permalink": product.get("permalink")
+        } for product in response.json()]
+    
     async def create_refund(
         self, 
         order_id: int, 
@@ -171,8 +308,9 @@ class WooCommerceService:
             if amount:
                 refund_data["amount"] = amount
             
-            response = self.wcapi.post(f"orders/{order_id}/refunds", refund_data)
+            response = await self._request("POST", f"orders/{order_id}/refunds", data=refund_data)
             if response.status_code == 201:
+                self.invalidate_order(order_id)
                 refund = response.json()
                 return {
                     "success": True,
@@ -206,8 +344,9 @@ class WooCommerceService:
             Dict with success status
         """
         try:
-            response = self.wcapi.put(f"orders/{order_id}", {"status": status})
+            response = await self._request("PUT", f"orders/{order_id}", data={"status": status})
             if response.status_code == 200:
+                self.invalidate_order(order_id)
                 return {
                     "success": True,
                     "message": f"Order status updated to {status}"
@@ -225,29 +364,56 @@ class WooCommerceService:
             }
 
 
+# Pooled clients: (store_url, encrypted key, encrypted secret) -> WooCommerceService
+_clients: "OrderedDict[Tuple[str, str, str], WooCommerceService]" = OrderedDict()
+
+
 def get_woocommerce_client(config: Dict[str, Any]) -> Optional[WooCommerceService]:
     """
-    Create WooCommerce client from encrypted config
+    Get the pooled WooCommerce client for an encrypted config
     
     Args:
-        config: Agent config containing WooCommerce credentials
+        config: Agent config containing WooCommerce credentials (the agent
+            document itself is accepted too)
         
     Returns:
         WooCommerceService instance or None if not configured
     """
     try:
-        wc_config = config.get("woocommerce", {})
+        wc_config = config.get("woocommerce") or config.get("config", {}).get("woocommerce", {})
         if not wc_config.get("enabled"):
             return None
         
         store_url = wc_config.get("store_url")
-        consumer_key = decrypt_credential(wc_config.get("consumer_key_encrypted", ""))
-        consumer_secret = decrypt_credential(wc_config.get("consumer_secret_encrypted", ""))
+        key = (
+            store_url,
+            wc_config.get("consumer_key_encrypted", ""),
+            wc_config.get("consumer_secret_encrypted", "")
+        )
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        
+        consumer_key = decrypt_credential(key[1])
+        consumer_secret = decrypt_credential(key[2])
         
         if not all([store_url, consumer_key, consumer_secret]):
             return None
         
-        return WooCommerceService(store_url, consumer_key, consumer_secret)
+        client = WooCommerceService(store_url, consumer_key, consumer_secret)
+        _clients[key] = client
+        if len(_clients) > MAX_POOLED_STORES:
+            _, evicted = _clients.popitem(last=False)
+            asyncio.get_running_loop().create_task(evicted.aclose())
+        return client
     except Exception as e:
         logger.error(f"Error creating WooCommerce client: {str(e)}")
         return None
+
+
+async def close_woocommerce_clients():
+    """Close every pooled store client (application shutdown)"""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
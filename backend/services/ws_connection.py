@@ -0,0 +1,148 @@
+"""
+WebSocket Connection - Per-connection bounded send queue with its own writer
+
+Broadcasting used to await ``send_json`` on each socket in turn, so one slow
+client delayed every other recipient. Each connection now has a bounded
+outbound queue drained by a dedicated writer task: enqueueing never blocks,
+payloads are serialized once per broadcast and shared by all recipients, and
+a client whose queue overflows (or whose send fails) is disconnected.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+SEND_TIMEOUT_SECONDS = 10.0  # A single frame taking longer marks the client dead
+LATENCY_SAMPLE_SIZE = 1000
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try again later": client should reconnect and resync
+
+
+def serialize(message: Dict[str, Any]) -> str:
+    """Serialize an event once so it can be queued for many connections"""
+    return json.dumps(message, default=str)
+
+
+class WebSocketMetrics:
+    """Process-wide send metrics for all connections"""
+
+    def __init__(self):
+        self.counters = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "frames_sent": 0,
+            "dropped_slow_consumers": 0,
+            "send_errors": 0
+        }
+        self.latency: Deque[float] = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self.max_queue_depth = 0
+
+    def record_send(self, latency_ms: float):
+        self.counters["frames_sent"] += 1
+        self.latency.append(latency_ms)
+
+    def _percentile(self, percentile: float) -> Optional[float]:
+        if not self.latency:
+            return None
+        ordered = sorted(self.latency)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile))], 2)
+
+    def get_stats(self, connections: Dict[str, "WebSocketConnection"]) -> Dict[str, Any]:
+        depths = [conn.queue.qsize() for conn in connections.values()]
+        return {
+            "open_connections": len(depths),
+            "queue_capacity": SEND_QUEUE_SIZE,
+            "queued_frames": sum(depths),
+            "max_queue_depth_now": max(depths) if depths else 0,
+            "max_queue_depth_seen": self.max_queue_depth,
+            "send_latency_p50_ms": self._percentile(0.50),
+            "send_latency_p95_ms": self._percentile(0.95),
+            "send_latency_p99_ms": self._percentile(0.99),
+            **self.counters
+        }
+
+
+ws_metrics = WebSocketMetrics()
+
+
+class WebSocketConnection:
+    """One client socket with a bounded outbound queue"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        connection_id: str,
+        tenant_id: str,
+        user_id: str,
+        on_close: Optional[Callable[["WebSocketConnection"], None]] = None
+    ):
+        self.websocket = websocket
+        self.id = connection_id
+        self.tenant_id = tenant_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.closed = False
+        self._on_close = on_close
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        ws_metrics.counters["connections_opened"] += 1
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, data: str) -> bool:
+        """Queue a serialized frame without waiting; False if the client was dropped"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((data, time.monotonic()))
+        except asyncio.QueueFull:
+            ws_metrics.counters["dropped_slow_consumers"] += 1
+            logger.warning(f"Dropping slow WebSocket consumer {self.user_id} ({SEND_QUEUE_SIZE} frames queued)")
+            self.close(SLOW_CONSUMER_CLOSE_CODE)
+            return False
+        depth = self.queue.qsize()
+        if depth > ws_metrics.max_queue_depth:
+            ws_metrics.max_queue_depth = depth
+        return True
+
+    def send_json(self, message: Dict[str, Any]) -> bool:
+        return self.send(serialize(message))
+
+    async def _write_loop(self):
+        try:
+            while True:
+                data, queued_at = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(data), SEND_TIMEOUT_SECONDS)
+                ws_metrics.record_send((time.monotonic() - queued_at) * 1000)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            ws_metrics.counters["send_errors"] += 1
+            logger.info(f"WebSocket send to {self.user_id} failed, closing: {str(e)}")
+            self.close()
+
+    def close(self, code: int = 1000):
+        """Stop the writer, close the socket and unregister (idempotent)"""
+        if self.closed:
+            return
+        self.closed = True
+        ws_metrics.counters["connections_closed"] += 1
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if self._on_close:
+            self._on_close(self)
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
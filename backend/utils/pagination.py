@@ -0,0 +1,53 @@
+"""
+Keyset pagination on (created_at, id)
+
+Paging with ``created_at < before`` skips or repeats messages that share a
+timestamp. Pages are instead keyed on the ``(created_at, id)`` pair, which is
+unique, and the position is handed to clients as an opaque cursor.
+"""
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just past a document"""
+    raw = json.dumps([document.get("created_at"), document.get("id")], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """(created_at, id) of a cursor; ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(doc_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, doc_id
+
+
+def older_than(cursor: str) -> Dict[str, Any]:
+    """Filter for documents before the cursor in (created_at, id) descending order"""
+    created_at, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}}
+    ]}
+
+
+def newer_than(created_at: str, doc_id: str) -> Dict[str, Any]:
+    """Filter for documents after (created_at, id), e.g. to poll for new messages"""
+    return {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "id": {"$gt": doc_id}}
+    ]}
+
+
+def page(documents: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Split ``limit + 1`` fetched documents into the page and the next cursor"""
+    if len(documents) > limit:
+        documents = documents[:limit]
+        return documents, encode_cursor(documents[-1])
+    return documents, None
@@ -23,6 +23,7 @@
   let settings = null;
   let agentInfo = null;
   let lastMessageId = null;
+  let lastMessageAt = null;
   let messageHistory = [];
   let pollInterval = null;
   let currentMode = 'ai';
@@ -36,7 +37,8 @@
         sessionToken,
         conversationId,
         messageHistory,
-        lastMessageId
+        lastMessageId,
+        lastMessageAt
       };
       sessionStorage.setItem(STORAGE_KEY, JSON.stringify(state));
     } catch (e) {
@@ -54,6 +56,7 @@
         conversationId = state.conversationId || null;
         messageHistory = state.messageHistory || [];
         lastMessageId = state.lastMessageId || null;
+        lastMessageAt = state.lastMessageAt || null;
         return true;
       }
     } catch (e) {
@@ -491,9 +494,9 @@
       });
     }
 
-    // Start polling for new messages if we have a conversation
+    // Start live updates if we have a conversation
     if (conversationId && sessionToken) {
-      startPolling();
+      startUpdates();
     }
   }
 
@@ -508,15 +511,15 @@
       if (bubble) bubble.classList.add('hidden'); // Hide bubble on mobile when open
       const input = document.getElementById('emergent-chat-input');
       if (input) input.focus();
-      // Start polling when chat opens and we have a conversation
+      // Start live updates when chat opens and we have a conversation
       if (conversationId && sessionToken) {
-        startPolling();
+        startUpdates();
       }
     } else {
       chatWindow.classList.remove('open');
       if (bubble) bubble.classList.remove('hidden'); // Show bubble when closed
-      // Stop polling when chat closes
-      stopPolling();
+      // Stop live updates when chat closes
+      stopUpdates();
     }
     saveState();
   }
@@ -565,83 +568,216 @@
     }
   }
 
-  function startPolling() {
-    if (pollInterval) return; // Already polling
+  // Live updates: a WebSocket pushes new messages and agent changes as they
+  // happen. While it is down we poll instead, and every (re)connect or poll
+  // only fetches messages newer than the last one we have. AI replies stream
+  // into a draft bubble that the saved message then takes over.
+  let realtimeSocket = null;
+  let streamingDrafts = {}; // message id -> { bubble, content }
+  let reconnectTimer = null;
+  let reconnectDelay = 1000;
+  let pingInterval = null;
+
+  function applyMode(mode, agent) {
+    // Check if mode or assigned agent changed
+    if (mode && mode !== currentMode) {
+      currentMode = mode;
+      // Both 'agent' and 'assisted' modes show the human agent
+      if ((mode === 'agent' || mode === 'assisted') && agent) {
+        updateHeader(agent);
+      } else if (mode === 'ai') {
+        updateHeader(null);
+      }
+    } else if ((mode === 'agent' || mode === 'assisted') && agent) {
+      // Check if agent changed
+      if (!assignedAgent || assignedAgent.id !== agent.id) {
+        updateHeader(agent);
+      }
+    }
+  }
+
+  function applyMessage(msg) {
+    // Map author_type to display type
+    let type;
+    if (msg.author_type === 'customer') {
+      type = 'customer';
+    } else if (msg.author_type === 'system') {
+      type = 'system';
+    } else {
+      // ai, agent, or any other type shows as 'ai' (left side)
+      type = 'ai';
+    }
     
-    pollInterval = setInterval(async () => {
-      if (!conversationId || !sessionToken) return;
-      
-      try {
-        const response = await fetch(`${apiUrl}/widget/messages/${conversationId}?token=${sessionToken}`);
-        if (response.ok) {
-          const data = await response.json();
-          
-          // Check if mode or assigned agent changed
-          if (data.mode && data.mode !== currentMode) {
-            currentMode = data.mode;
-            // Both 'agent' and 'assisted' modes show the human agent
-            if ((data.mode === 'agent' || data.mode === 'assisted') && data.assigned_agent) {
-              updateHeader(data.assigned_agent);
-            } else if (data.mode === 'ai') {
-              updateHeader(null);
-            }
-          } else if ((data.mode === 'agent' || data.mode === 'assisted') && data.assigned_agent) {
-            // Check if agent changed
-            if (!assignedAgent || assignedAgent.id !== data.assigned_agent.id) {
-              updateHeader(data.assigned_agent);
-            }
-          }
-          
-          if (data.messages && Array.isArray(data.messages)) {
-            // Find messages we don't have yet
-            data.messages.forEach(msg => {
-              // Map author_type to display type
-              let type;
-              if (msg.author_type === 'customer') {
-                type = 'customer';
-              } else if (msg.author_type === 'system') {
-                type = 'system';
-              } else {
-                // ai, agent, or any other type shows as 'ai' (left side)
-                type = 'ai';
-              }
-              
-              // Check by ID first
-              const existsById = messageHistory.some(m => m.id === msg.id);
-              
-              // Also check by content and type to catch temp ID mismatches
-              const existsByContent = messageHistory.some(m => 
-                m.content === msg.content && m.type === type
-              );
-              
-              if (!existsById && !existsByContent) {
-                // Truly new message (likely from human agent or system)
-                addMessageToUI(msg.content, type, msg.created_at, true);
-                messageHistory.push({
-                  id: msg.id,
-                  content: msg.content,
-                  type: type,
-                  timestamp: msg.created_at
-                });
-                saveState();
-              } else if (!existsById && existsByContent) {
-                // Same content exists with temp ID - update to real ID
-                const tempMsg = messageHistory.find(m => 
-                  m.content === msg.content && m.type === type && 
-                  (m.id.startsWith('temp_') || m.id.startsWith('ai_'))
-                );
-                if (tempMsg) {
-                  tempMsg.id = msg.id;
-                  saveState();
-                }
-              }
-            });
-          }
+    // Remember the newest message so reconnects only fetch what came after it
+    if (msg.created_at && (!lastMessageAt || msg.created_at >= lastMessageAt)) {
+      lastMessageId = msg.id;
+      lastMessageAt = msg.created_at;
+    }
+    
+    // An AI reply that was streaming: its draft bubble becomes the message
+    const draft = streamingDrafts[msg.id];
+    if (draft) {
+      delete streamingDrafts[msg.id];
+      if (!messageHistory.some(m => m.id === msg.id)) {
+        draft.bubble.innerHTML = sanitizeHTML(msg.content);
+        messageHistory.push({
+          id: msg.id,
+          content: msg.content,
+          type: type,
+          timestamp: msg.created_at
+        });
+      }
+      saveState();
+      return;
+    }
+    
+    // Check by ID first
+    const existsById = messageHistory.some(m => m.id === msg.id);
+    
+    // Also check by content and type to catch temp ID mismatches
+    const existsByContent = messageHistory.some(m => 
+      m.content === msg.content && m.type === type
+    );
+    
+    if (!existsById && !existsByContent) {
+      // Truly new message (likely from human agent or system)
+      addMessageToUI(msg.content, type, msg.created_at, true);
+      messageHistory.push({
+        id: msg.id,
+        content: msg.content,
+        type: type,
+        timestamp: msg.created_at
+      });
+    } else if (!existsById && existsByContent) {
+      // Same content exists with temp ID - update to real ID
+      const tempMsg = messageHistory.find(m => 
+        m.content === msg.content && m.type === type && 
+        (m.id.startsWith('temp_') || m.id.startsWith('ai_'))
+      );
+      if (tempMsg) {
+        tempMsg.id = msg.id;
+      }
+    }
+    saveState();
+  }
+
+  function applyMessageDelta(delta) {
+    if (messageHistory.some(m => m.id === delta.id)) return; // Already complete
+    let draft = streamingDrafts[delta.id];
+    if (!draft) {
+      hideTypingIndicator();
+      const messageDiv = addMessageToUI('', 'ai', null, false);
+      draft = { bubble: messageDiv.querySelector('.chat-message-content'), content: '' };
+      streamingDrafts[delta.id] = draft;
+    }
+    draft.content += delta.delta;
+    draft.bubble.innerHTML = sanitizeHTML(draft.content);
+    const messagesContainer = document.getElementById('emergent-chat-messages');
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  }
+
+  async function fetchNewMessages() {
+    if (!conversationId || !sessionToken) return;
+    
+    try {
+      const since = lastMessageId ? `&since=${encodeURIComponent(lastMessageId)}` : '';
+      const response = await fetch(`${apiUrl}/widget/messages/${conversationId}?token=${sessionToken}${since}`);
+      if (response.ok) {
+        const data = await response.json();
+        applyMode(data.mode, data.assigned_agent);
+        if (data.messages && Array.isArray(data.messages)) {
+          data.messages.forEach(applyMessage);
         }
-      } catch (error) {
-        console.error('Polling error:', error);
       }
-    }, 3000); // Poll every 3 seconds
+    } catch (error) {
+      console.error('Polling error:', error);
+    }
+  }
+
+  function connectRealtime() {
+    if (realtimeSocket || !conversationId || !sessionToken) return;
+    if (!('WebSocket' in window)) {
+      startPolling();
+      return;
+    }
+    
+    const wsUrl = new URL(`${apiUrl}/widget/ws/${conversationId}`, window.location.href);
+    wsUrl.protocol = wsUrl.protocol === 'https:' ? 'wss:' : 'ws:';
+    wsUrl.searchParams.set('token', sessionToken);
+    
+    const socket = new WebSocket(wsUrl.toString());
+    realtimeSocket = socket;
+    
+    socket.onopen = () => {
+      reconnectDelay = 1000;
+      stopPolling();
+      // Catch up on anything sent while we were disconnected
+      fetchNewMessages();
+      pingInterval = setInterval(() => {
+        if (socket.readyState === WebSocket.OPEN) {
+          socket.send(JSON.stringify({ type: 'ping' }));
+        }
+      }, 25000);
+    };
+    
+    socket.onmessage = (event) => {
+      let data;
+      try {
+        data = JSON.parse(event.data);
+      } catch (e) {
+        return;
+      }
+      if (data.type === 'message' && data.payload) {
+        applyMessage(data.payload);
+      } else if (data.type === 'message_delta' && data.payload) {
+        applyMessageDelta(data.payload);
+      } else if (data.type === 'mode_changed' && data.payload) {
+        applyMode(data.payload.mode, data.payload.assigned_agent);
+      }
+    };
+    
+    socket.onclose = () => {
+      if (realtimeSocket !== socket) return; // Closed on purpose
+      realtimeSocket = null;
+      clearInterval(pingInterval);
+      pingInterval = null;
+      // Poll until the socket is back, reconnecting with backoff
+      startPolling();
+      reconnectTimer = setTimeout(() => {
+        reconnectTimer = null;
+        connectRealtime();
+      }, reconnectDelay);
+      reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+    };
+  }
+
+  function startUpdates() {
+    if (!conversationId || !sessionToken) return;
+    if (reconnectTimer) {
+      clearTimeout(reconnectTimer);
+      reconnectTimer = null;
+    }
+    connectRealtime();
+  }
+
+  function stopUpdates() {
+    if (reconnectTimer) {
+      clearTimeout(reconnectTimer);
+      reconnectTimer = null;
+    }
+    clearInterval(pingInterval);
+    pingInterval = null;
+    if (realtimeSocket) {
+      const socket = realtimeSocket;
+      realtimeSocket = null;
+      socket.close();
+    }
+    stopPolling();
+  }
+
+  function startPolling() {
+    if (pollInterval) return; // Already polling
+    pollInterval = setInterval(fetchNewMessages, 3000); // Poll every 3 seconds
   }
 
   function stopPolling() {
@@ -690,9 +826,7 @@
     // Disable input while sending
     input.disabled = true;
     document.getElementById('emergent-chat-send').disabled = true;
-    
-    // Pause polling while sending to prevent duplicates
-    stopPolling();
+
 
     // Generate a temporary ID for the customer message
     const tempMsgId = `temp_${Date.now()}`;
@@ -767,16 +901,9 @@
       }
       
       // Display AI response if available
+      // (it may already have arrived over the realtime socket)
       if (data.ai_message) {
-        const aiMsg = {
-          id: data.ai_message.id || `ai_${Date.now()}`,
-          content: data.ai_message.content,
-          type: 'ai',
-          timestamp: data.ai_message.created_at
-        };
-        addMessageToUI(aiMsg.content, 'ai', aiMsg.timestamp, false);
-        messageHistory.push(aiMsg);
-        saveState();
+        applyMessage(data.ai_message);
       } else {
         console.error('No AI message in response:', data);
         addMessageToUI('Sorry, no response was generated. Please try again.', 'ai', null, false);
@@ -790,9 +917,9 @@
       document.getElementById('emergent-chat-send').disabled = false;
       input.focus();
       
-      // Resume polling after message is sent
+      // Start live updates once the first message created the conversation
       if (conversationId && sessionToken) {
-        startPolling();
+        startUpdates();
       }
     }
   }
@@ -848,6 +975,7 @@
     if (shouldScroll) {
       messagesContainer.scrollTop = messagesContainer.scrollHeight;
     }
+    return messageDiv;
   }
 
   // Initialize widget
@@ -59,6 +59,18 @@ import { toast } from 'sonner';
 import { cn } from '../lib/utils';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const MESSAGE_PAGE_SIZE = 100;
+
+// Add messages not seen yet, keeping (created_at, id) order
+const mergeMessages = (prev, incoming) => {
+  const known = new Set(prev.map((m) => m.id));
+  const fresh = incoming.filter((m) => !known.has(m.id));
+  if (fresh.length === 0) return prev;
+  return [...prev, ...fresh].sort((a, b) => {
+    if (a.created_at !== b.created_at) return a.created_at < b.created_at ? -1 : 1;
+    return a.id < b.id ? -1 : 1;
+  });
+};
 
 // Move ConversationsList outside to avoid nested component definition
 const ConversationsList = ({ conversations, id, navigate, setSidebarOpen }) => (
@@ -105,6 +117,8 @@ const ConversationDetail = () => {
   const navigate = useNavigate();
   const [conversation, setConversation] = useState(null);
   const [messages, setMessages] = useState([]);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
@@ -222,15 +236,21 @@ const ConversationDetail = () => {
     }
   }, [id, token, analyzingSentiment]);
 
-  // Main data fetch effect
+  // Main data fetch effect: the newest page first, then polls for newer messages only
+  // so pages loaded with "Load earlier messages" stay on screen
   useEffect(() => {
-    const fetchData = async () => {
+    let lastFetchedId = null; // Newest message received from the server
+    
+    const fetchData = async (initial = false) => {
       try {
+        const messageParams = { limit: MESSAGE_PAGE_SIZE };
+        if (!initial && lastFetchedId) messageParams.after = lastFetchedId;
         const [convRes, msgsRes, convsRes] = await Promise.all([
           axios.get(`${API}/conversations/${id}`, {
             headers: { Authorization: `Bearer ${token}` }
           }),
           axios.get(`${API}/conversations/${id}/messages`, {
+            params: messageParams,
             headers: { Authorization: `Bearer ${token}` }
           }),
           axios.get(`${API}/conversations`, {
@@ -238,7 +258,15 @@ const ConversationDetail = () => {
           })
         ]);
         setConversation(convRes.data);
-        setMessages(msgsRes.data);
+        if (initial) {
+          setMessages(msgsRes.data);
+          setOlderCursor(msgsRes.headers['x-next-cursor'] || null);
+        } else {
+          setMessages(prev => mergeMessages(prev, msgsRes.data));
+        }
+        if (msgsRes.data.length > 0) {
+          lastFetchedId = msgsRes.data[msgsRes.data.length - 1].id;
+        }
         setConversations(convsRes.data);
         
         // Fetch CRM link status
@@ -250,8 +278,8 @@ const ConversationDetail = () => {
       }
     };
 
-    fetchData();
-    const interval = setInterval(fetchData, 5000);
+    fetchData(true);
+    const interval = setInterval(() => fetchData(), 5000);
     return () => clearInterval(interval);
   }, [id, token, fetchCrmStatus]);
   
@@ -273,6 +301,42 @@ const ConversationDetail = () => {
     }
   }, [messages, conversation?.mode, fetchSuggestions]);
 
+  // Suggestions precomputed by the server are pushed over the messaging socket
+  useEffect(() => {
+    if (!token || !id) return;
+
+    let ws = null;
+    let reconnectTimeout = null;
+    let closed = false;
+
+    const connect = () => {
+      ws = new WebSocket(API.replace('http', 'ws') + `/messaging/ws?token=${token}`);
+      ws.onmessage = (event) => {
+        let data;
+        try {
+          data = JSON.parse(event.data);
+        } catch {
+          return;
+        }
+        if (data.type === 'suggestions_ready' && data.payload?.conversation_id === id) {
+          setSuggestions(data.payload.suggestions || []);
+          setLoadingSuggestions(false);
+        }
+      };
+      ws.onclose = () => {
+        if (!closed) reconnectTimeout = setTimeout(connect, 5000);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      if (reconnectTimeout) clearTimeout(reconnectTimeout);
+      if (ws) ws.close();
+    };
+  }, [id, token]);
+
   // Analyze sentiment when messages change
   useEffect(() => {
     if (messages.length > 0) {
@@ -302,6 +366,23 @@ const ConversationDetail = () => {
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const response = await axios.get(`${API}/conversations/${id}/messages`, {
+        params: { cursor: olderCursor, limit: MESSAGE_PAGE_SIZE },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setMessages(prev => [...response.data, ...prev]);
+      setOlderCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Failed to load earlier messages');
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleSendMessage = async (e) => {
     e.preventDefault();
     if (!newMessage.trim() || sending) return;
@@ -315,7 +396,7 @@ const ConversationDetail = () => {
         { content: newMessage, author_type: 'agent' },
         { headers: { Authorization: `Bearer ${token}` } }
       );
-      setMessages([...messages, response.data]);
+      setMessages(prev => mergeMessages(prev, [response.data]));
       setNewMessage('');
       toast.success('Message sent');
     } catch (error) {
@@ -540,6 +621,18 @@ const ConversationDetail = () => {
                 <div className="p-4 overflow-hidden">
                   {messages.length > 0 ? (
                     <div className="space-y-4">
+                      {olderCursor && (
+                        <div className="flex justify-center">
+                          <Button variant="ghost" size="sm" onClick={loadOlderMessages} disabled={loadingOlder}>
+                            {loadingOlder ? (
+                              <Loader2 className="h-4 w-4 mr-2 animate-spin" />
+                            ) : (
+                              <ChevronUp className="h-4 w-4 mr-2" />
+                            )}
+                            Load earlier messages
+                          </Button>
+                        </div>
+                      )}
                       {messages.map((message) => (
                         <MessageBubble key={message.id} message={message} />
                       ))}
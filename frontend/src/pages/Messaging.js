@@ -730,6 +730,19 @@ const Messaging = () => {
             ));
             break;
             
+          case 'presence_batch': {
+            const statuses = {};
+            data.payload.changes.forEach(change => {
+              statuses[change.user_id] = change;
+            });
+            setUsers(prev => prev.map(u => 
+              statuses[u.id]
+                ? { ...u, is_online: statuses[u.id].status === 'online', last_seen: statuses[u.id].last_seen }
+                : u
+            ));
+            break;
+          }
+            
           case 'channel_update':
             fetchChannels();
             break;